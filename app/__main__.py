@@ -0,0 +1,41 @@
+"""
+Punto de entrada por rol
+
+    python -m app api [--host 0.0.0.0] [--port 8000] [--workers 1]
+    python -m app bot
+    python -m app dispatcher
+
+Cada rol puede correr en su propio proceso. Al separar el bot y el
+despachador, desactivarlos en la API con EJECUTAR_BOT_EN_API=false y
+EJECUTAR_DESPACHADOR_EN_API=false.
+"""
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app", description="SpeedyFoodBot")
+    roles = parser.add_subparsers(dest="rol", required=True)
+
+    api = roles.add_parser("api", help="API FastAPI (uvicorn)")
+    api.add_argument("--host", default="0.0.0.0")
+    api.add_argument("--port", type=int, default=8000)
+    api.add_argument("--workers", type=int, default=1)
+
+    roles.add_parser("bot", help="Bot de Telegram (polling)")
+    roles.add_parser("dispatcher", help="Despachador de asignaciones (con elección de líder)")
+
+    args = parser.parse_args()
+
+    if args.rol == "api":
+        import uvicorn
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+    elif args.rol == "bot":
+        from app.bot.bot import run_bot
+        run_bot()
+    else:
+        from app.dispatcher import run_dispatcher
+        run_dispatcher()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,12 @@ from telegram.ext import (
     filters
 )
 from app.config import get_settings
+from app.database import async_engine
+from app.services.despacho_service import despachador
+from app.services.eventos_pedido import relay_eventos
+from app.bot.notificaciones import notificador_clientes
+from app.bot.limitador import LimitadorEnvios
+from app.bot.procesador import ProcesadorPorChat
 from app.bot.handlers import (
     start_command,
     menu_command,
@@ -21,6 +27,10 @@ from app.bot.handlers import (
 )
 
 
+# Conexiones HTTP a la API de Telegram (el limitador deja pasar ~30 envíos/s)
+CONEXIONES_HTTP_TELEGRAM = 32
+
+
 def create_bot_application() -> Application:
     """
     Crea y configura la aplicación del bot
@@ -28,7 +38,19 @@ def create_bot_application() -> Application:
     settings = get_settings()
     
     # Crear la aplicación
-    application = Application.builder().token(settings.token_telegram).build()
+    # Todos los envíos pasan por el limitador (límites de Telegram y prioridades)
+    application = (
+        Application.builder()
+        .token(settings.token_telegram)
+        .base_url(settings.telegram_api_url)
+        .rate_limiter(LimitadorEnvios())
+        .concurrent_updates(ProcesadorPorChat(settings.bot_updates_concurrentes))
+        # Por defecto el bot usa una sola conexión HTTP: con updates en
+        # paralelo todas las respuestas harían fila en ella
+        .connection_pool_size(CONEXIONES_HTTP_TELEGRAM)
+        .pool_timeout(10.0)
+        .build()
+    )
     
     # Registrar handlers de comandos
     application.add_handler(CommandHandler("start", start_command))
@@ -59,12 +81,33 @@ def create_bot_application() -> Application:
     return application
 
 
+async def _iniciar_proceso_bot(application: Application):
+    """Al arrancar el bot como proceso propio: publicar eventos al despachador"""
+    await despachador.iniciar_publicacion()
+    relay_eventos.iniciar()
+    notificador_clientes.iniciar(application)
+
+
+async def _detener_proceso_bot(application: Application):
+    await notificador_clientes.detener()
+    await relay_eventos.detener()
+    await despachador.detener_publicacion()
+    await async_engine.dispose()
+
+
 def run_bot():
     """
-    Ejecuta el bot en modo polling
+    Ejecuta el bot en modo polling como proceso independiente
+    (python -m app bot, con EJECUTAR_BOT_EN_API=false en la API)
     """
+    if get_settings().telegram_modo == "webhook":
+        print("⚠️ TELEGRAM_MODO=webhook: los updates los recibe la API (python -m app api)")
+        return
+    
     print("🤖 Iniciando SpeedyFoodBot...")
     application = create_bot_application()
+    application.post_init = _iniciar_proceso_bot
+    application.post_shutdown = _detener_proceso_bot
     
     print("✅ Bot configurado correctamente")
     print("📡 Escuchando mensajes...")
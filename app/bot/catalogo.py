@@ -0,0 +1,195 @@
+"""
+Catálogo del menú en memoria para el bot
+Navegar el menú (categorías, páginas de productos, vista de un producto) se
+responde con una copia del catálogo cargada una sola vez, con los teclados
+ya armados: tocar botones no consulta Postgres.
+
+La copia se marca como vieja cuando llega el NOTIFY de CANAL_CATALOGO (los
+routers de /productos y /categorias lo envían con su commit) y se vuelve a
+cargar en la siguiente consulta. Cada carga es una versión nueva; las copias
+no se modifican, así un handler que ya tomó una sigue viendo datos coherentes.
+
+Las fotos de los productos se envían por URL una sola vez: el file_id que
+devuelve Telegram se guarda en producto.img_file_id y se reutiliza.
+"""
+import asyncio
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import select, update
+from app.bot.keyboards import get_categorias_keyboard
+from app.database import AsyncSessionLocal
+from app.models import Categoria, Producto
+from app.services.catalogo_service import CANAL_CATALOGO
+from app.services.eventos_pedido import relay_eventos
+
+
+# Productos por página en la lista de una categoría
+PRODUCTOS_POR_PAGINA = 5
+
+
+class PaginaCategoria:
+    """Mensaje y botones (sin la fila del carrito) de una página de productos"""
+
+    def __init__(self, texto: str, filas: tuple):
+        self.texto = texto
+        self.filas = filas
+
+
+class VersionCatalogo:
+    """
+    Copia inmutable del catálogo. Los productos son filas del ORM ya
+    desconectadas de la sesión: solo lectura.
+    """
+
+    def __init__(self, version: int, categorias: list, productos: list):
+        self.version = version
+        self.categorias = categorias
+        self.categoria = {cat.codigo_categoria: cat for cat in categorias}
+        self.producto = {prod.codigo_producto: prod for prod in productos}
+        self.productos_categoria: dict[str, list] = {cat.codigo_categoria: [] for cat in categorias}
+        for prod in productos:
+            self.productos_categoria.setdefault(prod.codigo_categoria, []).append(prod)
+
+        self.teclado_categorias = get_categorias_keyboard(categorias)
+        # codigo_categoria -> páginas
+        self.paginas: dict[str, list[PaginaCategoria]] = {
+            cat.codigo_categoria: self._armar_paginas(cat, self.productos_categoria[cat.codigo_categoria])
+            for cat in categorias
+        }
+
+    @staticmethod
+    def _armar_paginas(categoria, productos: list) -> list[PaginaCategoria]:
+        total_paginas = (len(productos) + PRODUCTOS_POR_PAGINA - 1) // PRODUCTOS_POR_PAGINA
+        paginas = []
+        for pagina in range(total_paginas):
+            inicio = pagina * PRODUCTOS_POR_PAGINA
+
+            texto = f"🍽️ *{categoria.nombre.upper()}*\n"
+            texto += f"━━━━━━━━━━━━━━━━━\n"
+            if total_paginas > 1:
+                texto += f"📄 Página {pagina + 1}/{total_paginas}\n"
+            texto += "\n_Selecciona un producto:_"
+
+            # Un producto por fila con nombre completo y precio
+            filas = [
+                (InlineKeyboardButton(
+                    f"🍔 {prod.nombre} - Bs.{prod.precio}",
+                    callback_data=f"ver_prod_{prod.codigo_producto}"
+                ),)
+                for prod in productos[inicio:inicio + PRODUCTOS_POR_PAGINA]
+            ]
+            nav_row = []
+            codigo_cat = categoria.codigo_categoria
+            if pagina > 0:
+                nav_row.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"categoria_{codigo_cat}_{pagina-1}"))
+            if pagina < total_paginas - 1:
+                nav_row.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"categoria_{codigo_cat}_{pagina+1}"))
+            if nav_row:
+                filas.append(tuple(nav_row))
+            paginas.append(PaginaCategoria(texto, tuple(filas)))
+        return paginas
+
+    def pagina(self, codigo_categoria: str, numero: int) -> tuple[int, PaginaCategoria] | None:
+        """(número, página) ajustando el número al rango; None si la categoría no tiene productos"""
+        paginas = self.paginas.get(codigo_categoria)
+        if not paginas:
+            return None
+        numero = min(max(numero, 0), len(paginas) - 1)
+        return numero, paginas[numero]
+
+
+class CatalogoBot:
+    """Versión vigente del catálogo y su recarga cuando cambia"""
+
+    def __init__(self):
+        self._actual: VersionCatalogo | None = None
+        self._vieja = True
+        self._lock = asyncio.Lock()
+        # (codigo_producto, img_url) -> file_id capturados desde la última carga
+        self._file_ids: dict[tuple[str, str], str] = {}
+        self.recargas = 0
+        self.invalidaciones = 0
+
+    @property
+    def version(self) -> int:
+        return self._actual.version if self._actual is not None else 0
+
+    def invalidar(self, *_):
+        """El catálogo cambió (o no se sabe): la próxima consulta lo recarga"""
+        self._vieja = True
+        self.invalidaciones += 1
+
+    async def obtener(self) -> VersionCatalogo:
+        """Versión vigente; la carga de la BD si es la primera vez o si cambió"""
+        # Mientras se recarga, las consultas siguen con la versión anterior
+        if not self._vieja and self._actual is not None:
+            return self._actual
+        async with self._lock:
+            if self._vieja:
+                # Se baja antes de leer: un cambio durante la carga la vuelve a marcar
+                self._vieja = False
+                try:
+                    self._actual = await self._cargar(self.version + 1)
+                    self._file_ids.clear()
+                    self.recargas += 1
+                except Exception as e:
+                    self._vieja = True
+                    if self._actual is None:
+                        raise
+                    print(f"⚠️ No se pudo recargar el catálogo, se usa la versión {self.version}: {e}")
+        return self._actual
+
+    def file_id(self, producto) -> str | None:
+        """file_id de Telegram de la imagen actual del producto, si ya se envió"""
+        return self._file_ids.get((producto.codigo_producto, producto.img_url)) or producto.img_file_id
+
+    async def guardar_file_id(self, producto, mensaje):
+        """
+        Guarda el file_id de la foto de un mensaje enviado con producto.img_url.
+        Solo se escribe si img_url no cambió mientras tanto.
+        """
+        if not getattr(mensaje, "photo", None):
+            return
+        file_id = mensaje.photo[-1].file_id
+        self._file_ids[(producto.codigo_producto, producto.img_url)] = file_id
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Producto)
+                    .where(Producto.codigo_producto == producto.codigo_producto,
+                           Producto.img_url == producto.img_url)
+                    .values(img_file_id=file_id)
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el file_id de {producto.codigo_producto}: {e}")
+
+    @staticmethod
+    async def _cargar(version: int) -> VersionCatalogo:
+        async with AsyncSessionLocal() as db:
+            categorias = (await db.scalars(
+                select(Categoria).order_by(Categoria.codigo_categoria)
+            )).all()
+            productos = (await db.scalars(
+                select(Producto).order_by(Producto.codigo_producto)
+            )).all()
+        print(f"📚 Catálogo v{version}: {len(categorias)} categorías, {len(productos)} productos")
+        return VersionCatalogo(version, list(categorias), list(productos))
+
+    def estadisticas(self) -> dict:
+        actual = self._actual
+        return {
+            "version": self.version,
+            "vigente": actual is not None and not self._vieja,
+            "categorias": len(actual.categorias) if actual else 0,
+            "productos": len(actual.producto) if actual else 0,
+            "fotos_en_cache": sum(
+                1 for prod in actual.producto.values() if prod.img_url and self.file_id(prod)
+            ) if actual else 0,
+            "recargas": self.recargas,
+            "invalidaciones": self.invalidaciones
+        }
+
+
+# Instancia única del proceso
+catalogo_bot = CatalogoBot()
+relay_eventos.escuchar(CANAL_CATALOGO, catalogo_bot.invalidar)
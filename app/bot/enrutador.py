@@ -0,0 +1,154 @@
+"""
+Enrutador de callbacks del bot
+Cada botón inline manda un callback_data "accion" o "accion_parametros"
+(ej. "menu_ver", "ver_pedido_PED-ABC123", "cantidad_PROD01_2"). Las rutas se
+declaran con un decorador y el despacho es una búsqueda en diccionario:
+primero la acción exacta y, si no, el prefijo hasta cada "_" del dato (unos
+pocos intentos, sin importar cuántas rutas haya).
+
+Los parámetros se convierten según las anotaciones del handler:
+
+    @callbacks.prefijo("carrito_item_")
+    async def editar_item(query, context, indice: int): ...
+"""
+import inspect
+import time
+from telegram.ext import ContextTypes
+
+
+class CallbackInvalido(ValueError):
+    """El callback_data no trae los parámetros que espera la ruta"""
+
+
+class Ruta:
+    """Handler de una acción, con sus parámetros tipados y sus tiempos"""
+
+    def __init__(self, nombre: str, funcion):
+        self.nombre = nombre
+        self.funcion = funcion
+        # (nombre, tipo, tiene_default) de los parámetros después de (query, context)
+        self.parametros = [
+            (p.name, p.annotation if p.annotation is not inspect.Parameter.empty else str,
+             p.default is not inspect.Parameter.empty)
+            for p in list(inspect.signature(funcion).parameters.values())[2:]
+        ]
+        self.llamadas = 0
+        self.errores = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def convertir(self, datos: str) -> dict:
+        """
+        Parámetros del handler a partir de lo que sigue al prefijo. Se separan
+        por "_" desde la derecha: el primero puede contener "_".
+        """
+        if not self.parametros:
+            return {}
+        partes = datos.rsplit("_", len(self.parametros) - 1) if datos else []
+        obligatorios = sum(1 for _, _, opcional in self.parametros if not opcional)
+        if len(partes) < obligatorios:
+            raise CallbackInvalido(f"{self.nombre}: faltan parámetros en '{datos}'")
+        try:
+            return {
+                nombre: tipo(valor)
+                for (nombre, tipo, _), valor in zip(self.parametros, partes)
+            }
+        except ValueError:
+            raise CallbackInvalido(f"{self.nombre}: parámetros inválidos en '{datos}'")
+
+    def registrar_tiempo(self, inicio: float, error: bool):
+        ms = (time.perf_counter() - inicio) * 1000
+        self.llamadas += 1
+        self.errores += error
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+
+class EnrutadorCallbacks:
+    """Tabla callback_data -> handler(query, context, **parametros)"""
+
+    def __init__(self):
+        self._exactas: dict[str, Ruta] = {}
+        self._prefijos: dict[str, Ruta] = {}
+        self.sin_ruta = 0
+        self.invalidos = 0
+
+    def accion(self, *acciones: str):
+        """Registra el handler para uno o más callback_data fijos"""
+        def decorador(funcion):
+            for accion in acciones:
+                if accion in self._exactas:
+                    raise ValueError(f"Acción de callback duplicada: {accion}")
+                self._exactas[accion] = Ruta(accion, funcion)
+            return funcion
+        return decorador
+
+    def prefijo(self, prefijo: str):
+        """
+        Registra el handler para los callback_data "prefijo<parámetros>". El
+        prefijo termina en "_" y no puede ser prefijo de otro registrado.
+        """
+        if not prefijo.endswith("_"):
+            raise ValueError(f"El prefijo de callback debe terminar en '_': {prefijo}")
+        for existente in self._prefijos:
+            if existente.startswith(prefijo) or prefijo.startswith(existente):
+                raise ValueError(f"Prefijos de callback ambiguos: {existente} / {prefijo}")
+
+        def decorador(funcion):
+            self._prefijos[prefijo] = Ruta(prefijo, funcion)
+            return funcion
+        return decorador
+
+    def resolver(self, data: str) -> tuple[Ruta, str] | None:
+        """(ruta, texto de los parámetros) del callback_data, o None"""
+        ruta = self._exactas.get(data)
+        if ruta is not None:
+            return ruta, ""
+        fin = data.find("_")
+        while fin != -1:
+            ruta = self._prefijos.get(data[:fin + 1])
+            if ruta is not None:
+                return ruta, data[fin + 1:]
+            fin = data.find("_", fin + 1)
+        return None
+
+    async def despachar(self, query, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        """Ejecuta el handler del callback; False si no hay ruta o es inválido"""
+        resultado = self.resolver(query.data or "")
+        if resultado is None:
+            self.sin_ruta += 1
+            return False
+        ruta, datos = resultado
+        try:
+            parametros = ruta.convertir(datos)
+        except CallbackInvalido as e:
+            self.invalidos += 1
+            print(f"⚠️ Callback inválido: {e}")
+            return False
+
+        inicio = time.perf_counter()
+        error = True
+        try:
+            await ruta.funcion(query, context, **parametros)
+            error = False
+        finally:
+            ruta.registrar_tiempo(inicio, error)
+        return True
+
+    def estadisticas(self) -> dict:
+        rutas = [*self._exactas.values(), *self._prefijos.values()]
+        return {
+            "rutas": len(rutas),
+            "sin_ruta": self.sin_ruta,
+            "invalidos": self.invalidos,
+            "por_ruta": {
+                ruta.nombre: {
+                    "llamadas": ruta.llamadas,
+                    "errores": ruta.errores,
+                    "promedio_ms": round(ruta.total_ms / ruta.llamadas, 1),
+                    "max_ms": round(ruta.max_ms, 1)
+                }
+                for ruta in sorted(rutas, key=lambda r: r.total_ms, reverse=True)
+                if ruta.llamadas
+            }
+        }
@@ -2,7 +2,6 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputMe
 from telegram.ext import ContextTypes
 from app.bot.keyboards import (
     get_main_menu_keyboard,
-    get_categorias_keyboard,
     get_productos_keyboard,
     get_cantidad_keyboard,
     get_confirmar_pedido_keyboard,
@@ -19,26 +18,29 @@ from app.bot.keyboards import (
     get_tarjeta_keyboard,
     get_confirmar_tarjeta_keyboard
 )
-from app.database import SessionLocal
-from app.models import Categoria, Producto, ClienteBot, Pedido, ItemPedido, Conductor
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.models import Producto, ClienteBot, Pedido, ItemPedido, Conductor
+from app.services.despacho_service import despachador
+from app.services.eventos_pedido import registrar_evento
+from app.bot.tracking import seguimiento, DURACION_LIVE_LOCATION_SEGUNDOS
+from app.bot.enrutador import EnrutadorCallbacks
+from app.bot.catalogo import catalogo_bot
 from decimal import Decimal
 import random
 import string
 
 
-def get_db():
-    """Obtener sesión de base de datos"""
-    db = SessionLocal()
-    try:
-        return db
-    finally:
-        pass  # Se cierra manualmente después
+def get_db() -> AsyncSession:
+    """Obtener sesión async de base de datos (se cierra manualmente con await db.close())"""
+    return AsyncSessionLocal()
 
 
 async def _enviar_o_editar_mensaje(query, texto: str, reply_markup=None):
     """
     Helper global para enviar o editar mensaje, manejando fotos y texto.
-    Usado por funciones fuera del handle_callbacks.
+    Si el mensaje es una foto se borra y se envía uno nuevo.
     """
     try:
         if query.message.photo:
@@ -83,7 +85,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Registrar o actualizar cliente en la BD
     db = get_db()
     try:
-        cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+        cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
         if not cliente:
             # Cliente nuevo - solicitar teléfono
             context.user_data['carrito'] = []
@@ -106,7 +108,7 @@ Para brindarte un mejor servicio, por favor comparte tu número de teléfono 
             # Cliente existente
             context.user_data['carrito'] = []
     finally:
-        db.close()
+        await db.close()
     
     # Mostrar menú principal
     mensaje = f"""
@@ -131,22 +133,18 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def mostrar_categorias(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra las categorías disponibles"""
-    db = get_db()
-    try:
-        categorias = db.query(Categoria).all()
-        
-        if not categorias:
-            await update.message.reply_text("😢 No hay categorías disponibles por el momento.")
-            return
-        
-        mensaje = "🍽️ *NUESTRO MENÚ*\n\nSelecciona una categoría:"
-        await update.message.reply_text(
-            mensaje,
-            parse_mode='Markdown',
-            reply_markup=get_categorias_keyboard(categorias)
-        )
-    finally:
-        db.close()
+    catalogo = await catalogo_bot.obtener()
+    
+    if not catalogo.categorias:
+        await update.message.reply_text("😢 No hay categorías disponibles por el momento.")
+        return
+    
+    mensaje = "🍽️ *NUESTRO MENÚ*\n\nSelecciona una categoría:"
+    await update.message.reply_text(
+        mensaje,
+        parse_mode='Markdown',
+        reply_markup=catalogo.teclado_categorias
+    )
 
 
 # ============ MANEJADOR DE BOTONES DEL MENÚ PRINCIPAL ============
@@ -241,582 +239,504 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 # ============ MANEJADOR DE CALLBACKS (Botones Inline) ============
+# Cada acción se registra en la tabla `callbacks` (ver app/bot/enrutador.py)
+callbacks = EnrutadorCallbacks()
+
+
 async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja los callbacks de los botones inline"""
     query = update.callback_query
     await query.answer()
-    
-    data = query.data
-    
-    # Función helper para enviar mensaje (maneja fotos y texto)
-    async def enviar_mensaje(texto: str, reply_markup=None):
-        """Envía o edita mensaje, manejando fotos y texto"""
-        try:
-            if query.message.photo:
-                # Es una foto, eliminar y enviar nuevo mensaje
-                await query.message.delete()
-                await query.message.chat.send_message(
-                    texto,
-                    parse_mode='Markdown',
-                    reply_markup=reply_markup
-                )
-            else:
-                # Es texto, editar
-                await query.edit_message_text(
-                    texto,
-                    parse_mode='Markdown',
-                    reply_markup=reply_markup
-                )
-        except Exception:
-            # Fallback: enviar nuevo mensaje
-            await query.message.chat.send_message(
-                texto,
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-    
-    # ============ MENÚ PRINCIPAL ============
-    if data == "menu_ver" or data == "ver_categorias" or data == "producto_agregar":
-        db = get_db()
-        try:
-            categorias = db.query(Categoria).all()
-            await enviar_mensaje(
-                "🍽️ *NUESTRO MENÚ*\n\nSelecciona una categoría:",
-                reply_markup=get_categorias_keyboard(categorias)
-            )
-        finally:
-            db.close()
-    
-    elif data == "pedido_iniciar":
-        context.user_data['carrito'] = []
-        db = get_db()
-        try:
-            categorias = db.query(Categoria).all()
-            await enviar_mensaje(
-                "🛒 *NUEVO PEDIDO INICIADO*\n\n"
-                "Tu carrito está vacío.\n"
-                "Selecciona productos del menú:\n",
-                reply_markup=get_categorias_keyboard(categorias)
-            )
-        finally:
-            db.close()
-    
-    elif data == "detalles_agregar":
-        context.user_data['esperando_detalles'] = True
-        keyboard = [[InlineKeyboardButton("🔙 Cancelar", callback_data="volver_menu")]]
-        await enviar_mensaje(
-            "📝 *AGREGAR DETALLES*\n\n"
-            "Escribe los detalles adicionales para tu pedido:\n\n"
-            "_Ejemplo: Sin cebolla, extra salsa, etc._",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif data == "resumen_ver":
-        await mostrar_resumen_callback(query, context)
-    
-    # ============ EDITAR CARRITO ============
-    elif data == "editar_carrito":
-        await mostrar_editar_carrito(query, context)
-    
-    elif data == "vaciar_carrito":
-        context.user_data['carrito'] = []
-        keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
-        await enviar_mensaje(
-            "🗑️ *Carrito vaciado*\n\nTu carrito ha sido vaciado completamente.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif data.startswith("carrito_item_"):
-        indice = int(data.replace("carrito_item_", ""))
-        await mostrar_editar_item(query, context, indice)
-    
-    elif data.startswith("carrito_menos_"):
-        indice = int(data.replace("carrito_menos_", ""))
-        await modificar_cantidad_item(query, context, indice, -1)
-    
-    elif data.startswith("carrito_mas_"):
-        indice = int(data.replace("carrito_mas_", ""))
-        await modificar_cantidad_item(query, context, indice, 1)
-    
-    elif data.startswith("carrito_eliminar_"):
-        indice = int(data.replace("carrito_eliminar_", ""))
-        await eliminar_item_carrito(query, context, indice)
-    
-    elif data == "noop":
-        await query.answer()  # No hacer nada, solo responder al callback
-    
-    elif data == "pagar_pedido":
-        carrito = context.user_data.get('carrito', [])
-        if not carrito:
-            keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
-            await enviar_mensaje(
-                "🛒 *Tu carrito está vacío*\n\nAgrega productos para hacer un pedido.",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        await enviar_mensaje(
-            "💳 *MÉTODO DE PAGO*\n\nSelecciona cómo deseas pagar:",
-            reply_markup=get_metodo_pago_keyboard()
-        )
-    
-    elif data == "info_contacto":
-        keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
-        await enviar_mensaje(
-            "📞 *CONTACTO*\n\n"
-            "📱 WhatsApp: +591 70000000\n"
-            "☎️ Teléfono: 3-123456\n"
-            "📧 Email: contacto@speedyfood.com\n\n"
-            "¡Estamos para servirte! 😊",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif data == "info_horarios":
-        keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
-        await enviar_mensaje(
-            "🕐 *HORARIOS DE ATENCIÓN*\n\n"
-            "🗓️ Lunes a Viernes:\n"
-            "   11:00 AM - 10:00 PM\n\n"
-            "🗓️ Sábados y Domingos:\n"
-            "   12:00 PM - 11:00 PM\n\n"
-            "🎉 ¡Abierto todos los días!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif data == "info_delivery":
-        keyboard = [
-            [InlineKeyboardButton("📍 Enviar Ubicación", callback_data="solicitar_ubicacion")],
-            [InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]
-        ]
-        await enviar_mensaje(
-            "🚚 *INFORMACIÓN DE DELIVERY*\n\n"
-            "📍 Zona de cobertura: 5 km a la redonda\n"
-            "💰 Costo de envío: Bs. 10\n"
-            "⏱️ Tiempo estimado: 30-45 min\n\n"
-            "📍 Para hacer tu pedido, necesitaremos tu ubicación.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif data == "info_ayuda":
+    await callbacks.despachar(query, context)
+
+
+# ============ MENÚ PRINCIPAL ============
+@callbacks.accion("menu_ver", "ver_categorias", "producto_agregar")
+async def cb_menu_ver(query, context: ContextTypes.DEFAULT_TYPE):
+    catalogo = await catalogo_bot.obtener()
+    await _enviar_o_editar_mensaje(
+        query,
+        "🍽️ *NUESTRO MENÚ*\n\nSelecciona una categoría:",
+        reply_markup=catalogo.teclado_categorias
+    )
+
+
+@callbacks.accion("pedido_iniciar")
+async def cb_pedido_iniciar(query, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['carrito'] = []
+    catalogo = await catalogo_bot.obtener()
+    await _enviar_o_editar_mensaje(
+        query,
+        "🛒 *NUEVO PEDIDO INICIADO*\n\n"
+        "Tu carrito está vacío.\n"
+        "Selecciona productos del menú:\n",
+        reply_markup=catalogo.teclado_categorias
+    )
+
+
+@callbacks.accion("detalles_agregar")
+async def cb_detalles_agregar(query, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['esperando_detalles'] = True
+    keyboard = [[InlineKeyboardButton("🔙 Cancelar", callback_data="volver_menu")]]
+    await _enviar_o_editar_mensaje(
+        query,
+        "📝 *AGREGAR DETALLES*\n\n"
+        "Escribe los detalles adicionales para tu pedido:\n\n"
+        "_Ejemplo: Sin cebolla, extra salsa, etc._",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+# ============ EDITAR CARRITO ============
+@callbacks.accion("vaciar_carrito")
+async def cb_vaciar_carrito(query, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['carrito'] = []
+    keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
+    await _enviar_o_editar_mensaje(
+        query,
+        "🗑️ *Carrito vaciado*\n\nTu carrito ha sido vaciado completamente.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+@callbacks.prefijo("carrito_menos_")
+async def cb_carrito_menos(query, context: ContextTypes.DEFAULT_TYPE, indice: int):
+    await modificar_cantidad_item(query, context, indice, -1)
+
+
+@callbacks.prefijo("carrito_mas_")
+async def cb_carrito_mas(query, context: ContextTypes.DEFAULT_TYPE, indice: int):
+    await modificar_cantidad_item(query, context, indice, 1)
+
+
+@callbacks.accion("noop")
+async def cb_noop(query, context: ContextTypes.DEFAULT_TYPE):
+    """Botón decorativo (el callback ya se respondió)"""
+
+
+@callbacks.accion("pagar_pedido")
+async def cb_pagar_pedido(query, context: ContextTypes.DEFAULT_TYPE):
+    carrito = context.user_data.get('carrito', [])
+    if not carrito:
         keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
-        await enviar_mensaje(
-            "❓ *AYUDA*\n\n"
-            "*¿Cómo hacer un pedido?*\n"
-            "1️⃣ Presiona 'Ver Menú'\n"
-            "2️⃣ Selecciona una categoría\n"
-            "3️⃣ Elige tus productos\n"
-            "4️⃣ Revisa el resumen\n"
-            "5️⃣ Confirma y paga\n\n"
-            "*Comandos útiles:*\n"
-            "/start - Reiniciar bot\n"
-            "/menu - Ver menú\n"
-            "/carrito - Ver carrito\n"
-            "/mispedidos - Ver mis pedidos\n\n"
-            "¿Dudas? Contáctanos 📞",
+        await _enviar_o_editar_mensaje(
+            query,
+            "🛒 *Tu carrito está vacío*\n\nAgrega productos para hacer un pedido.",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-    
-    # ============ MIS PEDIDOS Y RASTREO ============
-    elif data == "mis_pedidos":
-        # Limpiar mensajes de ubicación al volver a la lista
-        await limpiar_mensajes_ubicacion(query, context)
-        await mostrar_mis_pedidos(query, context)
-    
-    elif data == "rastrear_pedido":
-        await enviar_mensaje(
-            "🔍 *RASTREAR PEDIDO*\n\n"
-            "Puedes ver el estado de tus pedidos y la ubicación del repartidor.\n\n"
-            "Selecciona 'Ver Mis Pedidos' para ver todos tus pedidos activos:",
-            reply_markup=get_rastrear_keyboard()
-        )
-    
-    elif data.startswith("ver_pedido_"):
-        codigo_pedido = data.replace("ver_pedido_", "")
-        await mostrar_detalle_pedido(query, context, codigo_pedido)
-    
-    elif data.startswith("ubicacion_conductor_"):
-        codigo_pedido = data.replace("ubicacion_conductor_", "")
-        await mostrar_ubicacion_conductor(query, context, codigo_pedido)
-    
-    elif data.startswith("tracking_live_"):
-        codigo_pedido = data.replace("tracking_live_", "")
-        await iniciar_tracking_live(query, context, codigo_pedido)
-    
-    elif data.startswith("stop_tracking_"):
-        codigo_pedido = data.replace("stop_tracking_", "")
-        await detener_tracking_live(query, context, codigo_pedido)
-    
-    elif data.startswith("actualizar_pedido_"):
-        codigo_pedido = data.replace("actualizar_pedido_", "")
-        await mostrar_detalle_pedido(query, context, codigo_pedido)
-    
-    elif data == "noop":
-        # No hacer nada - botón decorativo
-        await query.answer()
         return
+    await _enviar_o_editar_mensaje(
+        query,
+        "💳 *MÉTODO DE PAGO*\n\nSelecciona cómo deseas pagar:",
+        reply_markup=get_metodo_pago_keyboard()
+    )
+
+
+# ============ INFORMACIÓN ============
+@callbacks.accion("info_contacto")
+async def cb_info_contacto(query, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
+    await _enviar_o_editar_mensaje(
+        query,
+        "📞 *CONTACTO*\n\n"
+        "📱 WhatsApp: +591 70000000\n"
+        "☎️ Teléfono: 3-123456\n"
+        "📧 Email: contacto@speedyfood.com\n\n"
+        "¡Estamos para servirte! 😊",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+@callbacks.accion("info_horarios")
+async def cb_info_horarios(query, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
+    await _enviar_o_editar_mensaje(
+        query,
+        "🕐 *HORARIOS DE ATENCIÓN*\n\n"
+        "🗓️ Lunes a Viernes:\n"
+        "   11:00 AM - 10:00 PM\n\n"
+        "🗓️ Sábados y Domingos:\n"
+        "   12:00 PM - 11:00 PM\n\n"
+        "🎉 ¡Abierto todos los días!",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+@callbacks.accion("info_delivery")
+async def cb_info_delivery(query, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = [
+        [InlineKeyboardButton("📍 Enviar Ubicación", callback_data="solicitar_ubicacion")],
+        [InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]
+    ]
+    await _enviar_o_editar_mensaje(
+        query,
+        "🚚 *INFORMACIÓN DE DELIVERY*\n\n"
+        "📍 Zona de cobertura: 5 km a la redonda\n"
+        "💰 Costo de envío: Bs. 10\n"
+        "⏱️ Tiempo estimado: 30-45 min\n\n"
+        "📍 Para hacer tu pedido, necesitaremos tu ubicación.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+@callbacks.accion("info_ayuda")
+async def cb_info_ayuda(query, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="volver_menu")]]
+    await _enviar_o_editar_mensaje(
+        query,
+        "❓ *AYUDA*\n\n"
+        "*¿Cómo hacer un pedido?*\n"
+        "1️⃣ Presiona 'Ver Menú'\n"
+        "2️⃣ Selecciona una categoría\n"
+        "3️⃣ Elige tus productos\n"
+        "4️⃣ Revisa el resumen\n"
+        "5️⃣ Confirma y paga\n\n"
+        "*Comandos útiles:*\n"
+        "/start - Reiniciar bot\n"
+        "/menu - Ver menú\n"
+        "/carrito - Ver carrito\n"
+        "/mispedidos - Ver mis pedidos\n\n"
+        "¿Dudas? Contáctanos 📞",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+# ============ MIS PEDIDOS Y RASTREO ============
+@callbacks.accion("mis_pedidos")
+async def cb_mis_pedidos(query, context: ContextTypes.DEFAULT_TYPE):
+    # Limpiar mensajes de ubicación al volver a la lista
+    await limpiar_mensajes_ubicacion(query, context)
+    await mostrar_mis_pedidos(query, context)
+
+
+@callbacks.accion("rastrear_pedido")
+async def cb_rastrear_pedido(query, context: ContextTypes.DEFAULT_TYPE):
+    await _enviar_o_editar_mensaje(
+        query,
+        "🔍 *RASTREAR PEDIDO*\n\n"
+        "Puedes ver el estado de tus pedidos y la ubicación del repartidor.\n\n"
+        "Selecciona 'Ver Mis Pedidos' para ver todos tus pedidos activos:",
+        reply_markup=get_rastrear_keyboard()
+    )
+
+
+# ============ NAVEGACIÓN ============
+@callbacks.accion("volver_menu")
+async def cb_volver_menu(query, context: ContextTypes.DEFAULT_TYPE):
+    # Limpiar mensajes de ubicación pendientes
+    await limpiar_mensajes_ubicacion(query, context)
+    await _enviar_o_editar_mensaje(
+        query,
+        "🍔 *MENÚ PRINCIPAL*\n\n¿Qué deseas hacer?",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+
+@callbacks.accion("solicitar_ubicacion")
+async def cb_solicitar_ubicacion(query, context: ContextTypes.DEFAULT_TYPE):
+    await query.message.reply_text(
+        "📍 Por favor, envía tu ubicación:",
+        reply_markup=get_ubicacion_keyboard()
+    )
+
+
+# ============ PRODUCTOS ============
+# Seleccionar categoría - MOSTRAR PRODUCTOS PAGINADOS
+# Formato: categoria_CODIGO o categoria_CODIGO_PAGINA
+@callbacks.prefijo("categoria_")
+async def cb_categoria(query, context: ContextTypes.DEFAULT_TYPE, codigo_cat: str, pagina: int = 0):
+    catalogo = await catalogo_bot.obtener()
+    categoria = catalogo.categoria.get(codigo_cat)
+    resultado = catalogo.pagina(codigo_cat, pagina)
     
-    # Incrementar cantidad en selector de producto
-    elif data.startswith("qty_mas_"):
-        codigo_prod = data.replace("qty_mas_", "")
-        cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
-        if cantidad_actual < 10:  # Máximo 10
-            context.user_data[f'qty_{codigo_prod}'] = cantidad_actual + 1
-        await actualizar_vista_producto(query, context, codigo_prod)
+    if not resultado:
+        await _enviar_o_editar_mensaje(
+            query,
+            f"😢 No hay productos en {categoria.nombre}" if categoria else "😢 Esta categoría ya no está disponible",
+            reply_markup=catalogo.teclado_categorias
+        )
         return
     
-    # Decrementar cantidad en selector de producto
-    elif data.startswith("qty_menos_"):
-        codigo_prod = data.replace("qty_menos_", "")
-        cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
-        if cantidad_actual > 1:  # Mínimo 1
-            context.user_data[f'qty_{codigo_prod}'] = cantidad_actual - 1
-        await actualizar_vista_producto(query, context, codigo_prod)
-        return
+    # Guardar la categoría actual en el contexto
+    context.user_data['categoria_actual'] = codigo_cat
     
-    elif data == "volver_menu":
-        # Limpiar mensajes de ubicación pendientes
-        await limpiar_mensajes_ubicacion(query, context)
-        await enviar_mensaje(
-            "🍔 *MENÚ PRINCIPAL*\n\n¿Qué deseas hacer?",
-            reply_markup=get_main_menu_keyboard()
-        )
+    # Mensaje y botones de la página ya armados en el catálogo (5 productos por página);
+    # solo se agrega la fila del carrito del usuario
+    pagina, pagina_categoria = resultado
+    total_carrito = sum(item['cantidad'] for item in context.user_data.get('carrito', []))
+    keyboard = pagina_categoria.filas + ((
+        InlineKeyboardButton(f"🛒 Carrito ({total_carrito})", callback_data="resumen_ver"),
+        InlineKeyboardButton("🔙 Categorías", callback_data="menu_ver")
+    ),)
     
-    elif data == "solicitar_ubicacion":
-        await query.message.reply_text(
-            "📍 Por favor, envía tu ubicación:",
-            reply_markup=get_ubicacion_keyboard()
-        )
+    await _enviar_o_editar_mensaje(
+        query,
+        pagina_categoria.texto,
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+# Ver producto individual con imagen y opciones de cantidad
+@callbacks.prefijo("ver_prod_")
+async def cb_ver_producto(query, context: ContextTypes.DEFAULT_TYPE, codigo_prod: str):
+    producto = (await catalogo_bot.obtener()).producto.get(codigo_prod)
     
-    # Seleccionar categoría - MOSTRAR PRODUCTOS PAGINADOS
-    elif data.startswith("categoria_"):
-        # Formato: categoria_CODIGO o categoria_CODIGO_PAGINA
-        parts = data.split("_")
-        codigo_cat = parts[1]
-        pagina = int(parts[2]) if len(parts) > 2 else 0
-        
-        db = get_db()
-        try:
-            categoria = db.query(Categoria).filter(Categoria.codigo_categoria == codigo_cat).first()
-            productos = db.query(Producto).filter(Producto.codigo_categoria == codigo_cat).all()
-            
-            if not productos:
-                await enviar_mensaje(
-                    f"😢 No hay productos en {categoria.nombre}",
-                    reply_markup=get_categorias_keyboard(db.query(Categoria).all())
-                )
-                return
-            
-            # Guardar la categoría actual en el contexto
-            context.user_data['categoria_actual'] = codigo_cat
-            
-            # Paginación: 5 productos por página
-            PRODUCTOS_POR_PAGINA = 5
-            total_paginas = (len(productos) + PRODUCTOS_POR_PAGINA - 1) // PRODUCTOS_POR_PAGINA
-            inicio = pagina * PRODUCTOS_POR_PAGINA
-            fin = min(inicio + PRODUCTOS_POR_PAGINA, len(productos))
-            productos_pagina = productos[inicio:fin]
-            
-            # Crear mensaje con título
-            mensaje = f"🍽️ *{categoria.nombre.upper()}*\n"
-            mensaje += f"━━━━━━━━━━━━━━━━━\n"
-            if total_paginas > 1:
-                mensaje += f"📄 Página {pagina + 1}/{total_paginas}\n"
-            mensaje += "\n_Selecciona un producto:_"
-            
-            # Crear botones - uno por fila con nombre completo y precio
-            keyboard = []
-            for prod in productos_pagina:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"🍔 {prod.nombre} - Bs.{prod.precio}", 
-                        callback_data=f"ver_prod_{prod.codigo_producto}"
-                    )
-                ])
-            
-            # Botones de paginación
-            nav_row = []
-            if pagina > 0:
-                nav_row.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"categoria_{codigo_cat}_{pagina-1}"))
-            if pagina < total_paginas - 1:
-                nav_row.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"categoria_{codigo_cat}_{pagina+1}"))
-            if nav_row:
-                keyboard.append(nav_row)
-            
-            # Botones de acción
-            total_carrito = sum(item['cantidad'] for item in context.user_data.get('carrito', []))
-            keyboard.append([
-                InlineKeyboardButton(f"🛒 Carrito ({total_carrito})", callback_data="resumen_ver"),
-                InlineKeyboardButton("🔙 Categorías", callback_data="menu_ver")
-            ])
-            
-            await enviar_mensaje(
-                mensaje,
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        finally:
-            db.close()
+    if not producto:
+        await query.answer("❌ Producto no encontrado")
+        return
     
-    # Ver producto individual con imagen y opciones de cantidad
-    elif data.startswith("ver_prod_"):
-        codigo_prod = data.replace("ver_prod_", "")
-        db = get_db()
-        try:
-            producto = db.query(Producto).filter(Producto.codigo_producto == codigo_prod).first()
-            
-            if not producto:
-                await query.answer("❌ Producto no encontrado")
-                return
-            
-            # Obtener cantidad actual del selector (default 1)
-            cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
-            
-            # Caption compacto
-            caption = f"🍔 *{producto.nombre}*\n"
-            caption += f"_{producto.descripcion or 'Delicioso!'}_\n\n"
-            caption += f"💰 *Bs. {producto.precio}* c/u\n"
-            caption += f"📦 *Subtotal: Bs. {float(producto.precio) * cantidad_actual:.2f}*"
-            
-            # Botones con contador funcional
-            keyboard = [
-                [
-                    InlineKeyboardButton("➖", callback_data=f"qty_menos_{codigo_prod}"),
-                    InlineKeyboardButton(f"  {cantidad_actual}  ", callback_data="noop"),
-                    InlineKeyboardButton("➕", callback_data=f"qty_mas_{codigo_prod}"),
-                ],
-                [
-                    InlineKeyboardButton(f"🛒 Agregar {cantidad_actual} al carrito", callback_data=f"cantidad_{codigo_prod}_{cantidad_actual}"),
-                ],
-                [
-                    InlineKeyboardButton("🔙 Volver", callback_data=f"categoria_{producto.codigo_categoria}"),
-                    InlineKeyboardButton("📋 Carrito", callback_data="resumen_ver"),
-                ]
-            ]
-            
-            if producto.img_url:
-                try:
-                    # Intentar editar si es posible, sino enviar nuevo
-                    if query.message.photo:
-                        await query.edit_message_media(
-                            media=InputMediaPhoto(media=producto.img_url, caption=caption, parse_mode='Markdown'),
-                            reply_markup=InlineKeyboardMarkup(keyboard)
-                        )
-                    else:
-                        await query.message.delete()
-                        await query.message.chat.send_photo(
-                            photo=producto.img_url,
-                            caption=caption,
-                            parse_mode='Markdown',
-                            reply_markup=InlineKeyboardMarkup(keyboard)
-                        )
-                except:
-                    await query.message.chat.send_photo(
-                        photo=producto.img_url,
-                        caption=caption,
-                        parse_mode='Markdown',
-                        reply_markup=InlineKeyboardMarkup(keyboard)
-                    )
-            else:
-                await enviar_mensaje(
-                    caption,
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-        finally:
-            db.close()
+    # Obtener cantidad actual del selector (default 1)
+    cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
+    
+    # Caption compacto
+    caption = f"🍔 *{producto.nombre}*\n"
+    caption += f"_{producto.descripcion or 'Delicioso!'}_\n\n"
+    caption += f"💰 *Bs. {producto.precio}* c/u\n"
+    caption += f"📦 *Subtotal: Bs. {float(producto.precio) * cantidad_actual:.2f}*"
+    
+    # Botones con contador funcional
+    keyboard = [
+        [
+            InlineKeyboardButton("➖", callback_data=f"qty_menos_{codigo_prod}"),
+            InlineKeyboardButton(f"  {cantidad_actual}  ", callback_data="noop"),
+            InlineKeyboardButton("➕", callback_data=f"qty_mas_{codigo_prod}"),
+        ],
+        [
+            InlineKeyboardButton(f"🛒 Agregar {cantidad_actual} al carrito", callback_data=f"cantidad_{codigo_prod}_{cantidad_actual}"),
+        ],
+        [
+            InlineKeyboardButton("🔙 Volver", callback_data=f"categoria_{producto.codigo_categoria}"),
+            InlineKeyboardButton("📋 Carrito", callback_data="resumen_ver"),
+        ]
+    ]
     
-    # Seleccionar cantidad (desde imagen de producto)
-    elif data.startswith("cantidad_"):
-        parts = data.split("_")
-        codigo_prod = parts[1]
-        cantidad = int(parts[2])
-        
-        db = get_db()
+    if producto.img_url:
+        # file_id de un envío anterior (Telegram no vuelve a descargar la imagen) o la URL
+        foto = catalogo_bot.file_id(producto) or producto.img_url
         try:
-            producto = db.query(Producto).filter(Producto.codigo_producto == codigo_prod).first()
-            
-            # Agregar al carrito
-            if 'carrito' not in context.user_data:
-                context.user_data['carrito'] = []
-            
-            # Verificar si ya está en el carrito
-            encontrado = False
-            for item in context.user_data['carrito']:
-                if item['codigo'] == codigo_prod:
-                    item['cantidad'] += cantidad
-                    encontrado = True
-                    break
-            
-            if not encontrado:
-                context.user_data['carrito'].append({
-                    'codigo': codigo_prod,
-                    'nombre': producto.nombre,
-                    'precio': float(producto.precio),
-                    'cantidad': cantidad
-                })
-            
-            # Calcular total del carrito
-            total_items = sum(item['cantidad'] for item in context.user_data['carrito'])
-            total_precio = sum(item['cantidad'] * item['precio'] for item in context.user_data['carrito'])
-            
-            # Mostrar confirmación rápida en el mismo producto
-            mensaje_exito = f"✅ *+{cantidad}* agregado!\n🛒 Total: {total_items} items - Bs. {total_precio:.2f}"
-            
-            # Botones para seguir agregando o finalizar
-            keyboard = [
-                [
-                    InlineKeyboardButton("1️⃣", callback_data=f"cantidad_{codigo_prod}_1"),
-                    InlineKeyboardButton("2️⃣", callback_data=f"cantidad_{codigo_prod}_2"),
-                    InlineKeyboardButton("3️⃣", callback_data=f"cantidad_{codigo_prod}_3"),
-                ],
-                [
-                    InlineKeyboardButton("📋 Ver Carrito", callback_data="resumen_ver"),
-                    InlineKeyboardButton("✅ Finalizar", callback_data="confirmar_pedido"),
-                ]
-            ]
-            
-            # Verificar si el mensaje tiene foto (caption) o es texto
+            # Intentar editar si es posible, sino enviar nuevo
             if query.message.photo:
-                await query.edit_message_caption(
-                    caption=mensaje_exito,
-                    parse_mode='Markdown',
+                enviado = await query.edit_message_media(
+                    media=InputMediaPhoto(media=foto, caption=caption, parse_mode='Markdown'),
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
             else:
-                await query.edit_message_text(
-                    mensaje_exito,
+                await query.message.delete()
+                enviado = await query.message.chat.send_photo(
+                    photo=foto,
+                    caption=caption,
                     parse_mode='Markdown',
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
-        except Exception as e:
-            await query.answer(f"✅ {cantidad}x {producto.nombre} agregado!")
-        finally:
-            db.close()
-    
-    # Confirmar pedido
-    elif data == "confirmar_pedido":
-        # Eliminar mensaje anterior si es foto
-        try:
-            if query.message.photo:
-                await query.message.delete()
         except:
-            pass
-        await query.message.chat.send_message(
-            "📍 *Envía tu ubicación para el delivery*\n\nPresiona el botón para compartir tu ubicación:",
-            parse_mode='Markdown',
-            reply_markup=get_ubicacion_keyboard()
-        )
-    
-    # Cancelar pedido
-    elif data == "cancelar_pedido":
-        context.user_data['carrito'] = []
-        db = get_db()
-        try:
-            categorias = db.query(Categoria).all()
-            await enviar_mensaje(
-                "❌ *Pedido cancelado*\n\n¿Deseas empezar de nuevo?",
-                reply_markup=get_categorias_keyboard(categorias)
-            )
-        finally:
-            db.close()
-    
-    # Ver resumen desde callback
-    elif data == "ver_resumen":
-        carrito = context.user_data.get('carrito', [])
-        if not carrito:
-            await enviar_mensaje(
-                "🛒 *Tu carrito está vacío*",
-                reply_markup=get_main_menu_keyboard()
+            foto = producto.img_url
+            enviado = await query.message.chat.send_photo(
+                photo=foto,
+                caption=caption,
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
-            return
-        
-        mensaje = "📋 *RESUMEN DE TU PEDIDO*\n\n"
-        total = 0
-        for item in carrito:
-            subtotal = item['precio'] * item['cantidad']
-            total += subtotal
-            mensaje += f"• {item['cantidad']}x {item['nombre']} - Bs. {subtotal:.2f}\n"
-        
-        mensaje += f"\n💰 *TOTAL: Bs. {total:.2f}*"
-        
-        await enviar_mensaje(
-            mensaje,
-            reply_markup=get_confirmar_pedido_keyboard()
+        if foto == producto.img_url:
+            await catalogo_bot.guardar_file_id(producto, enviado)
+    else:
+        await _enviar_o_editar_mensaje(
+            query,
+            caption,
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-    
-    # ============ MÉTODOS DE PAGO ============
-    # Mostrar QR para pago
-    elif data == "mostrar_qr":
-        await mostrar_qr_pago(query, context)
-    
-    # Confirmar pago QR
-    elif data == "confirmar_pago_qr":
-        await procesar_pago_qr(query, context)
-    
-    # Mostrar formulario tarjeta
-    elif data == "pago_tarjeta":
-        await mostrar_pago_tarjeta(query, context)
-    
-    # Ingresar datos de tarjeta
-    elif data == "ingresar_tarjeta":
-        await solicitar_datos_tarjeta(query, context)
-    
-    # Confirmar pago tarjeta
-    elif data == "confirmar_pago_tarjeta":
-        await procesar_pago_tarjeta(query, context)
-    
-    # Método de pago efectivo (directo)
-    elif data == "pago_EFECTIVO":
-        await finalizar_pedido(query, context, "EFECTIVO")
 
 
-# ============ ACTUALIZAR VISTA PRODUCTO (para contador ➖➕) ============
-async def actualizar_vista_producto(query, context: ContextTypes.DEFAULT_TYPE, codigo_prod: str):
-    """Actualiza la vista del producto con la nueva cantidad"""
-    db = get_db()
+# Selector de cantidad ➖➕ en la vista del producto
+@callbacks.prefijo("qty_mas_")
+async def cb_qty_mas(query, context: ContextTypes.DEFAULT_TYPE, codigo_prod: str):
+    cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
+    if cantidad_actual < 10:  # Máximo 10
+        context.user_data[f'qty_{codigo_prod}'] = cantidad_actual + 1
+    await actualizar_vista_producto(query, context, codigo_prod)
+
+
+@callbacks.prefijo("qty_menos_")
+async def cb_qty_menos(query, context: ContextTypes.DEFAULT_TYPE, codigo_prod: str):
+    cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
+    if cantidad_actual > 1:  # Mínimo 1
+        context.user_data[f'qty_{codigo_prod}'] = cantidad_actual - 1
+    await actualizar_vista_producto(query, context, codigo_prod)
+
+
+# Seleccionar cantidad (desde imagen de producto)
+@callbacks.prefijo("cantidad_")
+async def cb_cantidad(query, context: ContextTypes.DEFAULT_TYPE, codigo_prod: str, cantidad: int):
+    producto = (await catalogo_bot.obtener()).producto.get(codigo_prod)
+    if not producto:
+        await query.answer("❌ Producto no encontrado")
+        return
+    
     try:
-        producto = db.query(Producto).filter(Producto.codigo_producto == codigo_prod).first()
-        
-        if not producto:
-            await query.answer("❌ Producto no encontrado")
-            return
-        
-        cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
-        
-        # Caption con subtotal
-        caption = f"🍔 *{producto.nombre}*\n"
-        caption += f"_{producto.descripcion or 'Delicioso!'}_\n\n"
-        caption += f"💰 *Bs. {producto.precio}* c/u\n"
-        caption += f"📦 *Subtotal: Bs. {float(producto.precio) * cantidad_actual:.2f}*"
+        # Agregar al carrito
+        if 'carrito' not in context.user_data:
+            context.user_data['carrito'] = []
         
-        # Botones con contador
+        # Verificar si ya está en el carrito
+        encontrado = False
+        for item in context.user_data['carrito']:
+            if item['codigo'] == codigo_prod:
+                item['cantidad'] += cantidad
+                encontrado = True
+                break
+        
+        if not encontrado:
+            context.user_data['carrito'].append({
+                'codigo': codigo_prod,
+                'nombre': producto.nombre,
+                'precio': float(producto.precio),
+                'cantidad': cantidad
+            })
+        
+        # Calcular total del carrito
+        total_items = sum(item['cantidad'] for item in context.user_data['carrito'])
+        total_precio = sum(item['cantidad'] * item['precio'] for item in context.user_data['carrito'])
+        
+        # Mostrar confirmación rápida en el mismo producto
+        mensaje_exito = f"✅ *+{cantidad}* agregado!\n🛒 Total: {total_items} items - Bs. {total_precio:.2f}"
+        
+        # Botones para seguir agregando o finalizar
         keyboard = [
             [
-                InlineKeyboardButton("➖", callback_data=f"qty_menos_{codigo_prod}"),
-                InlineKeyboardButton(f"  {cantidad_actual}  ", callback_data="noop"),
-                InlineKeyboardButton("➕", callback_data=f"qty_mas_{codigo_prod}"),
+                InlineKeyboardButton("1️⃣", callback_data=f"cantidad_{codigo_prod}_1"),
+                InlineKeyboardButton("2️⃣", callback_data=f"cantidad_{codigo_prod}_2"),
+                InlineKeyboardButton("3️⃣", callback_data=f"cantidad_{codigo_prod}_3"),
             ],
             [
-                InlineKeyboardButton(f"🛒 Agregar {cantidad_actual} al carrito", callback_data=f"cantidad_{codigo_prod}_{cantidad_actual}"),
-            ],
-            [
-                InlineKeyboardButton("🔙 Volver", callback_data=f"categoria_{producto.codigo_categoria}"),
-                InlineKeyboardButton("📋 Carrito", callback_data="resumen_ver"),
+                InlineKeyboardButton("📋 Ver Carrito", callback_data="resumen_ver"),
+                InlineKeyboardButton("✅ Finalizar", callback_data="confirmar_pedido"),
             ]
         ]
         
-        # Actualizar el mensaje (caption si es foto)
+        # Verificar si el mensaje tiene foto (caption) o es texto
         if query.message.photo:
             await query.edit_message_caption(
-                caption=caption,
+                caption=mensaje_exito,
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
         else:
             await query.edit_message_text(
-                caption,
+                mensaje_exito,
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
-    finally:
-        db.close()
+    except Exception as e:
+        await query.answer(f"✅ {cantidad}x {producto.nombre} agregado!")
+
+
+# ============ PEDIDO ============
+@callbacks.accion("confirmar_pedido")
+async def cb_confirmar_pedido(query, context: ContextTypes.DEFAULT_TYPE):
+    # Eliminar mensaje anterior si es foto
+    try:
+        if query.message.photo:
+            await query.message.delete()
+    except:
+        pass
+    await query.message.chat.send_message(
+        "📍 *Envía tu ubicación para el delivery*\n\nPresiona el botón para compartir tu ubicación:",
+        parse_mode='Markdown',
+        reply_markup=get_ubicacion_keyboard()
+    )
+
+
+@callbacks.accion("cancelar_pedido")
+async def cb_cancelar_pedido(query, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['carrito'] = []
+    catalogo = await catalogo_bot.obtener()
+    await _enviar_o_editar_mensaje(
+        query,
+        "❌ *Pedido cancelado*\n\n¿Deseas empezar de nuevo?",
+        reply_markup=catalogo.teclado_categorias
+    )
+
+
+# Ver resumen desde callback
+@callbacks.accion("ver_resumen")
+async def cb_ver_resumen(query, context: ContextTypes.DEFAULT_TYPE):
+    carrito = context.user_data.get('carrito', [])
+    if not carrito:
+        await _enviar_o_editar_mensaje(
+            query,
+            "🛒 *Tu carrito está vacío*",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    mensaje = "📋 *RESUMEN DE TU PEDIDO*\n\n"
+    total = 0
+    for item in carrito:
+        subtotal = item['precio'] * item['cantidad']
+        total += subtotal
+        mensaje += f"• {item['cantidad']}x {item['nombre']} - Bs. {subtotal:.2f}\n"
+    
+    mensaje += f"\n💰 *TOTAL: Bs. {total:.2f}*"
+    
+    await _enviar_o_editar_mensaje(
+        query,
+        mensaje,
+        reply_markup=get_confirmar_pedido_keyboard()
+    )
+
+
+# ============ MÉTODOS DE PAGO ============
+# (QR y tarjeta: las rutas están en sus funciones, más abajo)
+@callbacks.accion("pago_EFECTIVO")
+async def cb_pago_efectivo(query, context: ContextTypes.DEFAULT_TYPE):
+    await finalizar_pedido(query, context, "EFECTIVO")
+
+
+# ============ ACTUALIZAR VISTA PRODUCTO (para contador ➖➕) ============
+async def actualizar_vista_producto(query, context: ContextTypes.DEFAULT_TYPE, codigo_prod: str):
+    """Actualiza la vista del producto con la nueva cantidad"""
+    producto = (await catalogo_bot.obtener()).producto.get(codigo_prod)
+    
+    if not producto:
+        await query.answer("❌ Producto no encontrado")
+        return
+    
+    cantidad_actual = context.user_data.get(f'qty_{codigo_prod}', 1)
+    
+    # Caption con subtotal
+    caption = f"🍔 *{producto.nombre}*\n"
+    caption += f"_{producto.descripcion or 'Delicioso!'}_\n\n"
+    caption += f"💰 *Bs. {producto.precio}* c/u\n"
+    caption += f"📦 *Subtotal: Bs. {float(producto.precio) * cantidad_actual:.2f}*"
+    
+    # Botones con contador
+    keyboard = [
+        [
+            InlineKeyboardButton("➖", callback_data=f"qty_menos_{codigo_prod}"),
+            InlineKeyboardButton(f"  {cantidad_actual}  ", callback_data="noop"),
+            InlineKeyboardButton("➕", callback_data=f"qty_mas_{codigo_prod}"),
+        ],
+        [
+            InlineKeyboardButton(f"🛒 Agregar {cantidad_actual} al carrito", callback_data=f"cantidad_{codigo_prod}_{cantidad_actual}"),
+        ],
+        [
+            InlineKeyboardButton("🔙 Volver", callback_data=f"categoria_{producto.codigo_categoria}"),
+            InlineKeyboardButton("📋 Carrito", callback_data="resumen_ver"),
+        ]
+    ]
+    
+    # Actualizar el mensaje (caption si es foto)
+    if query.message.photo:
+        await query.edit_message_caption(
+            caption=caption,
+            parse_mode='Markdown',
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    else:
+        await query.edit_message_text(
+            caption,
+            parse_mode='Markdown',
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
 
 
 # ============ MOSTRAR RESUMEN ============
@@ -852,6 +772,7 @@ async def mostrar_resumen(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ============ MOSTRAR RESUMEN CALLBACK ============
+@callbacks.accion("resumen_ver")
 async def mostrar_resumen_callback(query, context: ContextTypes.DEFAULT_TYPE):
     """Muestra el resumen del carrito (desde callback)"""
     carrito = context.user_data.get('carrito', [])
@@ -886,6 +807,7 @@ async def mostrar_resumen_callback(query, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ============ EDITAR CARRITO ============
+@callbacks.accion("editar_carrito")
 async def mostrar_editar_carrito(query, context: ContextTypes.DEFAULT_TYPE):
     """Muestra el carrito con opciones para editar cada producto"""
     carrito = context.user_data.get('carrito', [])
@@ -917,6 +839,7 @@ async def mostrar_editar_carrito(query, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@callbacks.prefijo("carrito_item_")
 async def mostrar_editar_item(query, context: ContextTypes.DEFAULT_TYPE, indice: int):
     """Muestra las opciones para editar un item específico del carrito"""
     carrito = context.user_data.get('carrito', [])
@@ -986,6 +909,7 @@ async def modificar_cantidad_item(query, context: ContextTypes.DEFAULT_TYPE, ind
     await mostrar_editar_item(query, context, indice)
 
 
+@callbacks.prefijo("carrito_eliminar_")
 async def eliminar_item_carrito(query, context: ContextTypes.DEFAULT_TYPE, indice: int):
     """Elimina un item del carrito"""
     carrito = context.user_data.get('carrito', [])
@@ -1031,6 +955,7 @@ async def procesar_pago(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ============ PAGO QR ============
+@callbacks.accion("mostrar_qr")
 async def mostrar_qr_pago(query, context: ContextTypes.DEFAULT_TYPE):
     """Muestra el código QR para pago"""
     carrito = context.user_data.get('carrito', [])
@@ -1074,6 +999,7 @@ async def mostrar_qr_pago(query, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@callbacks.accion("confirmar_pago_qr")
 async def procesar_pago_qr(query, context: ContextTypes.DEFAULT_TYPE):
     """Procesa el pago por QR (simulado)"""
     import asyncio
@@ -1126,6 +1052,7 @@ async def procesar_pago_qr(query, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ============ PAGO TARJETA ============
+@callbacks.accion("pago_tarjeta")
 async def mostrar_pago_tarjeta(query, context: ContextTypes.DEFAULT_TYPE):
     """Muestra opciones de pago con tarjeta"""
     carrito = context.user_data.get('carrito', [])
@@ -1146,6 +1073,7 @@ async def mostrar_pago_tarjeta(query, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@callbacks.accion("ingresar_tarjeta")
 async def solicitar_datos_tarjeta(query, context: ContextTypes.DEFAULT_TYPE):
     """Solicita los datos de la tarjeta (simulado)"""
     context.user_data['esperando_tarjeta'] = True
@@ -1261,6 +1189,7 @@ async def procesar_datos_tarjeta(update: Update, context: ContextTypes.DEFAULT_T
     return False
 
 
+@callbacks.accion("confirmar_pago_tarjeta")
 async def procesar_pago_tarjeta(query, context: ContextTypes.DEFAULT_TYPE):
     """Procesa el pago con tarjeta (simulado)"""
     import asyncio
@@ -1323,7 +1252,7 @@ async def finalizar_pedido_directo(query, context: ContextTypes.DEFAULT_TYPE, me
     
     db = get_db()
     try:
-        cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+        cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
         
         if not cliente:
             await query.message.chat.send_message("❌ Error: Cliente no encontrado. Usa /start")
@@ -1355,10 +1284,15 @@ async def finalizar_pedido_directo(query, context: ContextTypes.DEFAULT_TYPE, me
             )
             db.add(item_pedido)
         
-        db.commit()
+        # La asignación se intenta aquí mismo: el despachador ignora este evento
+        registrar_evento(db, pedido, "creado", asignacion_inmediata=True)
+        await db.commit()
         
         # Asignar conductor
-        resultado_asignacion = asignar_conductor_a_pedido(db, codigo_pedido)
+        resultado_asignacion = await asignar_conductor_a_pedido(db, codigo_pedido, avisar_cliente=False)
+        if not resultado_asignacion["exito"]:
+            # Sin conductor por ahora: queda en la cola del despachador
+            despachador.notificar("pedido_creado", codigo_pedido)
         
         if resultado_asignacion["exito"]:
             conductor_info = resultado_asignacion["conductor"]
@@ -1366,7 +1300,7 @@ async def finalizar_pedido_directo(query, context: ContextTypes.DEFAULT_TYPE, me
             dist_cliente = None
             tiempo_estimado = None
             if cliente.latitud_ultima and cliente.longitud_ultima:
-                info_entrega = calcular_distancia_conductor_cliente(
+                info_entrega = await calcular_distancia_conductor_cliente(
                     db, 
                     conductor_info["codigo_conductor"],
                     float(cliente.latitud_ultima),
@@ -1419,10 +1353,10 @@ Te notificaremos cuando un conductor sea asignado.
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         await query.message.chat.send_message(f"❌ Error al procesar el pedido: {str(e)}")
     finally:
-        db.close()
+        await db.close()
 
 
 # ============ FINALIZAR PEDIDO ============
@@ -1436,7 +1370,7 @@ async def finalizar_pedido(query, context: ContextTypes.DEFAULT_TYPE, metodo_pag
     db = get_db()
     try:
         # Obtener cliente
-        cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+        cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
         
         if not cliente:
             await query.edit_message_text("❌ Error: Cliente no encontrado. Usa /start")
@@ -1471,10 +1405,15 @@ async def finalizar_pedido(query, context: ContextTypes.DEFAULT_TYPE, metodo_pag
             )
             db.add(item_pedido)
         
-        db.commit()
+        # La asignación se intenta aquí mismo: el despachador ignora este evento
+        registrar_evento(db, pedido, "creado", asignacion_inmediata=True)
+        await db.commit()
         
         # ============ ASIGNAR CONDUCTOR MÁS CERCANO ============
-        resultado_asignacion = asignar_conductor_a_pedido(db, codigo_pedido)
+        resultado_asignacion = await asignar_conductor_a_pedido(db, codigo_pedido, avisar_cliente=False)
+        if not resultado_asignacion["exito"]:
+            # Sin conductor por ahora: queda en la cola del despachador
+            despachador.notificar("pedido_creado", codigo_pedido)
         
         if resultado_asignacion["exito"]:
             conductor_info = resultado_asignacion["conductor"]
@@ -1483,7 +1422,7 @@ async def finalizar_pedido(query, context: ContextTypes.DEFAULT_TYPE, metodo_pag
             dist_cliente = None
             tiempo_estimado = None
             if cliente.latitud_ultima and cliente.longitud_ultima:
-                info_entrega = calcular_distancia_conductor_cliente(
+                info_entrega = await calcular_distancia_conductor_cliente(
                     db, 
                     conductor_info["codigo_conductor"],
                     float(cliente.latitud_ultima),
@@ -1533,10 +1472,10 @@ Te notificaremos cuando un conductor sea asignado.
         await query.edit_message_text(mensaje, parse_mode='Markdown')
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         await query.edit_message_text(f"❌ Error al procesar el pedido: {str(e)}")
     finally:
-        db.close()
+        await db.close()
 
 
 # ============ FUNCIONES DE SEGUIMIENTO DE PEDIDOS ============
@@ -1547,7 +1486,7 @@ async def mostrar_mis_pedidos(query, context: ContextTypes.DEFAULT_TYPE):
     db = get_db()
     try:
         # Obtener cliente
-        cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+        cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
         
         if not cliente or not cliente.telefono:
             keyboard = [[InlineKeyboardButton("🏠 Volver al Inicio", callback_data="volver_menu")]]
@@ -1559,9 +1498,9 @@ async def mostrar_mis_pedidos(query, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Obtener pedidos del cliente
-        pedidos = db.query(Pedido).filter(
+        pedidos = (await db.scalars(select(Pedido).where(
             Pedido.cliente_telefono == cliente.telefono
-        ).order_by(Pedido.fecha.desc()).limit(10).all()
+        ).order_by(Pedido.fecha.desc()).limit(10))).all()
         
         if not pedidos:
             keyboard = [[InlineKeyboardButton("🏠 Volver al Inicio", callback_data="volver_menu")]]
@@ -1585,16 +1524,18 @@ async def mostrar_mis_pedidos(query, context: ContextTypes.DEFAULT_TYPE):
         )
         
     finally:
-        db.close()
+        await db.close()
 
 
+@callbacks.prefijo("ver_pedido_")
+@callbacks.prefijo("actualizar_pedido_")
 async def mostrar_detalle_pedido(query, context: ContextTypes.DEFAULT_TYPE, codigo_pedido: str):
     """Muestra el detalle de un pedido específico"""
     from app.services.conductor_service import calcular_distancia_conductor_cliente
     
     db = get_db()
     try:
-        pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo_pedido).first()
+        pedido = await db.scalar(select(Pedido).where(Pedido.codigo_pedido == codigo_pedido))
         
         if not pedido:
             await query.edit_message_text("❌ Pedido no encontrado")
@@ -1614,11 +1555,11 @@ async def mostrar_detalle_pedido(query, context: ContextTypes.DEFAULT_TYPE, codi
         estado_texto = estado_emoji.get(pedido.estado, pedido.estado)
         
         # Obtener items del pedido
-        items = db.query(ItemPedido).filter(ItemPedido.codigo_pedido == codigo_pedido).all()
+        items = (await db.scalars(select(ItemPedido).where(ItemPedido.codigo_pedido == codigo_pedido))).all()
         
         items_texto = ""
         for item in items:
-            producto = db.query(Producto).filter(Producto.codigo_producto == item.codigo_producto).first()
+            producto = await db.scalar(select(Producto).where(Producto.codigo_producto == item.codigo_producto))
             nombre = producto.nombre if producto else item.codigo_producto
             items_texto += f"  • {item.cantidad}x {nombre} - Bs.{item.precio_unitario}\n"
         
@@ -1627,9 +1568,9 @@ async def mostrar_detalle_pedido(query, context: ContextTypes.DEFAULT_TYPE, codi
         tiene_conductor = False
         if pedido.conductor_codigo:
             tiene_conductor = True
-            conductor = db.query(Conductor).filter(
+            conductor = await db.scalar(select(Conductor).where(
                 Conductor.codigo_conductor == pedido.conductor_codigo
-            ).first()
+            ))
             
             if conductor:
                 conductor_texto = f"\n🚴 *REPARTIDOR:*\n"
@@ -1639,7 +1580,7 @@ async def mostrar_detalle_pedido(query, context: ContextTypes.DEFAULT_TYPE, codi
                 
                 # Calcular distancia al cliente si tiene ubicación
                 if conductor.latitud and conductor.longitud and pedido.latitud_destino and pedido.longitud_destino:
-                    info_distancia = calcular_distancia_conductor_cliente(
+                    info_distancia = await calcular_distancia_conductor_cliente(
                         db,
                         conductor.codigo_conductor,
                         float(pedido.latitud_destino),
@@ -1677,9 +1618,10 @@ async def mostrar_detalle_pedido(query, context: ContextTypes.DEFAULT_TYPE, codi
         )
         
     finally:
-        db.close()
+        await db.close()
 
 
+@callbacks.prefijo("ubicacion_conductor_")
 async def mostrar_ubicacion_conductor(query, context: ContextTypes.DEFAULT_TYPE, codigo_pedido: str):
     """Muestra la ubicación del conductor asignado al pedido con live location"""
     from app.services.conductor_service import calcular_distancia_conductor_cliente
@@ -1687,7 +1629,7 @@ async def mostrar_ubicacion_conductor(query, context: ContextTypes.DEFAULT_TYPE,
     
     db = get_db()
     try:
-        pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo_pedido).first()
+        pedido = await db.scalar(select(Pedido).where(Pedido.codigo_pedido == codigo_pedido))
         
         if not pedido or not pedido.conductor_codigo:
             keyboard = [[InlineKeyboardButton("🔙 Volver", callback_data=f"ver_pedido_{codigo_pedido}")]]
@@ -1697,9 +1639,9 @@ async def mostrar_ubicacion_conductor(query, context: ContextTypes.DEFAULT_TYPE,
             )
             return
         
-        conductor = db.query(Conductor).filter(
+        conductor = await db.scalar(select(Conductor).where(
             Conductor.codigo_conductor == pedido.conductor_codigo
-        ).first()
+        ))
         
         if not conductor:
             keyboard = [[InlineKeyboardButton("🔙 Volver", callback_data=f"ver_pedido_{codigo_pedido}")]]
@@ -1728,7 +1670,7 @@ async def mostrar_ubicacion_conductor(query, context: ContextTypes.DEFAULT_TYPE,
         tiempo_estimado = None
         
         if pedido.latitud_destino and pedido.longitud_destino:
-            info = calcular_distancia_conductor_cliente(
+            info = await calcular_distancia_conductor_cliente(
                 db,
                 conductor.codigo_conductor,
                 float(pedido.latitud_destino),
@@ -1807,10 +1749,11 @@ async def mostrar_ubicacion_conductor(query, context: ContextTypes.DEFAULT_TYPE,
             pass
         
     finally:
-        db.close()
+        await db.close()
 
 
 # ============ TRACKING EN VIVO ============
+@callbacks.prefijo("tracking_live_")
 async def iniciar_tracking_live(query, context: ContextTypes.DEFAULT_TYPE, codigo_pedido: str):
     """Inicia el tracking en vivo del conductor"""
     from datetime import datetime
@@ -1824,15 +1767,15 @@ async def iniciar_tracking_live(query, context: ContextTypes.DEFAULT_TYPE, codig
     
     db = get_db()
     try:
-        pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo_pedido).first()
+        pedido = await db.scalar(select(Pedido).where(Pedido.codigo_pedido == codigo_pedido))
         
         if not pedido or not pedido.conductor_codigo:
             await query.answer("❌ No hay conductor asignado")
             return
         
-        conductor = db.query(Conductor).filter(
+        conductor = await db.scalar(select(Conductor).where(
             Conductor.codigo_conductor == pedido.conductor_codigo
-        ).first()
+        ))
         
         if not conductor or not conductor.latitud or not conductor.longitud:
             await query.answer("❌ El conductor no tiene ubicación")
@@ -1855,7 +1798,7 @@ async def iniciar_tracking_live(query, context: ContextTypes.DEFAULT_TYPE, codig
             f"📦 Pedido: `{codigo_pedido}`\n"
             f"👤 Conductor: {conductor.nombre}\n"
             f"📞 Tel: {conductor.telefono}\n\n"
-            f"_Actualizando cada 10 segundos..._\n"
+            f"_Se actualiza mientras el conductor se mueve..._\n"
             f"🕐 {datetime.now().strftime('%H:%M:%S')}",
             parse_mode='Markdown',
             reply_markup=get_tracking_keyboard(codigo_pedido)
@@ -1867,11 +1810,16 @@ async def iniciar_tracking_live(query, context: ContextTypes.DEFAULT_TYPE, codig
                 chat_id=chat_id,
                 latitude=float(conductor.latitud),
                 longitude=float(conductor.longitud),
-                live_period=1800,  # 30 minutos
+                live_period=DURACION_LIVE_LOCATION_SEGUNDOS,  # 30 minutos
                 heading=None,
                 proximity_alert_radius=100
             )
             context.user_data[f'live_location_msg_{codigo_pedido}'] = live_msg.message_id
+            # Las actualizaciones las hace el job compartido de tracking
+            seguimiento.agregar(
+                context, chat_id, codigo_pedido, live_msg.message_id, conductor.codigo_conductor,
+                float(conductor.latitud), float(conductor.longitud)
+            )
         except Exception as e:
             # Si no funciona live location, usar ubicación normal
             location_msg = await context.bot.send_location(
@@ -1881,87 +1829,18 @@ async def iniciar_tracking_live(query, context: ContextTypes.DEFAULT_TYPE, codig
             )
             context.user_data[f'location_msg_{codigo_pedido}'] = location_msg.message_id
         
-        # Programar actualizaciones automáticas (si job_queue está disponible)
-        if context.job_queue:
-            context.job_queue.run_repeating(
-                actualizar_tracking_job,
-                interval=10,  # Cada 10 segundos
-                first=10,
-                chat_id=chat_id,
-                name=f"tracking_{codigo_pedido}_{chat_id}",
-                data={
-                    'codigo_pedido': codigo_pedido,
-                    'chat_id': chat_id,
-                    'conductor_codigo': conductor.codigo_conductor
-                }
-            )
-        
     finally:
-        db.close()
-
-
-async def actualizar_tracking_job(context: ContextTypes.DEFAULT_TYPE):
-    """Job que actualiza la ubicación del conductor periódicamente"""
-    from app.services.conductor_service import calcular_distancia_conductor_cliente
-    from datetime import datetime
-    
-    job = context.job
-    data = job.data
-    codigo_pedido = data['codigo_pedido']
-    chat_id = data['chat_id']
-    conductor_codigo = data['conductor_codigo']
-    
-    # Verificar si el tracking sigue activo
-    if not context.application.user_data.get(chat_id, {}).get(f'tracking_active_{codigo_pedido}'):
-        job.schedule_removal()
-        return
-    
-    db = get_db()
-    try:
-        conductor = db.query(Conductor).filter(
-            Conductor.codigo_conductor == conductor_codigo
-        ).first()
-        
-        pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo_pedido).first()
-        
-        if not conductor or not conductor.latitud or not pedido:
-            return
-        
-        # Si el pedido ya fue entregado, detener tracking
-        if pedido.estado in ["ENTREGADO", "CANCELADO"]:
-            context.application.user_data.get(chat_id, {})[f'tracking_active_{codigo_pedido}'] = False
-            job.schedule_removal()
-            return
-        
-        # Actualizar Live Location si existe
-        live_msg_id = context.application.user_data.get(chat_id, {}).get(f'live_location_msg_{codigo_pedido}')
-        if live_msg_id:
-            try:
-                await context.bot.edit_message_live_location(
-                    chat_id=chat_id,
-                    message_id=live_msg_id,
-                    latitude=float(conductor.latitud),
-                    longitude=float(conductor.longitud)
-                )
-            except:
-                pass
-        
-    finally:
-        db.close()
+        await db.close()
 
 
+@callbacks.prefijo("stop_tracking_")
 async def detener_tracking_live(query, context: ContextTypes.DEFAULT_TYPE, codigo_pedido: str):
     """Detiene el tracking en vivo"""
     chat_id = query.message.chat_id
     
     # Marcar tracking como inactivo
     context.user_data[f'tracking_active_{codigo_pedido}'] = False
-    
-    # Cancelar el job de actualización (si job_queue está disponible)
-    if context.job_queue:
-        current_jobs = context.job_queue.get_jobs_by_name(f"tracking_{codigo_pedido}_{chat_id}")
-        for job in current_jobs:
-            job.schedule_removal()
+    seguimiento.quitar(chat_id, codigo_pedido)
     
     # Eliminar mensaje de live location
     live_msg_id = context.user_data.get(f'live_location_msg_{codigo_pedido}')
@@ -2011,15 +1890,7 @@ async def limpiar_mensajes_ubicacion(query, context: ContextTypes.DEFAULT_TYPE):
         # Desactivar trackings activos
         if key.startswith('tracking_active_'):
             context.user_data[key] = False
-            codigo_pedido = key.replace('tracking_active_', '')
-            # Cancelar jobs si existen
-            if context.job_queue:
-                try:
-                    current_jobs = context.job_queue.get_jobs_by_name(f"tracking_{codigo_pedido}_{chat_id}")
-                    for job in current_jobs:
-                        job.schedule_removal()
-                except:
-                    pass
+            seguimiento.quitar(chat_id, key.replace('tracking_active_', ''))
     
     # Limpiar las keys
     for key in keys_to_remove:
@@ -2034,11 +1905,11 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     db = get_db()
     try:
-        cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+        cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
         if cliente:
             cliente.latitud_ultima = location.latitude
             cliente.longitud_ultima = location.longitude
-            db.commit()
+            await db.commit()
         
         await update.message.reply_text(
             f"📍 *Ubicación guardada*\n\n"
@@ -2049,7 +1920,7 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_metodo_pago_keyboard()
         )
     finally:
-        db.close()
+        await db.close()
 
 
 # ============ MANEJAR TEXTO GENERAL ============
@@ -2082,12 +1953,12 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         db = get_db()
         try:
             # Verificar si el usuario ya existe
-            cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+            cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
             
             if cliente:
                 # Actualizar teléfono
                 cliente.telefono = text
-                db.commit()
+                await db.commit()
                 await update.message.reply_text(
                     f"✅ *¡Teléfono actualizado!*\n\n📱 {text}\n\nYa puedes hacer tus pedidos 🍔",
                     parse_mode='Markdown',
@@ -2101,20 +1972,20 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     nombre=user.first_name
                 )
                 db.add(cliente)
-                db.commit()
+                await db.commit()
                 await update.message.reply_text(
                     f"✅ *¡Teléfono registrado!*\n\n📱 {text}\n\nYa puedes hacer tus pedidos 🍔",
                     parse_mode='Markdown',
                     reply_markup=get_main_menu_keyboard()
                 )
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             await update.message.reply_text(
                 "❌ Error al guardar el teléfono. Intenta de nuevo.",
                 reply_markup=get_main_menu_keyboard()
             )
         finally:
-            db.close()
+            await db.close()
         return
     
     # Si no es un comando conocido, mostrar menú
@@ -2138,7 +2009,7 @@ async def mispedidos_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     db = get_db()
     try:
         # Obtener cliente
-        cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+        cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
         
         if not cliente or not cliente.telefono:
             await update.message.reply_text(
@@ -2149,9 +2020,9 @@ async def mispedidos_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
         
         # Obtener pedidos del cliente
-        pedidos = db.query(Pedido).filter(
+        pedidos = (await db.scalars(select(Pedido).where(
             Pedido.cliente_telefono == cliente.telefono
-        ).order_by(Pedido.fecha.desc()).limit(10).all()
+        ).order_by(Pedido.fecha.desc()).limit(10))).all()
         
         if not pedidos:
             await update.message.reply_text(
@@ -2174,7 +2045,7 @@ async def mispedidos_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         
     finally:
-        db.close()
+        await db.close()
 
 
 # ============ COMANDO /rastrear ============
@@ -2198,7 +2069,7 @@ async def rastrear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     db = get_db()
     try:
-        pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo_pedido).first()
+        pedido = await db.scalar(select(Pedido).where(Pedido.codigo_pedido == codigo_pedido))
         
         if not pedido:
             await update.message.reply_text(
@@ -2210,7 +2081,7 @@ async def rastrear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Verificar que el pedido pertenece al usuario
-        cliente = db.query(ClienteBot).filter(ClienteBot.chat_id == chat_id).first()
+        cliente = await db.scalar(select(ClienteBot).where(ClienteBot.chat_id == chat_id))
         if cliente and pedido.cliente_telefono != cliente.telefono:
             await update.message.reply_text(
                 "❌ Este pedido no te pertenece.",
@@ -2244,7 +2115,7 @@ async def rastrear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     finally:
-        db.close()
+        await db.close()
 
 
 # ============ COMANDO /cancelar ============
@@ -2272,13 +2143,13 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db = get_db()
     try:
         # Verificar si ya existe un cliente con ese teléfono
-        cliente_existente = db.query(ClienteBot).filter(ClienteBot.telefono == telefono).first()
+        cliente_existente = await db.scalar(select(ClienteBot).where(ClienteBot.telefono == telefono))
         
         if cliente_existente:
             # Actualizar chat_id si es diferente
             cliente_existente.chat_id = chat_id
             cliente_existente.nombre = user.first_name
-            db.commit()
+            await db.commit()
         else:
             # Crear nuevo cliente con el teléfono real
             cliente = ClienteBot(
@@ -2287,7 +2158,7 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 nombre=contact.first_name or user.first_name
             )
             db.add(cliente)
-            db.commit()
+            await db.commit()
         
         await update.message.reply_text(
             f"✅ *¡Teléfono registrado!*\n\n"
@@ -2297,13 +2168,13 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_main_menu_keyboard()
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         await update.message.reply_text(
             f"❌ Error al registrar: {str(e)}\n\nIntenta de nuevo con /start",
             reply_markup=get_main_menu_keyboard()
         )
     finally:
-        db.close()
+        await db.close()
 
 
 # ============ OMITIR TELÉFONO ============
@@ -2321,7 +2192,7 @@ async def handle_omitir_telefono(update: Update, context: ContextTypes.DEFAULT_T
             nombre=user.first_name
         )
         db.add(cliente)
-        db.commit()
+        await db.commit()
         
         await update.message.reply_text(
             "👍 *¡Sin problema!*\n\n"
@@ -2331,10 +2202,10 @@ async def handle_omitir_telefono(update: Update, context: ContextTypes.DEFAULT_T
             reply_markup=get_main_menu_keyboard()
         )
     except:
-        db.rollback()
+        await db.rollback()
         await update.message.reply_text(
             "Ya tienes una cuenta. ¡Bienvenido de nuevo!",
             reply_markup=get_main_menu_keyboard()
         )
     finally:
-        db.close()
+        await db.close()
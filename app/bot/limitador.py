@@ -0,0 +1,316 @@
+"""
+Limitador de envíos del bot
+Todas las llamadas a Telegram que envían o editan mensajes pasan por una cola
+con prioridades y se despachan respetando los límites de Telegram: uno global
+del bot y uno por chat (token buckets). Las ediciones del mismo mensaje que
+todavía esperan en la cola se combinan en una sola (la última).
+
+Prioridades (rate_limit_args de los métodos del bot; por defecto se deduce
+del endpoint):
+    PRIORIDAD_INTERACTIVA: respuestas a lo que el usuario acaba de hacer
+    PRIORIDAD_AVISO: avisos de cambios de estado de los pedidos
+    PRIORIDAD_TRACKING: ediciones de Live Location
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_AVISO = 1
+PRIORIDAD_TRACKING = 2
+PRIORIDADES = (PRIORIDAD_INTERACTIVA, PRIORIDAD_AVISO, PRIORIDAD_TRACKING)
+NOMBRES_PRIORIDAD = {
+    PRIORIDAD_INTERACTIVA: "interactiva",
+    PRIORIDAD_AVISO: "aviso",
+    PRIORIDAD_TRACKING: "tracking",
+}
+
+# Límites de Telegram: ~30 mensajes/s por bot, ~1 mensaje/s por chat privado
+# (admite ráfagas cortas) y 20 mensajes/min por grupo
+MENSAJES_POR_SEGUNDO = 25
+RAFAGA_GLOBAL = 30
+MENSAJES_POR_SEGUNDO_CHAT = 1.0
+RAFAGA_CHAT = 3
+MENSAJES_POR_MINUTO_GRUPO = 20
+
+# Reintentos de un envío que recibe 429 (RetryAfter)
+MAX_REINTENTOS_429 = 3
+
+# Endpoints que no cuentan para los límites de mensajes
+PREFIJOS_LIMITADOS = ("send", "edit", "copy", "forward", "stop")
+
+# Ediciones que se pueden combinar si el mismo mensaje ya tiene una en cola
+ENDPOINTS_COMBINABLES = (
+    "editMessageText",
+    "editMessageCaption",
+    "editMessageReplyMarkup",
+    "editMessageLiveLocation",
+)
+
+
+def _es_grupo(chat_id) -> bool:
+    """Grupos y canales tienen id negativo (o @nombre)"""
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        return chat_id is not None
+
+
+class CuboTokens:
+    """Token bucket: `tasa` tokens por segundo hasta `capacidad`"""
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.actualizado = time.monotonic()
+
+    def _recargar(self, ahora: float):
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+
+    def espera(self, ahora: float) -> float:
+        """Segundos hasta que haya un token (0 si ya hay)"""
+        self._recargar(ahora)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.tasa
+
+    def consumir(self, ahora: float):
+        self._recargar(ahora)
+        self.tokens -= 1
+
+    def lleno(self, ahora: float) -> bool:
+        self._recargar(ahora)
+        return self.tokens >= self.capacidad
+
+
+class LimitadorEnvios(BaseRateLimiter[int]):
+    """
+    Rate limiter del bot (Application.builder().rate_limiter(...)).
+    Una task despacha la cola: toma el primer envío de la prioridad más alta
+    cuyo chat tenga token, y lo ejecuta en segundo plano.
+    """
+
+    def __init__(self):
+        self._global = CuboTokens(MENSAJES_POR_SEGUNDO, RAFAGA_GLOBAL)
+        self._chats: dict = {}
+        # prioridad -> chat_id -> envíos en orden de llegada
+        self._colas: dict[int, OrderedDict] = {prioridad: OrderedDict() for prioridad in PRIORIDADES}
+        # (endpoint, chat_id, message_id) -> envío en cola (para combinar ediciones)
+        self._ediciones: dict[tuple, dict] = {}
+        self._pausa_hasta = 0.0
+        self._hay_envios: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._en_curso: set[asyncio.Task] = set()
+        self.enviados = {prioridad: 0 for prioridad in PRIORIDADES}
+        self.combinados = 0
+        self.reintentos_429 = 0
+        self.fallidos = 0
+
+    async def initialize(self):
+        self._hay_envios = asyncio.Event()
+        self._task = asyncio.create_task(self._despachar())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._en_curso:
+            await asyncio.gather(*self._en_curso, return_exceptions=True)
+        # Lo que quedó en cola no se va a enviar
+        for cola in self._colas.values():
+            for envios in cola.values():
+                for envio in envios:
+                    for futuro in envio["futuros"]:
+                        if not futuro.done():
+                            futuro.cancel()
+            cola.clear()
+        self._ediciones.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(PREFIJOS_LIMITADOS) or self._task is None:
+            return await callback(*args, **kwargs)
+
+        prioridad = rate_limit_args if rate_limit_args in PRIORIDADES else self._prioridad_por_defecto(endpoint)
+        chat_id = data.get("chat_id")
+        futuro = asyncio.get_running_loop().create_future()
+
+        clave_edicion = None
+        if endpoint in ENDPOINTS_COMBINABLES:
+            clave_edicion = (endpoint, chat_id, data.get("message_id"), data.get("inline_message_id"))
+            pendiente = self._ediciones.get(clave_edicion)
+            if pendiente is not None:
+                # Aún no se envió: se reemplaza por la edición más nueva, con
+                # la prioridad más alta de las dos
+                pendiente["llamada"] = (callback, args, kwargs)
+                pendiente["futuros"].append(futuro)
+                if prioridad < pendiente["prioridad"]:
+                    self._cambiar_prioridad(pendiente, prioridad)
+                self.combinados += 1
+                return await futuro
+
+        envio = {
+            "llamada": (callback, args, kwargs),
+            "futuros": [futuro],
+            "chat_id": chat_id,
+            "prioridad": prioridad,
+            "clave_edicion": clave_edicion,
+            "reintentos": 0
+        }
+        self._encolar(envio)
+        return await futuro
+
+    def metricas(self) -> dict:
+        return {
+            "en_cola": {
+                NOMBRES_PRIORIDAD[prioridad]: sum(len(envios) for envios in self._colas[prioridad].values())
+                for prioridad in PRIORIDADES
+            },
+            "en_curso": len(self._en_curso),
+            "enviados": {NOMBRES_PRIORIDAD[prioridad]: total for prioridad, total in self.enviados.items()},
+            "ediciones_combinadas": self.combinados,
+            "reintentos_429": self.reintentos_429,
+            "fallidos": self.fallidos,
+            "pausa_restante_segundos": round(max(0.0, self._pausa_hasta - time.monotonic()), 1)
+        }
+
+    @staticmethod
+    def _prioridad_por_defecto(endpoint: str) -> int:
+        if endpoint in ("editMessageLiveLocation", "stopMessageLiveLocation"):
+            return PRIORIDAD_TRACKING
+        return PRIORIDAD_INTERACTIVA
+
+    def _encolar(self, envio: dict, al_frente: bool = False):
+        cola = self._colas[envio["prioridad"]]
+        envios = cola.get(envio["chat_id"])
+        if envios is None:
+            envios = cola[envio["chat_id"]] = deque()
+        if al_frente:
+            envios.appendleft(envio)
+        else:
+            envios.append(envio)
+        if envio["clave_edicion"] is not None:
+            # Un reintento (429) no le quita la clave a una edición más nueva
+            # del mismo mensaje que ya está en cola: las siguientes se combinan
+            # con esa, que se envía después
+            self._ediciones.setdefault(envio["clave_edicion"], envio)
+        self._hay_envios.set()
+
+    def _cambiar_prioridad(self, envio: dict, prioridad: int):
+        """Pasa un envío en cola a la cola de otra prioridad (al final de su chat)"""
+        cola = self._colas[envio["prioridad"]]
+        envios = cola[envio["chat_id"]]
+        for i, otro in enumerate(envios):
+            if otro is envio:
+                del envios[i]
+                break
+        if not envios:
+            del cola[envio["chat_id"]]
+        envio["prioridad"] = prioridad
+        self._encolar(envio)
+
+    def _cubo_chat(self, chat_id) -> CuboTokens:
+        cubo = self._chats.get(chat_id)
+        if cubo is None:
+            if _es_grupo(chat_id):
+                cubo = CuboTokens(MENSAJES_POR_MINUTO_GRUPO / 60, RAFAGA_CHAT)
+            else:
+                cubo = CuboTokens(MENSAJES_POR_SEGUNDO_CHAT, RAFAGA_CHAT)
+            self._chats[chat_id] = cubo
+        return cubo
+
+    def _siguiente(self, ahora: float) -> tuple[dict | None, float]:
+        """
+        Primer envío listo (prioridad más alta, chats en ronda) o, si no hay
+        ninguno, los segundos hasta que alguno lo esté
+        """
+        espera = None
+        for prioridad in PRIORIDADES:
+            cola = self._colas[prioridad]
+            for chat_id in list(cola):
+                espera_chat = self._cubo_chat(chat_id).espera(ahora)
+                if espera_chat > 0:
+                    espera = espera_chat if espera is None else min(espera, espera_chat)
+                    continue
+                envios = cola[chat_id]
+                envio = envios.popleft()
+                if envios:
+                    cola.move_to_end(chat_id)
+                else:
+                    del cola[chat_id]
+                return envio, 0.0
+        return None, espera if espera is not None else 1.0
+
+    async def _despachar(self):
+        while True:
+            ahora = time.monotonic()
+            if self._pausa_hasta > ahora:
+                # Telegram pidió esperar (429): se frena todo
+                await asyncio.sleep(self._pausa_hasta - ahora)
+                continue
+
+            espera_global = self._global.espera(ahora)
+            if espera_global > 0:
+                await asyncio.sleep(espera_global)
+                continue
+
+            envio, espera = self._siguiente(ahora)
+            if envio is None:
+                self._hay_envios.clear()
+                try:
+                    await asyncio.wait_for(self._hay_envios.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global.consumir(ahora)
+            self._cubo_chat(envio["chat_id"]).consumir(ahora)
+            if envio["clave_edicion"] is not None:
+                self._ediciones.pop(envio["clave_edicion"], None)
+            tarea = asyncio.create_task(self._ejecutar(envio))
+            self._en_curso.add(tarea)
+            tarea.add_done_callback(self._en_curso.discard)
+            self._limpiar_chats(ahora)
+
+    async def _ejecutar(self, envio: dict):
+        callback, args, kwargs = envio["llamada"]
+        try:
+            resultado = await callback(*args, **kwargs)
+        except RetryAfter as e:
+            self.reintentos_429 += 1
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + float(e.retry_after))
+            envio["reintentos"] += 1
+            if envio["reintentos"] <= MAX_REINTENTOS_429:
+                self._encolar(envio, al_frente=True)
+                return
+            self._resolver(envio, excepcion=e)
+        except Exception as e:
+            self._resolver(envio, excepcion=e)
+        else:
+            self.enviados[envio["prioridad"]] += 1
+            self._resolver(envio, resultado=resultado)
+
+    def _resolver(self, envio: dict, resultado=None, excepcion: Exception | None = None):
+        if excepcion is not None:
+            self.fallidos += 1
+        for futuro in envio["futuros"]:
+            if futuro.done():
+                continue
+            if excepcion is not None:
+                futuro.set_exception(excepcion)
+            else:
+                futuro.set_result(resultado)
+
+    def _limpiar_chats(self, ahora: float):
+        """Olvida los cubos de chats inactivos (ya recargados del todo)"""
+        if len(self._chats) < 10_000:
+            return
+        en_cola = {chat_id for cola in self._colas.values() for chat_id in cola}
+        for chat_id in [c for c, cubo in self._chats.items() if c not in en_cola and cubo.lleno(ahora)]:
+            del self._chats[chat_id]
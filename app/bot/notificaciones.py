@@ -0,0 +1,209 @@
+"""
+Avisos a los clientes del bot
+Cuando un pedido pasa a ASIGNADO, ACEPTADO, EN_CAMINO o ENTREGADO (por
+cualquier camino: API, endpoints del conductor, asignación automática) el
+bus de eventos de pedidos lo entrega aquí y se le envía un mensaje al chat
+del cliente. Los eventos se juntan en lotes: una sola consulta resuelve el
+chat y el conductor de todo el lote; los envíos los despacha el limitador
+del bot, detrás de las respuestas interactivas.
+
+Con varias réplicas del bot (modo webhook) todas reciben los mismos eventos:
+cada una reclama los suyos en evento_pedido.avisado y solo avisa la que lo
+reclamó.
+"""
+import asyncio
+from sqlalchemy import select, update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden
+from telegram.ext import Application
+from app.bot.limitador import PRIORIDAD_AVISO
+from app.database import AsyncSessionLocal
+from app.models import ClienteBot, Conductor, EventoPedido, Pedido
+from app.services.eventos_pedido import relay_eventos
+
+
+# Tiempo que se esperan más eventos antes de enviar un lote
+ESPERA_LOTE_SEGUNDOS = 0.5
+MAX_EVENTOS_LOTE = 200
+
+# Tipos de evento que cambian el estado del pedido
+TIPOS_AVISADOS = ("asignado", "aceptado", "estado")
+
+
+def _texto_asignado(codigo: str, conductor: dict) -> str:
+    return (
+        f"🚗 *¡Tu pedido tiene conductor!*\n\n"
+        f"📦 Pedido: `{codigo}`\n"
+        f"👤 Conductor: {conductor['nombre']}\n"
+        f"📞 Tel: {conductor['telefono']}"
+    )
+
+
+def _texto_aceptado(codigo: str, conductor: dict) -> str:
+    return (
+        f"✅ *{conductor['nombre']} aceptó tu pedido*\n\n"
+        f"📦 Pedido: `{codigo}`\n"
+        f"Va camino al restaurante."
+    )
+
+
+def _texto_en_camino(codigo: str, conductor: dict) -> str:
+    return (
+        f"🚴 *¡Tu pedido va en camino!*\n\n"
+        f"📦 Pedido: `{codigo}`\n"
+        f"Puedes seguir al conductor en vivo."
+    )
+
+
+def _texto_entregado(codigo: str, conductor: dict) -> str:
+    return (
+        f"🎉 *¡Pedido entregado!*\n\n"
+        f"📦 Pedido: `{codigo}`\n"
+        f"¡Gracias por tu compra, buen provecho!"
+    )
+
+
+# Estado -> (texto, botones extra)
+AVISOS_POR_ESTADO = {
+    "ASIGNADO": (_texto_asignado, []),
+    "ACEPTADO": (_texto_aceptado, []),
+    "EN_CAMINO": (_texto_en_camino, [("📍 Seguir en vivo", "tracking_live_{codigo}")]),
+    "ENTREGADO": (_texto_entregado, []),
+}
+
+
+class NotificadorClientes:
+    """
+    Cola de avisos del bot: recibe los eventos de pedidos (en el event loop
+    del bot) y una task los envía por lotes.
+    """
+
+    def __init__(self):
+        self._application: Application | None = None
+        self._cola: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self.avisos_enviados = 0
+        self.avisos_fallidos = 0
+
+    @property
+    def pendientes(self) -> int:
+        return self._cola.qsize() if self._cola is not None else 0
+
+    def iniciar(self, application: Application):
+        """Empieza a avisar (solo en el proceso donde corre el bot)"""
+        self._application = application
+        self._cola = asyncio.Queue()
+        relay_eventos.suscribir(self.recibir_evento)
+        self._task = asyncio.create_task(self._ejecutar())
+
+    async def detener(self):
+        relay_eventos.desuscribir(self.recibir_evento)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._cola = None
+
+    def recibir_evento(self, evento: dict):
+        """Suscriptor del bus de eventos de pedidos"""
+        if self._cola is None:
+            return
+        if evento["tipo"] not in TIPOS_AVISADOS or evento["estado"] not in AVISOS_POR_ESTADO:
+            return
+        datos = evento["datos"]
+        # El bot ya le mostró la asignación al cliente; o el estado no cambió
+        if datos.get("avisar_cliente") is False or datos.get("anterior") == evento["estado"]:
+            return
+        self._cola.put_nowait(evento)
+
+    async def _ejecutar(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await self._cola.get()]
+            fin = loop.time() + ESPERA_LOTE_SEGUNDOS
+            while len(lote) < MAX_EVENTOS_LOTE:
+                restante = fin - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._enviar_lote(lote)
+            except Exception as e:
+                print(f"❌ Error al enviar avisos de pedidos: {e}")
+
+    async def _enviar_lote(self, lote: list):
+        # Si un pedido cambió varias veces en el lote, solo se avisa el último estado
+        ultimos = {}
+        for evento in lote:
+            ultimos.pop(evento["codigo_pedido"], None)
+            ultimos[evento["codigo_pedido"]] = evento
+
+        async with AsyncSessionLocal() as db:
+            reclamados = set((await db.execute(
+                update(EventoPedido)
+                .where(
+                    EventoPedido.id.in_([evento["id"] for evento in ultimos.values()]),
+                    EventoPedido.avisado.is_(False)
+                )
+                .values(avisado=True)
+                .returning(EventoPedido.codigo_pedido)
+            )).scalars())
+            await db.commit()
+            ultimos = {codigo: evento for codigo, evento in ultimos.items() if codigo in reclamados}
+            if not ultimos:
+                return
+
+            filas = (await db.execute(
+                select(
+                    Pedido.codigo_pedido,
+                    ClienteBot.chat_id,
+                    Conductor.nombre,
+                    Conductor.telefono
+                )
+                .join(ClienteBot, ClienteBot.telefono == Pedido.cliente_telefono)
+                .outerjoin(Conductor, Conductor.codigo_conductor == Pedido.conductor_codigo)
+                .where(Pedido.codigo_pedido.in_(list(ultimos)))
+            )).all()
+        destinos = {fila.codigo_pedido: fila for fila in filas}
+
+        envios = []
+        for codigo, evento in ultimos.items():
+            fila = destinos.get(codigo)
+            if fila is None or not fila.chat_id:
+                continue
+            texto, botones = AVISOS_POR_ESTADO[evento["estado"]]
+            conductor = {"nombre": fila.nombre or "El conductor", "telefono": fila.telefono or "-"}
+            teclado = [
+                [InlineKeyboardButton(etiqueta, callback_data=callback.format(codigo=codigo))]
+                for etiqueta, callback in botones
+            ]
+            teclado.append([InlineKeyboardButton("📦 Ver Pedido", callback_data=f"ver_pedido_{codigo}")])
+            envios.append(self._enviar(fila.chat_id, texto(codigo, conductor), InlineKeyboardMarkup(teclado)))
+        await asyncio.gather(*envios)
+
+    async def _enviar(self, chat_id: str, texto: str, teclado: InlineKeyboardMarkup):
+        try:
+            await self._application.bot.send_message(
+                chat_id=chat_id,
+                text=texto,
+                parse_mode='Markdown',
+                reply_markup=teclado,
+                rate_limit_args=PRIORIDAD_AVISO
+            )
+            self.avisos_enviados += 1
+        except Forbidden:
+            # El cliente bloqueó el bot
+            self.avisos_fallidos += 1
+        except Exception as e:
+            self.avisos_fallidos += 1
+            print(f"⚠️ No se pudo avisar al chat {chat_id}: {e}")
+
+
+# Instancia única del proceso
+notificador_clientes = NotificadorClientes()
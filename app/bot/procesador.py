@@ -0,0 +1,89 @@
+"""
+Procesamiento concurrente de updates del bot
+Por defecto python-telegram-bot atiende un update a la vez: un cliente
+esperando el pago QR (varios segundos de sleep) o una consulta lenta demora
+los botones de todos los demás. ProcesadorPorChat atiende hasta N updates en
+paralelo, pero los de un mismo chat en orden de llegada y de a uno, así las
+modificaciones de context.user_data (carrito, pasos del pago) no compiten.
+"""
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# Updates aceptados a la vez (en proceso o esperando el turno de su chat);
+# lo que realmente corre en paralelo lo limita `trabajadores`
+MAX_UPDATES_EN_VUELO = 10_000
+
+
+def _clave_chat(update: object):
+    """Chat (o usuario) al que pertenece el update; None si no tiene"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return ("usuario", update.effective_user.id)
+    return None
+
+
+class ProcesadorPorChat(BaseUpdateProcessor):
+    """
+    Update processor de la Application (builder().concurrent_updates(...)).
+    Cada update espera primero el turno de su chat y después un trabajador
+    libre, así los updates encolados de un chat no ocupan trabajadores.
+    """
+
+    def __init__(self, trabajadores: int):
+        # El semáforo de la clase base solo acota los updates en vuelo
+        super().__init__(MAX_UPDATES_EN_VUELO)
+        self.trabajadores = trabajadores
+        self._semaforo_trabajadores = asyncio.BoundedSemaphore(trabajadores)
+        # chat -> [lock, updates del chat en vuelo]
+        self._chats: dict = {}
+        self.en_proceso = 0
+        self.procesados = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update: object, coroutine):
+        clave = _clave_chat(update)
+        if clave is None:
+            await self._procesar(coroutine)
+            return
+
+        chat = self._chats.get(clave)
+        if chat is None:
+            chat = self._chats[clave] = [asyncio.Lock(), 0]
+        chat[1] += 1
+        try:
+            # asyncio.Lock despierta a los que esperan en orden de llegada
+            async with chat[0]:
+                await self._procesar(coroutine)
+        finally:
+            chat[1] -= 1
+            if not chat[1]:
+                del self._chats[clave]
+
+    async def _procesar(self, coroutine):
+        async with self._semaforo_trabajadores:
+            self.en_proceso += 1
+            try:
+                await coroutine
+            finally:
+                self.en_proceso -= 1
+                self.procesados += 1
+
+    def estadisticas(self) -> dict:
+        en_vuelo = sum(updates for _, updates in self._chats.values())
+        return {
+            "trabajadores": self.trabajadores,
+            "en_proceso": self.en_proceso,
+            "esperando_turno": max(0, en_vuelo - self.en_proceso),
+            "chats_activos": len(self._chats),
+            "procesados": self.procesados
+        }
@@ -0,0 +1,243 @@
+"""
+Tracking en vivo de pedidos en el bot
+Un solo job periódico actualiza todas las ubicaciones en vivo (Live Location)
+abiertas: lee con una consulta el estado de los pedidos seguidos y la
+posición de sus conductores, y reparte las ediciones en paralelo (el
+limitador de envíos del bot las despacha con la prioridad más baja).
+
+Cada mensaje se refresca con una cadencia que depende del estado del pedido
+(y de la cercanía al destino), y solo se edita si el conductor se movió más
+de UMBRAL_MOVIMIENTO_METROS desde la última posición enviada.
+"""
+import asyncio
+import time
+from sqlalchemy import select
+from telegram.error import BadRequest
+from telegram.ext import Application, ContextTypes
+from app.bot.limitador import PRIORIDAD_TRACKING
+from app.database import AsyncSessionLocal
+from app.models import Conductor, Pedido
+from app.services.conductor_service import calcular_distancia_haversine
+
+
+# Cada cuánto corre el job de tracking (la cadencia más rápida posible)
+INTERVALO_TRACKING_SEGUNDOS = 5
+
+# Segundos entre refrescos de un mensaje según el estado del pedido
+CADENCIA_POR_ESTADO = {
+    "ASIGNADO": 30,
+    "ACEPTADO": 20,
+    "EN_RESTAURANTE": 30,  # El conductor espera el pedido: casi no se mueve
+    "RECOGIO_PEDIDO": 10,
+    "EN_CAMINO": 10,
+}
+CADENCIA_POR_DEFECTO = 15
+
+# En camino y cerca del destino se refresca más seguido
+DISTANCIA_CERCA_DESTINO_KM = 1.0
+CADENCIA_CERCA_DESTINO = 5
+
+# Movimiento mínimo para volver a editar la Live Location
+UMBRAL_MOVIMIENTO_METROS = 25
+
+# Duración de la Live Location enviada (después Telegram no admite ediciones)
+DURACION_LIVE_LOCATION_SEGUNDOS = 1800
+
+NOMBRE_JOB = "tracking_en_vivo"
+
+ESTADOS_FINALES = ("ENTREGADO", "CANCELADO")
+
+
+class SeguimientoEnVivo:
+    """
+    Mensajes de Live Location abiertos, por (chat_id, codigo_pedido).
+    Los handlers los agregan/quitan; el job tick() actualiza los que toca
+    refrescar en cada pasada.
+    """
+
+    def __init__(self):
+        # (chat_id, codigo_pedido) -> {"message_id", "conductor_codigo", "vence",
+        #                              "proximo", "enviada": (lat, lng) | None}
+        self._mensajes: dict[tuple, dict] = {}
+        self.ediciones_enviadas = 0
+        self.ediciones_omitidas = 0  # Sin movimiento suficiente
+        self.ediciones_sin_cambios = 0  # Telegram: "message is not modified"
+        self.ediciones_fallidas = 0
+
+    @property
+    def total(self) -> int:
+        return len(self._mensajes)
+
+    def agregar(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, codigo_pedido: str,
+                message_id: int, conductor_codigo: str, latitud: float | None = None,
+                longitud: float | None = None):
+        """
+        Empieza a seguir un mensaje de Live Location (y arranca el job si hace falta)
+
+        Args:
+            latitud, longitud: Posición con la que se envió el mensaje
+        """
+        ahora = time.monotonic()
+        self._mensajes[(chat_id, codigo_pedido)] = {
+            "message_id": message_id,
+            "conductor_codigo": conductor_codigo,
+            "vence": ahora + DURACION_LIVE_LOCATION_SEGUNDOS,
+            "proximo": ahora + INTERVALO_TRACKING_SEGUNDOS,
+            "enviada": (latitud, longitud) if latitud is not None and longitud is not None else None
+        }
+        if context.job_queue and not context.job_queue.get_jobs_by_name(NOMBRE_JOB):
+            context.job_queue.run_repeating(
+                self.tick,
+                interval=INTERVALO_TRACKING_SEGUNDOS,
+                first=INTERVALO_TRACKING_SEGUNDOS,
+                name=NOMBRE_JOB
+            )
+
+    def quitar(self, chat_id: int, codigo_pedido: str):
+        self._mensajes.pop((chat_id, codigo_pedido), None)
+
+    def estadisticas(self) -> dict:
+        return {
+            "mensajes": self.total,
+            "ediciones_enviadas": self.ediciones_enviadas,
+            "ediciones_omitidas": self.ediciones_omitidas,
+            "ediciones_sin_cambios": self.ediciones_sin_cambios,
+            "ediciones_fallidas": self.ediciones_fallidas
+        }
+
+    async def tick(self, context: ContextTypes.DEFAULT_TYPE):
+        """Job: una consulta para los pedidos que toca refrescar y ediciones en paralelo"""
+        ahora = time.monotonic()
+        for clave, mensaje in list(self._mensajes.items()):
+            if mensaje["vence"] <= ahora:
+                self._finalizar(context.application, *clave)
+
+        pendientes = [clave for clave, mensaje in self._mensajes.items() if mensaje["proximo"] <= ahora]
+        if not pendientes:
+            return
+
+        estados = await self._leer_estados({codigo for _, codigo in pendientes})
+
+        ediciones = []
+        for chat_id, codigo_pedido in pendientes:
+            mensaje = self._mensajes.get((chat_id, codigo_pedido))
+            estado = estados.get(codigo_pedido)
+            if mensaje is None or estado is None:
+                continue
+            if estado["estado"] in ESTADOS_FINALES:
+                self._finalizar(context.application, chat_id, codigo_pedido)
+                continue
+            # Si se reasignó el pedido, se sigue al conductor nuevo
+            if estado["conductor_codigo"]:
+                mensaje["conductor_codigo"] = estado["conductor_codigo"]
+            mensaje["proximo"] = ahora + _cadencia(estado)
+            if estado["latitud"] is None or estado["longitud"] is None:
+                continue
+            posicion = (estado["latitud"], estado["longitud"])
+            if not _se_movio(mensaje["enviada"], posicion):
+                self.ediciones_omitidas += 1
+                continue
+            ediciones.append(self._editar(context, chat_id, codigo_pedido, mensaje, posicion))
+
+        await asyncio.gather(*ediciones)
+
+    async def _leer_estados(self, codigos: set) -> dict:
+        """
+        Estado, conductor y posición de cada pedido seguido (un solo SELECT).
+        La posición sale del almacén de posiciones si este proceso tiene
+        una más nueva que la guardada en la BD.
+        """
+        from app.services.ubicacion_service import almacen_posiciones
+
+        async with AsyncSessionLocal() as db:
+            filas = (await db.execute(
+                select(
+                    Pedido.codigo_pedido,
+                    Pedido.estado,
+                    Pedido.conductor_codigo,
+                    Pedido.latitud_destino,
+                    Pedido.longitud_destino,
+                    Conductor.latitud,
+                    Conductor.longitud,
+                    Conductor.ultima_actualizacion
+                )
+                .outerjoin(Conductor, Conductor.codigo_conductor == Pedido.conductor_codigo)
+                .where(Pedido.codigo_pedido.in_(codigos))
+            )).all()
+
+        estados = {}
+        for fila in filas:
+            latitud, longitud = fila.latitud, fila.longitud
+            fix = almacen_posiciones.obtener(fila.conductor_codigo) if fila.conductor_codigo else None
+            if fix is not None and (fila.ultima_actualizacion is None or fix[2] > fila.ultima_actualizacion):
+                latitud, longitud = fix[0], fix[1]
+            estados[fila.codigo_pedido] = {
+                "estado": fila.estado,
+                "conductor_codigo": fila.conductor_codigo,
+                "latitud": float(latitud) if latitud is not None else None,
+                "longitud": float(longitud) if longitud is not None else None,
+                "latitud_destino": float(fila.latitud_destino) if fila.latitud_destino is not None else None,
+                "longitud_destino": float(fila.longitud_destino) if fila.longitud_destino is not None else None
+            }
+        return estados
+
+    def _finalizar(self, application: Application, chat_id: int, codigo_pedido: str):
+        """El pedido terminó o la Live Location venció: dejar de seguirlo"""
+        self.quitar(chat_id, codigo_pedido)
+        datos_usuario = application.user_data.get(chat_id)
+        if datos_usuario is not None:
+            datos_usuario[f'tracking_active_{codigo_pedido}'] = False
+
+    async def _editar(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, codigo_pedido: str,
+                      mensaje: dict, posicion: tuple):
+        try:
+            await context.bot.edit_message_live_location(
+                chat_id=chat_id,
+                message_id=mensaje["message_id"],
+                latitude=posicion[0],
+                longitude=posicion[1],
+                rate_limit_args=PRIORIDAD_TRACKING
+            )
+        except BadRequest as e:
+            error = str(e).lower()
+            if "not modified" in error:
+                # Telegram ya muestra esa posición
+                self.ediciones_sin_cambios += 1
+                mensaje["enviada"] = posicion
+            elif "not found" in error or "can't be edited" in error:
+                # El usuario borró el mensaje o la Live Location terminó
+                self._finalizar(context.application, chat_id, codigo_pedido)
+            else:
+                self.ediciones_fallidas += 1
+                print(f"⚠️ Tracking {codigo_pedido}: {e}")
+            return
+        except Exception as e:
+            self.ediciones_fallidas += 1
+            print(f"⚠️ Tracking {codigo_pedido}: {e}")
+            return
+        self.ediciones_enviadas += 1
+        mensaje["enviada"] = posicion
+
+
+def _cadencia(estado: dict) -> float:
+    """Segundos hasta el próximo refresco del mensaje según el estado del pedido"""
+    if (
+        estado["estado"] == "EN_CAMINO"
+        and None not in (estado["latitud"], estado["latitud_destino"], estado["longitud_destino"])
+        and calcular_distancia_haversine(
+            estado["latitud"], estado["longitud"], estado["latitud_destino"], estado["longitud_destino"]
+        ) <= DISTANCIA_CERCA_DESTINO_KM
+    ):
+        return CADENCIA_CERCA_DESTINO
+    return CADENCIA_POR_ESTADO.get(estado["estado"], CADENCIA_POR_DEFECTO)
+
+
+def _se_movio(enviada: tuple | None, posicion: tuple) -> bool:
+    """True si la posición está a más de UMBRAL_MOVIMIENTO_METROS de la última enviada"""
+    if enviada is None:
+        return True
+    return calcular_distancia_haversine(*enviada, *posicion) * 1000 >= UMBRAL_MOVIMIENTO_METROS
+
+
+# Instancia única del proceso
+seguimiento = SeguimientoEnVivo()
@@ -0,0 +1,143 @@
+"""
+Modo webhook del bot
+Telegram hace POST de cada update a /telegram/webhook de la API. El endpoint
+solo valida el secreto y encola el update (responde enseguida); un grupo
+acotado de workers lo entrega al update processor de la Application
+(ProcesadorPorChat: en paralelo, en orden dentro de cada chat). Si la cola está
+llena se responde 503 y Telegram reintenta más tarde.
+
+Todos los updates de un chat tienen que llegar al mismo proceso: el estado
+de la conversación (context.user_data: carrito, cantidades, pasos del pago)
+y el orden por chat de ProcesadorPorChat viven en memoria del proceso. Con
+varias réplicas de la API, el proxy debe enviar /telegram/webhook a una sola
+(o repartir por chat); las demás pueden correr el bot solo para enviar
+avisos.
+"""
+import asyncio
+from telegram import Update
+from telegram.ext import Application
+
+
+# Ruta del endpoint en la API
+RUTA_WEBHOOK = "/telegram/webhook"
+
+# Segundos que se espera a que los workers terminen la cola al apagar
+ESPERA_APAGADO_SEGUNDOS = 10.0
+
+
+class UpdateInvalido(ValueError):
+    """El cuerpo recibido no es un update de Telegram"""
+
+
+class ReceptorWebhook:
+    """
+    Cola acotada de updates recibidos por webhook y los workers que la
+    procesan. Los updates pasan por el update processor de la Application,
+    igual que en polling.
+    """
+
+    def __init__(self):
+        self._application: Application | None = None
+        self._cola: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self.recibidos = 0
+        self.rechazados = 0  # Cola llena (503)
+        self.invalidos = 0  # Cuerpo que no es un update (400)
+        self.procesados = 0
+        self.fallidos = 0
+
+    @property
+    def activo(self) -> bool:
+        return self._cola is not None
+
+    @property
+    def pendientes(self) -> int:
+        return self._cola.qsize() if self._cola is not None else 0
+
+    async def iniciar(self, application: Application, url: str, secreto: str,
+                      workers: int, max_cola: int):
+        """
+        Arranca los workers y registra la URL del webhook en Telegram.
+        Sin secreto no arranca: cualquiera podría enviar updates falsos al endpoint.
+        """
+        if not secreto:
+            raise ValueError("TELEGRAM_MODO=webhook requiere TELEGRAM_WEBHOOK_SECRETO")
+        self._application = application
+        self._cola = asyncio.Queue(maxsize=max_cola)
+        self._workers = [asyncio.create_task(self._trabajar()) for _ in range(workers)]
+        # Registrar la URL es idempotente (reinicios, réplicas que comparten la
+        # URL pública). No se descartan updates pendientes
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=secreto,
+            allowed_updates=Update.ALL_TYPES
+        )
+
+    async def detener(self):
+        """Termina lo que quedó en cola (con límite de tiempo) y para los workers"""
+        if self._cola is None:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), ESPERA_APAGADO_SEGUNDOS)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Webhook: {self._cola.qsize()} updates sin procesar al apagar")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._cola = None
+
+    def recibir(self, datos: dict) -> bool:
+        """
+        Encola un update recibido por el endpoint
+
+        Returns:
+            False si la cola está llena (Telegram debe reintentar)
+        
+        Raises:
+            UpdateInvalido: si datos no es un update
+        """
+        try:
+            if not isinstance(datos, dict):
+                raise TypeError(f"se esperaba un objeto JSON, llegó {type(datos).__name__}")
+            update = Update.de_json(datos, self._application.bot)
+        except Exception as e:
+            self.invalidos += 1
+            raise UpdateInvalido(f"Update inválido: {e}") from e
+        try:
+            self._cola.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rechazados += 1
+            return False
+        self.recibidos += 1
+        return True
+
+    def estadisticas(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "pendientes": self.pendientes,
+            "recibidos": self.recibidos,
+            "rechazados": self.rechazados,
+            "invalidos": self.invalidos,
+            "procesados": self.procesados,
+            "fallidos": self.fallidos
+        }
+
+    async def _trabajar(self):
+        application = self._application
+        while True:
+            update = await self._cola.get()
+            try:
+                await application.update_processor.process_update(
+                    update, application.process_update(update)
+                )
+                self.procesados += 1
+            except Exception as e:
+                self.fallidos += 1
+                print(f"❌ Error al procesar update {update.update_id}: {e}")
+            finally:
+                self._cola.task_done()
+
+
+# Instancia única del proceso
+receptor_webhook = ReceptorWebhook()
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Literal
 
 
 class Settings(BaseSettings):
@@ -13,6 +14,60 @@ class Settings(BaseSettings):
     
     # Telegram
     token_telegram: str
+    
+    # Asignación de conductores: "optima" (Húngaro) o "voraz"
+    estrategia_asignacion: Literal["optima", "voraz"] = "optima"
+    
+    # Roles que corren dentro del proceso de la API (python -m app api).
+    # Con varios workers de uvicorn conviene desactivar el bot y correrlo
+    # aparte (python -m app bot); el despachador se puede dejar: solo el
+    # que tenga el advisory lock asigna (ver app/dispatcher.py)
+    ejecutar_bot_en_api: bool = True
+    ejecutar_despachador_en_api: bool = True
+    
+    # Despachador: cada cuánto un proceso en espera intenta tomar el
+    # liderazgo y cada cuánto el líder verifica su conexión (segundos)
+    despachador_reintento_segundos: float = 1.0
+    despachador_latido_segundos: float = 2.0
+    
+    # Posiciones GPS de conductores: cada cuánto se vuelcan a la BD las que
+    # están en memoria (es también lo máximo que se pierde ante una caída)
+    posiciones_intervalo_vaciado_segundos: float = 5.0
+    
+    # Historial de ubicaciones: días con todas las posiciones, resolución
+    # (segundos entre posiciones) de los días anteriores y días que se guardan
+    historial_dias_completo: int = 7
+    historial_segundos_muestreo: int = 30
+    historial_dias_retencion: int = 180
+    
+    # Días que se guardan los eventos de pedidos (outbox)
+    eventos_dias_retencion: int = 7
+    
+    # Recepción de updates de Telegram: "polling" (un solo proceso del bot) o
+    # "webhook" (Telegram hace POST a /telegram/webhook de la API). En webhook
+    # el bot corre dentro de la API (EJECUTAR_BOT_EN_API=true). El estado de
+    # cada conversación (carrito, pasos del pago) y el orden de los updates de
+    # un chat viven en el proceso que los atiende: con varias réplicas, el
+    # proxy debe enviar el webhook a una sola (o repartir por chat id).
+    telegram_modo: Literal["polling", "webhook"] = "polling"
+    # URL pública completa del endpoint, p. ej. https://speedyfood.example/telegram/webhook
+    telegram_webhook_url: str = ""
+    # Secreto que Telegram envía en X-Telegram-Bot-Api-Secret-Token
+    # (obligatorio en modo webhook: sin él no se inicia)
+    telegram_webhook_secreto: str = ""
+    # Workers que toman los updates recibidos (incluye los que esperan el
+    # turno de su chat, más que BOT_UPDATES_CONCURRENTES) y tope de la cola
+    # (503 si se llena)
+    telegram_webhook_workers: int = 512
+    telegram_webhook_max_cola: int = 1000
+    # API de Telegram (scripts/fake_telegram.py la reemplaza en pruebas locales)
+    telegram_api_url: str = "https://api.telegram.org/bot"
+    
+    # Updates del bot atendidos en paralelo (los de un mismo chat, siempre en
+    # orden). Los handlers pasan casi todo el tiempo esperando (BD, Telegram,
+    # el pago simulado), así que conviene un número alto; las consultas igual
+    # hacen fila en el pool de conexiones de la BD
+    bot_updates_concurrentes: int = 256
 
     class Config:
         env_file = ".env"
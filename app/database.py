@@ -1,4 +1,7 @@
+import asyncpg
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.config import get_settings
 
@@ -13,6 +16,38 @@ engine = create_engine(
 # Crear sesión
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _url_async(database_url: str) -> str:
+    """Convierte la URL de conexión para usar el driver async (asyncpg)"""
+    url = make_url(database_url)
+    return url.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+# Motor async: lo usan el bot, la asignación automática y los endpoints async
+async_engine = create_async_engine(
+    _url_async(settings.database_url),
+    echo=True
+)
+
+async def conectar_asyncpg(**kwargs) -> asyncpg.Connection:
+    """
+    Abre una conexión asyncpg dedicada, fuera del pool de SQLAlchemy.
+    Para lo que necesita una sesión de Postgres propia y duradera
+    (LISTEN/NOTIFY, advisory locks).
+    """
+    url = make_url(settings.database_url).set(drivername="postgresql")
+    return await asyncpg.connect(url.render_as_string(hide_password=False), **kwargs)
+
+
+# Sesión async (expire_on_commit=False para poder leer atributos tras el commit
+# sin disparar consultas implícitas fuera del event loop)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Base para los modelos
 Base = declarative_base()
 
@@ -27,3 +62,12 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """
+    Dependency de FastAPI para obtener una sesión async de BD
+    Uso: db: AsyncSession = Depends(get_async_db)
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,177 @@
+"""
+Despachador de asignaciones
+Corre la task de asignación automática con elección de líder: cada instancia
+intenta tomar un advisory lock de Postgres en una conexión dedicada y solo la
+que lo tiene asigna. Si el líder muere, su conexión se cierra, Postgres libera
+el lock y otra instancia lo toma en el siguiente reintento.
+
+Uso:
+    python -m app dispatcher
+(o dentro de la API, con EJECUTAR_DESPACHADOR_EN_API=true)
+"""
+import asyncio
+from app.config import get_settings
+from app.database import AsyncSessionLocal, async_engine, conectar_asyncpg
+from app.services.conductor_service import asignar_pedidos_en_lote
+from app.services.despacho_service import despachador, CANAL_ASIGNACION
+from app.services.historial_service import ejecutar_mantenimiento
+from app.services.eventos_pedido import relay_eventos, ejecutar_limpieza
+
+
+# Clave del advisory lock del líder (cualquier bigint fijo y único en la BD)
+LLAVE_LIDER_DESPACHO = 73310001
+
+# La asignación se dispara por eventos (ver despacho_service); este intervalo
+# es solo el barrido de respaldo por si algún evento se pierde
+INTERVALO_ASIGNACION_SEGUNDOS = 300  # Cada 5 minutos
+
+# Keepalive TCP del lado del servidor: si el host del líder desaparece sin
+# cerrar la conexión, Postgres la da por muerta (y suelta el lock) en ~10 s
+KEEPALIVE_SERVIDOR = {
+    "tcp_keepalives_idle": "4",
+    "tcp_keepalives_interval": "2",
+    "tcp_keepalives_count": "3"
+}
+
+
+async def asignar_pedidos_pendientes():
+    """
+    Asigna en lote los pedidos SOLICITADOS sin conductor a los conductores
+    disponibles (una sola matriz de costos y una sola transacción).
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            resultado = await asignar_pedidos_en_lote(db)
+
+        if resultado["asignaciones"]:
+            print(
+                f"🔄 Asignación automática ({resultado['estrategia']}): "
+                f"{len(resultado['asignaciones'])} pedidos asignados, "
+                f"{resultado['distancia_total_km']} km en total"
+            )
+            for asignacion in resultado["asignaciones"]:
+                print(f"✅ Pedido {asignacion['pedido']} asignado a {asignacion['conductor']} ({asignacion['distancia_km']} km)")
+
+        if resultado["pendientes"]:
+            print(f"⚠️ {resultado['pendientes']} pedidos siguen sin conductor disponible")
+
+    except Exception as e:
+        print(f"❌ Error en asignación automática: {e}")
+
+
+async def asignar_pedidos_automaticamente():
+    """
+    Task de asignación automática.
+    Hace un barrido al arrancar y luego espera eventos del despachador
+    (pedido creado, rechazado, conductor liberado) para asignar al instante.
+    Si no llega ningún evento, repite el barrido cada INTERVALO_ASIGNACION_SEGUNDOS.
+    """
+    while True:
+        await asignar_pedidos_pendientes()
+
+        # Esperar el siguiente evento (o el barrido de respaldo)
+        eventos = await despachador.esperar_eventos(INTERVALO_ASIGNACION_SEGUNDOS)
+        if eventos:
+            motivos = sorted({motivo for motivo, _ in eventos})
+            print(f"⚡ Asignación disparada por: {', '.join(motivos)}")
+
+
+async def _liderar(conexion, latido: float):
+    """
+    Corre la asignación mientras la conexión que tiene el lock siga viva.
+    Si el latido falla se deja de asignar de inmediato: el lock pudo haberse
+    perdido y otra instancia puede estar tomando el liderazgo.
+    """
+    despachador.iniciar(asyncio.get_running_loop())
+    await conexion.add_listener(CANAL_ASIGNACION, despachador.recibir_notificacion)
+    tareas = {
+        asyncio.create_task(asignar_pedidos_automaticamente()),
+        # El mantenimiento del historial y del outbox también corre en una sola instancia
+        asyncio.create_task(ejecutar_mantenimiento()),
+        asyncio.create_task(ejecutar_limpieza())
+    }
+    try:
+        while True:
+            terminadas, _ = await asyncio.wait(tareas, timeout=latido, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in terminadas:
+                tarea.result()
+            if terminadas:
+                return
+            await asyncio.wait_for(conexion.fetchval("SELECT 1"), timeout=latido)
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        despachador.detener()
+
+
+async def ejecutar_despachador():
+    """
+    Bucle de elección de líder (no retorna; se detiene cancelando la task).
+    Las instancias en espera reintentan tomar el lock cada
+    despachador_reintento_segundos.
+    """
+    settings = get_settings()
+    reintento = settings.despachador_reintento_segundos
+    en_espera = False
+
+    while True:
+        conexion = None
+        try:
+            conexion = await conectar_asyncpg(server_settings=KEEPALIVE_SERVIDOR)
+            if await conexion.fetchval("SELECT pg_try_advisory_lock($1)", LLAVE_LIDER_DESPACHO):
+                print("👑 Despachador activo: esta instancia asigna los pedidos")
+                en_espera = False
+                await _liderar(conexion, settings.despachador_latido_segundos)
+            elif not en_espera:
+                print("⏳ Despachador en espera: otra instancia tiene el liderazgo")
+                en_espera = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Despachador: {e}")
+        finally:
+            # Cerrar la sesión de Postgres libera el advisory lock
+            if conexion is not None:
+                conexion.terminate()
+
+        await asyncio.sleep(reintento)
+
+
+def _evento_asignacion(evento: dict):
+    """
+    Suscriptor del bus de eventos de pedidos: un pedido que queda en la cola
+    (creado, rechazado, liberado) dispara la asignación si el líder está en
+    este proceso
+    """
+    if not despachador.activo or evento["datos"].get("asignacion_inmediata"):
+        return
+    if evento["estado"] == "SOLICITADO" and evento["conductor_codigo"] is None:
+        despachador.notificar(f"pedido_{evento['tipo']}", evento["codigo_pedido"])
+
+
+relay_eventos.suscribir(_evento_asignacion)
+
+
+async def _main():
+    relay_eventos.iniciar()
+    try:
+        await ejecutar_despachador()
+    finally:
+        await relay_eventos.detener()
+        await async_engine.dispose()
+
+
+def run_dispatcher():
+    """
+    Ejecuta el despachador como proceso independiente
+    """
+    print("🚚 Iniciando despachador de asignaciones...")
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        print("🛑 Despachador detenido")
+
+
+if __name__ == "__main__":
+    run_dispatcher()
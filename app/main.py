@@ -2,114 +2,133 @@
 SpeedyFoodBot - API FastAPI + Bot Telegram
 """
 import asyncio
+import hmac
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import get_settings
-from app.routers import categorias, productos, clientes, conductores, pedidos
+from app.routers import categorias, productos, clientes, conductores, pedidos, configuracion
 from app.bot.bot import create_bot_application
-from app.database import SessionLocal
+from app.bot.tracking import seguimiento
+from app.bot.notificaciones import notificador_clientes
+from app.bot.webhook import receptor_webhook, RUTA_WEBHOOK
+from sqlalchemy import select, func
+from app.database import AsyncSessionLocal, async_engine
 from app.models import Pedido, Conductor
-from app.services.conductor_service import asignar_conductor_a_pedido
+from app.services.despacho_service import despachador
+from app.dispatcher import ejecutar_despachador, INTERVALO_ASIGNACION_SEGUNDOS
+from app.services.indice_conductores import cargar_indice_desde_bd, ejecutar_recarga
+from app.services.ubicacion_service import almacen_posiciones
+from app.services.eventos_pedido import relay_eventos
 
 
 # Variable global para la aplicación del bot
 bot_app = None
-# Variable para controlar el task de asignación automática
-asignacion_task = None
-
-# Configuración de asignación automática
-INTERVALO_ASIGNACION_SEGUNDOS = 30  # Cada 30 segundos
-
-
-async def asignar_pedidos_automaticamente():
-    """
-    Task que se ejecuta periódicamente para asignar pedidos SOLICITADOS
-    a conductores disponibles automáticamente.
-    """
-    while True:
-        try:
-            db = SessionLocal()
-            
-            # Buscar pedidos en estado SOLICITADO sin conductor
-            pedidos_pendientes = db.query(Pedido).filter(
-                Pedido.estado == "SOLICITADO",
-                Pedido.conductor_codigo.is_(None)
-            ).order_by(Pedido.fecha.asc()).all()  # Ordenar por antigüedad
-            
-            if pedidos_pendientes:
-                print(f"🔄 Asignación automática: {len(pedidos_pendientes)} pedidos pendientes")
-                
-                for pedido in pedidos_pendientes:
-                    # Verificar si hay conductores disponibles
-                    conductor_disponible = db.query(Conductor).filter(
-                        Conductor.is_disponible == True,
-                        Conductor.latitud.isnot(None),
-                        Conductor.longitud.isnot(None)
-                    ).first()
-                    
-                    if not conductor_disponible:
-                        print("⚠️ No hay conductores disponibles")
-                        break
-                    
-                    # Asignar conductor más cercano
-                    resultado = asignar_conductor_a_pedido(db, pedido.codigo_pedido)
-                    
-                    if resultado["exito"]:
-                        print(f"✅ Pedido {pedido.codigo_pedido} asignado a {resultado.get('conductor', 'N/A')}")
-                    else:
-                        print(f"⚠️ No se pudo asignar {pedido.codigo_pedido}: {resultado['mensaje']}")
-            
-            db.close()
-            
-        except Exception as e:
-            print(f"❌ Error en asignación automática: {e}")
-        
-        # Esperar antes de la siguiente verificación
-        await asyncio.sleep(INTERVALO_ASIGNACION_SEGUNDOS)
+# Variable para controlar el task del despachador (elección de líder + asignación)
+despachador_task = None
+# Variable para controlar el task que vuelca las posiciones GPS a la BD
+posiciones_task = None
+# Variable para controlar el task que recarga el índice de conductores
+indice_task = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Maneja el ciclo de vida de la aplicación.
-    Inicia el bot de Telegram y el sistema de asignación automática.
+    Según la configuración, inicia también el bot de Telegram y el
+    despachador de asignaciones dentro de este proceso.
     """
-    global bot_app, asignacion_task
+    global bot_app, despachador_task, posiciones_task, indice_task
+    settings = get_settings()
     
     print("🚀 Iniciando SpeedyFoodBot...")
     
     # Crear e iniciar el bot de Telegram
-    bot_app = create_bot_application()
-    await bot_app.initialize()
-    await bot_app.start()
-    await bot_app.updater.start_polling(drop_pending_updates=True)
+    if settings.ejecutar_bot_en_api:
+        bot_app = create_bot_application()
+        await bot_app.initialize()
+        await bot_app.start()
+        if settings.telegram_modo == "webhook":
+            await receptor_webhook.iniciar(
+                bot_app,
+                url=settings.telegram_webhook_url,
+                secreto=settings.telegram_webhook_secreto,
+                workers=settings.telegram_webhook_workers,
+                max_cola=settings.telegram_webhook_max_cola
+            )
+            print(f"✅ Bot de Telegram iniciado (webhook en {RUTA_WEBHOOK})")
+        else:
+            await bot_app.updater.start_polling(drop_pending_updates=True)
+            print("✅ Bot de Telegram iniciado")
+    
+    # Cargar el índice espacial de conductores; se mantiene con los eventos
+    # del relay y una recarga periódica
+    async with AsyncSessionLocal() as db:
+        await cargar_indice_desde_bd(db)
+    indice_task = asyncio.create_task(ejecutar_recarga())
     
-    print("✅ Bot de Telegram iniciado")
+    # Posiciones GPS en memoria, volcadas a la BD cada N segundos
+    posiciones_task = asyncio.create_task(
+        almacen_posiciones.ejecutar_vaciado(settings.posiciones_intervalo_vaciado_segundos)
+    )
     
-    # Iniciar task de asignación automática
-    asignacion_task = asyncio.create_task(asignar_pedidos_automaticamente())
-    print(f"🔄 Asignación automática iniciada (cada {INTERVALO_ASIGNACION_SEGUNDOS} segundos)")
+    # Los eventos de asignación se publican al despachador líder (NOTIFY)
+    await despachador.iniciar_publicacion()
+    
+    # Relay de eventos de pedidos: pushes a conductores, streams SSE, despachador
+    # y avisos del bot a los clientes
+    relay_eventos.iniciar()
+    if bot_app:
+        notificador_clientes.iniciar(bot_app)
+    
+    # Despachador con elección de líder: solo una instancia asigna
+    if settings.ejecutar_despachador_en_api:
+        despachador_task = asyncio.create_task(ejecutar_despachador())
+        print(f"🔄 Despachador iniciado (por eventos, barrido cada {INTERVALO_ASIGNACION_SEGUNDOS} segundos)")
     
     print("📡 API FastAPI lista en http://localhost:8000")
     print("📖 Documentación en http://localhost:8000/docs")
     
     yield  # La aplicación se ejecuta aquí
     
-    # Apagar el task de asignación
-    print("🛑 Deteniendo asignación automática...")
-    if asignacion_task:
-        asignacion_task.cancel()
+    # Apagar el despachador
+    if despachador_task:
+        print("🛑 Deteniendo despachador...")
+        despachador_task.cancel()
+        try:
+            await despachador_task
+        except asyncio.CancelledError:
+            pass
+    await despachador.detener_publicacion()
+    await relay_eventos.detener()
+    if indice_task:
+        indice_task.cancel()
+        try:
+            await indice_task
+        except asyncio.CancelledError:
+            pass
+    
+    # Último vaciado de posiciones pendientes
+    if posiciones_task:
+        posiciones_task.cancel()
         try:
-            await asignacion_task
+            await posiciones_task
         except asyncio.CancelledError:
             pass
     
     # Apagar el bot cuando se cierra FastAPI
-    print("🛑 Deteniendo bot de Telegram...")
-    await bot_app.updater.stop()
-    await bot_app.stop()
-    await bot_app.shutdown()
+    if bot_app:
+        print("🛑 Deteniendo bot de Telegram...")
+        await notificador_clientes.detener()
+        await receptor_webhook.detener()
+        if bot_app.updater.running:
+            await bot_app.updater.stop()
+        await bot_app.stop()
+        await bot_app.shutdown()
+    
+    # Cerrar el pool de conexiones async
+    await async_engine.dispose()
 
 
 # Crear instancia de FastAPI con lifespan
@@ -137,6 +156,7 @@ app.include_router(productos.router)
 app.include_router(clientes.router)
 app.include_router(conductores.router)
 app.include_router(pedidos.router)
+app.include_router(configuracion.router)
 
 
 @app.get("/", tags=["Root"])
@@ -162,34 +182,107 @@ def health_check():
 
 
 @app.get("/asignacion/estado", tags=["Asignación Automática"])
-def estado_asignacion():
+async def estado_asignacion():
     """Ver estado del sistema de asignación automática"""
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         # Contar pedidos pendientes
-        pedidos_solicitados = db.query(Pedido).filter(
-            Pedido.estado == "SOLICITADO",
-            Pedido.conductor_codigo.is_(None)
-        ).count()
+        pedidos_solicitados = await db.scalar(
+            select(func.count()).select_from(Pedido).where(
+                Pedido.estado == "SOLICITADO",
+                Pedido.conductor_codigo.is_(None)
+            )
+        )
         
         # Contar conductores disponibles
-        conductores_disponibles = db.query(Conductor).filter(
-            Conductor.is_disponible == True,
-            Conductor.latitud.isnot(None),
-            Conductor.longitud.isnot(None)
-        ).count()
+        conductores_disponibles = await db.scalar(
+            select(func.count()).select_from(Conductor).where(
+                Conductor.is_disponible == True,
+                Conductor.latitud.isnot(None),
+                Conductor.longitud.isnot(None)
+            )
+        )
         
         return {
             "asignacion_automatica": "activa",
+            "modo": "eventos",
+            "despachador_en_este_proceso": despachador.activo,
+            "estrategia": get_settings().estrategia_asignacion,
             "intervalo_segundos": INTERVALO_ASIGNACION_SEGUNDOS,
             "pedidos_pendientes": pedidos_solicitados,
             "conductores_disponibles": conductores_disponibles
         }
-    finally:
-        db.close()
 
 
-# Para ejecutar directamente: python -m app.main
+@app.get("/tracking/estado", tags=["Tracking"])
+def estado_tracking():
+    """Ver el tracking en vivo del bot (ediciones enviadas/omitidas) y los avisos a clientes"""
+    return {
+        "bot_en_este_proceso": bot_app is not None,
+        **seguimiento.estadisticas(),
+        "avisos_pendientes": notificador_clientes.pendientes,
+        "avisos_enviados": notificador_clientes.avisos_enviados,
+        "avisos_fallidos": notificador_clientes.avisos_fallidos
+    }
+
+
+@app.get("/bot/envios", tags=["Bot"])
+def estado_envios_bot():
+    """Ver la cola de envíos del bot: pendientes por prioridad, enviados, ediciones combinadas y 429"""
+    if bot_app is None:
+        return {"bot_en_este_proceso": False}
+    return {"bot_en_este_proceso": True, **bot_app.bot.rate_limiter.metricas()}
+
+
+@app.post(RUTA_WEBHOOK, tags=["Bot"])
+async def telegram_webhook(request: Request):
+    """Recibe los updates de Telegram (TELEGRAM_MODO=webhook) y los encola"""
+    if not receptor_webhook.activo:
+        raise HTTPException(status_code=404, detail="El bot no recibe updates por webhook en este proceso")
+    # El receptor no arranca sin secreto (ReceptorWebhook.iniciar)
+    if not hmac.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(),
+        get_settings().telegram_webhook_secreto.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Secreto de webhook inválido")
+    try:
+        # JSON mal formado (JSONDecodeError) o UpdateInvalido: ambos son ValueError
+        aceptado = receptor_webhook.recibir(await request.json())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="El cuerpo no es un update de Telegram")
+    if not aceptado:
+        # Telegram reintenta el update más tarde
+        raise HTTPException(status_code=503, detail="Cola de updates llena")
+    return {"ok": True}
+
+
+@app.get("/bot/updates", tags=["Bot"])
+def estado_updates_bot():
+    """Ver los updates en proceso por chat y la cola del webhook en este proceso"""
+    if bot_app is None:
+        return {"bot_en_este_proceso": False}
+    return {
+        "bot_en_este_proceso": True,
+        "modo": get_settings().telegram_modo,
+        "procesador": bot_app.update_processor.estadisticas(),
+        "webhook": receptor_webhook.estadisticas()
+    }
+
+
+@app.get("/bot/callbacks", tags=["Bot"])
+def estado_callbacks_bot():
+    """Ver las rutas de botones del bot: llamadas, errores y tiempos por acción"""
+    from app.bot.handlers import callbacks
+    return callbacks.estadisticas()
+
+
+@app.get("/bot/catalogo", tags=["Bot"])
+def estado_catalogo_bot():
+    """Ver la versión del catálogo en memoria del bot y cuántas veces se recargó"""
+    from app.bot.catalogo import catalogo_bot
+    return catalogo_bot.estadisticas()
+
+
+# Para ejecutar directamente: python -m app.main (o python -m app api)
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
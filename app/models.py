@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, DECIMAL, Boolean, Text, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, String, Integer, BigInteger, DECIMAL, REAL, Boolean, Text, TIMESTAMP, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -55,6 +56,21 @@ class Conductor(Base):
     
     # Relación con pedidos
     pedidos = relationship("Pedido", back_populates="conductor")
+    
+    __table_args__ = (
+        # Prefiltro por caja lat/lng de los conductores disponibles
+        Index(
+            "ix_conductor_disponible_coordenadas",
+            "latitud", "longitud",
+            postgresql_where=text("is_disponible AND latitud IS NOT NULL AND longitud IS NOT NULL")
+        ),
+        # GET /conductores/disponibles
+        Index(
+            "ix_conductor_disponible",
+            "codigo_conductor",
+            postgresql_where=text("is_disponible")
+        ),
+    )
 
 
 class Producto(Base):
@@ -66,6 +82,7 @@ class Producto(Base):
     descripcion = Column(Text)
     precio = Column(DECIMAL(10, 2))
     img_url = Column(String(500))
+    img_file_id = Column(String(200))  # file_id de Telegram de img_url (lo guarda el bot)
     codigo_categoria = Column(String(50), ForeignKey("categoria.codigo_categoria"))
     
     # Relación con categoría
@@ -95,6 +112,31 @@ class Pedido(Base):
     conductor = relationship("Conductor", back_populates="pedidos")
     items = relationship("ItemPedido", back_populates="pedido")
     transaccion = relationship("Transaction", back_populates="pedido", uselist=False)
+    
+    # Índices de las consultas calientes (ver migrations/001_indices_consultas.sql)
+    __table_args__ = (
+        # Cola de asignación: SOLICITADO sin conductor, por antigüedad
+        Index(
+            "ix_pedido_pendiente_asignacion_fecha",
+            "fecha",
+            postgresql_where=text("estado = 'SOLICITADO' AND conductor_codigo IS NULL")
+        ),
+        # Pedidos de un cliente, los más recientes primero (/mispedidos)
+        Index("ix_pedido_cliente_fecha", "cliente_telefono", fecha.desc()),
+        # Pedidos activos de un conductor (estado NOT IN ENTREGADO/CANCELADO):
+        # /pedidos, /pendientes y el pedido en curso de cada fix GPS. Solo
+        # contiene los activos (unos pocos por conductor), no todo el historial
+        Index(
+            "ix_pedido_conductor_activo_fecha",
+            "conductor_codigo", fecha.desc(),
+            postgresql_where=text("estado NOT IN ('ENTREGADO', 'CANCELADO')")
+        ),
+        # Historial completo de un conductor (todos los estados) y la FK
+        # pedido.conductor_codigo; el parcial no sirve para estas consultas
+        Index("ix_pedido_conductor_fecha", "conductor_codigo", fecha.desc()),
+        # GET /pedidos/estado/{estado}
+        Index("ix_pedido_estado_fecha", "estado", "fecha"),
+    )
 
 
 class ItemPedido(Base):
@@ -123,3 +165,50 @@ class Transaction(Base):
     
     # Relación con pedido
     pedido = relationship("Pedido", back_populates="transaccion")
+
+
+class UbicacionConductor(Base):
+    """
+    Historial de posiciones GPS de los conductores (solo inserción)
+    Particionada por día en registrado_en (ver migrations/002_historial_ubicaciones.sql)
+    """
+    __tablename__ = "ubicacion_conductor"
+    
+    codigo_conductor = Column(String(100), primary_key=True)
+    registrado_en = Column(TIMESTAMP, primary_key=True)
+    codigo_pedido = Column(String(50), nullable=True)  # Pedido en curso, si había
+    latitud = Column(REAL, nullable=False)  # ~1 m de precisión, 4 bytes
+    longitud = Column(REAL, nullable=False)
+    
+    __table_args__ = (
+        # Recorrido de un pedido
+        Index(
+            "ix_ubicacion_conductor_pedido",
+            "codigo_pedido", "registrado_en",
+            postgresql_where=text("codigo_pedido IS NOT NULL")
+        ),
+        {"postgresql_partition_by": "RANGE (registrado_en)"},
+    )
+
+
+class EventoPedido(Base):
+    """
+    Outbox de eventos de pedidos (creado, asignado, cambio de estado...)
+    Se escribe en la misma transacción que el cambio; el relay de
+    app/services/eventos_pedido.py lo publica a los suscriptores en orden de id
+    """
+    __tablename__ = "evento_pedido"
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    codigo_pedido = Column(String(50), nullable=False)
+    tipo = Column(String(30), nullable=False)
+    estado = Column(String(20))  # Estado del pedido después del evento
+    conductor_codigo = Column(String(100), nullable=True)  # Conductor después del evento
+    datos = Column(JSONB, nullable=True)  # Detalle propio de cada tipo
+    avisado = Column(Boolean, nullable=False, default=False, server_default=text("false"))  # Aviso al cliente ya tomado por un bot
+    creado_en = Column(TIMESTAMP, server_default=func.now())
+    
+    __table_args__ = (
+        # Limpieza de eventos viejos
+        Index("ix_evento_pedido_creado_en", "creado_en"),
+    )
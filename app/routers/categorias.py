@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Categoria
 from app.schemas import CategoriaCreate, CategoriaResponse
+from app.services.catalogo_service import notificar_cambio_catalogo
 
 router = APIRouter(prefix="/categorias", tags=["Categorías"])
 
@@ -27,6 +28,7 @@ def crear_categoria(categoria: CategoriaCreate, db: Session = Depends(get_db)):
     """Crear una nueva categoría"""
     db_categoria = Categoria(**categoria.model_dump())
     db.add(db_categoria)
+    notificar_cambio_catalogo(db)
     db.commit()
     db.refresh(db_categoria)
     return db_categoria
@@ -39,5 +41,6 @@ def eliminar_categoria(codigo: str, db: Session = Depends(get_db)):
     if not categoria:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     db.delete(categoria)
+    notificar_cambio_catalogo(db)
     db.commit()
     return {"mensaje": "Categoría eliminada"}
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from app.database import get_db
+from app.database import get_db, get_async_db, AsyncSessionLocal
 from app.models import Conductor, Pedido
-from app.schemas import ConductorCreate, ConductorResponse, UbicacionUpdate, UbicacionResponse, PedidoResponse
+from app.schemas import (
+    ConductorCreate, ConductorResponse, UbicacionUpdate, UbicacionResponse, PedidoResponse,
+    UbicacionLote, UbicacionLoteResponse
+)
+from app.services.despacho_service import despachador
+from app.services.indice_conductores import indice_conductores
+from app.services.eventos_pedido import registrar_evento
+from app.services.conexiones_conductores import conexiones_conductores
 
 router = APIRouter(prefix="/conductores", tags=["Conductores"])
 
@@ -36,6 +45,7 @@ def crear_conductor(conductor: ConductorCreate, db: Session = Depends(get_db)):
     db.add(db_conductor)
     db.commit()
     db.refresh(db_conductor)
+    indice_conductores.registrar(db_conductor)
     return db_conductor
 
 
@@ -64,20 +74,119 @@ def actualizar_ubicacion(
 ):
     """
     Actualizar ubicación del conductor (GPS)
-    Se actualiza automáticamente el timestamp de última actualización
+    La posición queda en memoria (visible al instante para asignación y
+    tracking) y se guarda en la BD en el siguiente vaciado del almacén
     """
-    conductor = db.query(Conductor).filter(Conductor.codigo_conductor == codigo).first()
-    if not conductor:
-        raise HTTPException(status_code=404, detail="Conductor no encontrado")
+    from app.services.ubicacion_service import almacen_posiciones
     
-    conductor.latitud = ubicacion.latitud
-    conductor.longitud = ubicacion.longitud
-    conductor.ultima_actualizacion = datetime.now()
+    # Los datos del conductor salen del índice; solo se va a la BD si no está
+    datos = indice_conductores.obtener(codigo)
+    if datos is None:
+        conductor = db.query(Conductor).filter(Conductor.codigo_conductor == codigo).first()
+        if not conductor:
+            raise HTTPException(status_code=404, detail="Conductor no encontrado")
+        indice_conductores.registrar(conductor)
+        datos = indice_conductores.obtener(codigo)
     
-    db.commit()
-    db.refresh(conductor)
+    ahora = datetime.now()
+    almacen_posiciones.registrar(codigo, ubicacion.latitud, ubicacion.longitud, ahora)
     
-    return conductor
+    return {
+        "codigo_conductor": codigo,
+        "nombre": datos["nombre"],
+        "latitud": ubicacion.latitud,
+        "longitud": ubicacion.longitud,
+        "is_disponible": datos["disponible"],
+        "ultima_actualizacion": ahora
+    }
+
+
+@router.websocket("/{codigo}/stream")
+async def stream_conductor(websocket: WebSocket, codigo: str):
+    """
+    Conexión permanente del conductor
+    - El conductor envía frames de ubicación compactos: [lat, lng, ts_ms]
+      (o una lista de ellos); van al mismo almacén que PUT /ubicacion
+    - El servidor envía pushes: pedido asignado, cambios de estado
+    """
+    from app.services.ubicacion_service import almacen_posiciones, leer_frame_ubicaciones
+    
+    if indice_conductores.obtener(codigo) is None:
+        async with AsyncSessionLocal() as db:
+            conductor = await db.scalar(select(Conductor).where(Conductor.codigo_conductor == codigo))
+        if not conductor:
+            await websocket.close(code=4404, reason="Conductor no encontrado")
+            return
+        indice_conductores.registrar(conductor)
+    
+    await websocket.accept()
+    anterior = conexiones_conductores.conectar(codigo, websocket)
+    if anterior is not None:
+        try:
+            await anterior.close(code=4000, reason="Reemplazada por una nueva conexión")
+        except Exception:
+            pass
+    # Todos los envíos pasan por el registro (serializados con los pushes)
+    conexiones_conductores.enviar(codigo, {"tipo": "conectado", "codigo_conductor": codigo})
+    
+    try:
+        while True:
+            texto = await websocket.receive_text()
+            try:
+                fixes = leer_frame_ubicaciones(texto)
+            except (ValueError, TypeError) as e:
+                conexiones_conductores.enviar(codigo, {"tipo": "error", "detalle": str(e)})
+                continue
+            for latitud, longitud, timestamp in fixes:
+                almacen_posiciones.registrar(codigo, latitud, longitud, timestamp)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        conexiones_conductores.desconectar(codigo, websocket)
+
+
+@router.post("/ubicaciones/lote", response_model=UbicacionLoteResponse)
+async def actualizar_ubicaciones_lote(lote: UbicacionLote, db: AsyncSession = Depends(get_async_db)):
+    """
+    Actualizar en bloque las ubicaciones de varios conductores
+    Cada fix trae su timestamp: por conductor se aplica el más reciente y solo
+    si es más nuevo que la última ubicación guardada (los atrasados se descartan).
+    Los fixes con timestamp en el futuro se rechazan
+    """
+    from app.services.ubicacion_service import (
+        separar_futuros, deduplicar_ubicaciones, aplicar_ubicaciones, almacen_posiciones
+    )
+    
+    fixes, futuros = separar_futuros(lote.ubicaciones)
+    ultimos = deduplicar_ubicaciones(fixes)
+    aplicadas, no_encontrados = await aplicar_ubicaciones(db, ultimos)
+    
+    # Al historial van todos los fixes válidos (no solo el último de cada conductor)
+    for fix in fixes:
+        if fix.codigo_conductor not in no_encontrados:
+            almacen_posiciones.agregar_historial(fix.codigo_conductor, fix.latitud, fix.longitud, fix.timestamp)
+    
+    resultados = []
+    for codigo, (_, _, timestamp) in ultimos.items():
+        if codigo in aplicadas:
+            estado = "aplicada"
+        elif codigo in no_encontrados:
+            estado = "no_encontrado"
+        else:
+            estado = "obsoleta"
+        resultados.append({"codigo_conductor": codigo, "estado": estado, "timestamp": timestamp})
+    for codigo, timestamp in futuros.items():
+        if codigo not in ultimos:
+            resultados.append({"codigo_conductor": codigo, "estado": "futura", "timestamp": timestamp})
+    
+    return {
+        "aplicadas": len(aplicadas),
+        "obsoletas": len(ultimos) - len(aplicadas) - len(no_encontrados),
+        "no_encontrados": len(no_encontrados),
+        "duplicadas": len(fixes) - len(ultimos),
+        "futuras": len(lote.ubicaciones) - len(fixes),
+        "resultados": resultados
+    }
 
 
 @router.put("/{codigo}/disponibilidad")
@@ -96,18 +205,30 @@ def actualizar_disponibilidad(
     conductor.is_disponible = disponible
     db.commit()
     
+    if not indice_conductores.actualizar_disponibilidad(codigo, disponible):
+        indice_conductores.registrar(conductor)
+    
+    if disponible:
+        despachador.notificar("conductor_disponible")
+    
     return {"mensaje": f"Conductor {conductor.nombre} {'disponible' if disponible else 'no disponible'}"}
 
 
 # ============ ENDPOINTS DE ASIGNACIÓN POR PROXIMIDAD ============
 @router.get("/cercanos/restaurante")
-def obtener_conductores_cercanos(db: Session = Depends(get_db)):
+async def obtener_conductores_cercanos(
+    limite: int | None = Query(None, ge=1),
+    radio_km: float | None = Query(None, gt=0),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
     Obtener conductores disponibles ordenados por distancia al restaurante
+    - limite: solo los N más cercanos
+    - radio_km: solo los que están a menos de esa distancia
     """
     from app.services.conductor_service import obtener_conductores_ordenados_por_distancia
     
-    conductores = obtener_conductores_ordenados_por_distancia(db)
+    conductores = await obtener_conductores_ordenados_por_distancia(db, limite=limite, radio_km=radio_km)
     
     if not conductores:
         return {"mensaje": "No hay conductores disponibles", "conductores": []}
@@ -119,13 +240,13 @@ def obtener_conductores_cercanos(db: Session = Depends(get_db)):
 
 
 @router.get("/cercano/restaurante")
-def obtener_conductor_mas_cercano_endpoint(db: Session = Depends(get_db)):
+async def obtener_conductor_mas_cercano_endpoint(db: AsyncSession = Depends(get_async_db)):
     """
     Obtener el conductor disponible más cercano al restaurante
     """
     from app.services.conductor_service import obtener_conductor_mas_cercano
     
-    conductor = obtener_conductor_mas_cercano(db)
+    conductor = await obtener_conductor_mas_cercano(db)
     
     if not conductor:
         raise HTTPException(status_code=404, detail="No hay conductores disponibles")
@@ -134,7 +255,7 @@ def obtener_conductor_mas_cercano_endpoint(db: Session = Depends(get_db)):
 
 
 @router.get("/{codigo}/distancia")
-def calcular_distancia_a_restaurante(codigo: str, db: Session = Depends(get_db)):
+async def calcular_distancia_a_restaurante(codigo: str, db: AsyncSession = Depends(get_async_db)):
     """
     Calcular distancia de un conductor específico al restaurante
     """
@@ -143,14 +264,14 @@ def calcular_distancia_a_restaurante(codigo: str, db: Session = Depends(get_db))
         calcular_distancia_haversine
     )
     
-    conductor = db.query(Conductor).filter(Conductor.codigo_conductor == codigo).first()
+    conductor = await db.scalar(select(Conductor).where(Conductor.codigo_conductor == codigo))
     if not conductor:
         raise HTTPException(status_code=404, detail="Conductor no encontrado")
     
     if conductor.latitud is None or conductor.longitud is None:
         raise HTTPException(status_code=400, detail="El conductor no tiene ubicación registrada")
     
-    rest_lat, rest_lng = obtener_coordenadas_restaurante(db)
+    rest_lat, rest_lng = await obtener_coordenadas_restaurante(db)
     distancia = calcular_distancia_haversine(
         float(conductor.latitud),
         float(conductor.longitud),
@@ -250,6 +371,7 @@ def aceptar_pedido(codigo: str, codigo_pedido: str, db: Session = Depends(get_db
     
     # Aceptar el pedido
     pedido.estado = "ACEPTADO"
+    registrar_evento(db, pedido, "aceptado")
     db.commit()
     
     return {
@@ -300,7 +422,10 @@ def rechazar_pedido(codigo: str, codigo_pedido: str, db: Session = Depends(get_d
     # Liberar al conductor
     conductor.is_disponible = True
     
+    # El evento reasigna el pedido de inmediato a otro conductor
+    registrar_evento(db, pedido, "rechazado", conductor_anterior=codigo)
     db.commit()
+    indice_conductores.actualizar_disponibilidad(codigo, True)
     
     return {
         "mensaje": f"Pedido {codigo_pedido} rechazado",
@@ -466,6 +591,7 @@ def actualizar_estado_pedido_conductor(
     
     # Actualizar estado
     pedido.estado = nuevo_estado
+    registrar_evento(db, pedido, "estado", anterior=estado_actual, origen="conductor")
     
     # Si el pedido fue entregado, liberar al conductor
     if nuevo_estado == "ENTREGADO":
@@ -473,6 +599,10 @@ def actualizar_estado_pedido_conductor(
     
     db.commit()
     
+    if nuevo_estado == "ENTREGADO":
+        indice_conductores.actualizar_disponibilidad(codigo, True)
+        despachador.notificar("conductor_liberado")
+    
     # Emojis para cada estado
     emojis_estado = {
         "ACEPTADO": "✅",
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models import ConfiguracionSistema
+from app.schemas import ConfiguracionUpdate, ConfiguracionResponse
+from app.services.configuracion_service import configuracion, notificar_cambio_configuracion
+
+router = APIRouter(prefix="/configuracion", tags=["Configuración"])
+
+
+@router.get("/", response_model=list[ConfiguracionResponse])
+def listar_configuracion(db: Session = Depends(get_db)):
+    """Obtener todos los valores de configuración"""
+    return db.query(ConfiguracionSistema).all()
+
+
+@router.get("/{clave}", response_model=ConfiguracionResponse)
+def obtener_configuracion(clave: str, db: Session = Depends(get_db)):
+    """Obtener un valor de configuración por clave"""
+    config = db.query(ConfiguracionSistema).filter(ConfiguracionSistema.clave == clave).first()
+    if not config:
+        raise HTTPException(status_code=404, detail="Clave de configuración no encontrada")
+    return config
+
+
+@router.put("/{clave}", response_model=ConfiguracionResponse)
+def actualizar_configuracion(clave: str, datos: ConfiguracionUpdate, db: Session = Depends(get_db)):
+    """Crear o actualizar un valor de configuración (ej: REST_LAT, REST_LNG)"""
+    config = db.query(ConfiguracionSistema).filter(ConfiguracionSistema.clave == clave).first()
+    if not config:
+        config = ConfiguracionSistema(clave=clave)
+        db.add(config)
+    config.valor = datos.valor
+    notificar_cambio_configuracion(db)
+    db.commit()
+    db.refresh(config)
+    
+    # Los caminos calientes leen la caché: recargar en la próxima lectura
+    # (los demás procesos lo hacen al recibir el NOTIFY)
+    configuracion.invalidar()
+    
+    return config
+
+
+@router.delete("/{clave}")
+def eliminar_configuracion(clave: str, db: Session = Depends(get_db)):
+    """Eliminar un valor de configuración"""
+    config = db.query(ConfiguracionSistema).filter(ConfiguracionSistema.clave == clave).first()
+    if not config:
+        raise HTTPException(status_code=404, detail="Clave de configuración no encontrada")
+    db.delete(config)
+    notificar_cambio_configuracion(db)
+    db.commit()
+    configuracion.invalidar()
+    return {"mensaje": "Configuración eliminada"}
@@ -1,11 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, get_async_db, AsyncSessionLocal
 from app.models import Pedido, ItemPedido, Conductor
 from app.schemas import PedidoCreate, PedidoResponse
+from app.services.indice_conductores import indice_conductores
+from app.services.eventos_pedido import registrar_evento
+import asyncio
+import json
 import random
 import string
 
+# Segundos sin eventos tras los que se envía un ping al cliente SSE
+SSE_KEEPALIVE_SEGUNDOS = 15
+
 router = APIRouter(prefix="/pedidos", tags=["Pedidos"])
 
 
@@ -30,6 +40,62 @@ def obtener_pedido(codigo: str, db: Session = Depends(get_db)):
     return pedido
 
 
+@router.get("/{codigo}/recorrido")
+async def obtener_recorrido_pedido(codigo: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Recorrido del conductor durante el pedido (polyline codificada),
+    desde el historial de ubicaciones
+    """
+    from app.services.historial_service import obtener_recorrido
+    
+    pedido = await db.scalar(select(Pedido).where(Pedido.codigo_pedido == codigo))
+    if not pedido:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado")
+    
+    return await obtener_recorrido(db, pedido)
+
+
+@router.get("/{codigo}/stream")
+async def stream_pedido(codigo: str):
+    """
+    Seguimiento del pedido por Server-Sent Events
+    - event: estado   -> cambios de estado / conductor asignado
+    - event: posicion -> posición del conductor cuando se mueve
+    El stream termina cuando el pedido se entrega o se cancela.
+    """
+    from app.services.canales_pedidos import canales_pedidos
+    
+    async with AsyncSessionLocal() as db:
+        existe = await db.scalar(select(Pedido.codigo_pedido).where(Pedido.codigo_pedido == codigo))
+    if not existe:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado")
+    
+    async def eventos():
+        cola = canales_pedidos.suscribir(codigo)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=SSE_KEEPALIVE_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    # Comentario SSE: mantiene viva la conexión en proxies
+                    yield ": ping\n\n"
+                    continue
+                if evento is None:
+                    yield "event: fin\ndata: {}\n\n"
+                    return
+                tipo, datos = evento
+                yield f"event: {tipo}\ndata: {json.dumps(datos, default=str)}\n\n"
+        finally:
+            canales_pedidos.desuscribir(codigo, cola)
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/cliente/{telefono}", response_model=list[PedidoResponse])
 def pedidos_por_cliente(telefono: str, db: Session = Depends(get_db)):
     """Obtener pedidos de un cliente"""
@@ -72,8 +138,11 @@ def crear_pedido(pedido: PedidoCreate, db: Session = Depends(get_db)):
         )
         db.add(db_item)
     
+    # El evento dispara la asignación automática de inmediato
+    registrar_evento(db, db_pedido, "creado")
     db.commit()
     db.refresh(db_pedido)
+    
     return db_pedido
 
 
@@ -98,7 +167,9 @@ def actualizar_estado(codigo: str, nuevo_estado: str, db: Session = Depends(get_
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
     
+    estado_anterior = pedido.estado
     pedido.estado = nuevo_estado
+    registrar_evento(db, pedido, "estado", anterior=estado_anterior)
     db.commit()
     
     return {"mensaje": f"Estado actualizado a {nuevo_estado}"}
@@ -107,11 +178,17 @@ def actualizar_estado(codigo: str, nuevo_estado: str, db: Session = Depends(get_
 @router.put("/{codigo}/asignar/{codigo_conductor}")
 def asignar_conductor(codigo: str, codigo_conductor: str, db: Session = Depends(get_db)):
     """Asignar un conductor manualmente al pedido"""
-    pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo).first()
+    # Bloqueo de ambas filas: la asignación automática (SKIP LOCKED) las salta
+    pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo).with_for_update().first()
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
     
-    conductor = db.query(Conductor).filter(Conductor.codigo_conductor == codigo_conductor).first()
+    conductor = (
+        db.query(Conductor)
+        .filter(Conductor.codigo_conductor == codigo_conductor)
+        .with_for_update()
+        .first()
+    )
     if not conductor:
         raise HTTPException(status_code=404, detail="Conductor no encontrado")
     
@@ -122,20 +199,22 @@ def asignar_conductor(codigo: str, codigo_conductor: str, db: Session = Depends(
     pedido.conductor_codigo = codigo_conductor
     pedido.estado = "ASIGNADO"
     conductor.is_disponible = False
+    registrar_evento(db, pedido, "asignado", manual=True)
     
     db.commit()
+    indice_conductores.actualizar_disponibilidad(codigo_conductor, False)
     
     return {"mensaje": f"Conductor {codigo_conductor} asignado al pedido {codigo}"}
 
 
 @router.put("/{codigo}/asignar-automatico")
-def asignar_conductor_automatico(codigo: str, db: Session = Depends(get_db)):
+async def asignar_conductor_automatico(codigo: str, db: AsyncSession = Depends(get_async_db)):
     """
     Asignar automáticamente el conductor más cercano al restaurante
     """
     from app.services.conductor_service import asignar_conductor_a_pedido
     
-    resultado = asignar_conductor_a_pedido(db, codigo)
+    resultado = await asignar_conductor_a_pedido(db, codigo)
     
     if not resultado["exito"]:
         raise HTTPException(status_code=400, detail=resultado["mensaje"])
@@ -144,27 +223,33 @@ def asignar_conductor_automatico(codigo: str, db: Session = Depends(get_db)):
 
 
 @router.put("/{codigo}/liberar-conductor")
-def liberar_conductor_pedido(codigo: str, db: Session = Depends(get_db)):
+async def liberar_conductor_pedido(codigo: str, db: AsyncSession = Depends(get_async_db)):
     """
     Libera el conductor asignado al pedido (lo marca como disponible)
     Útil cuando el pedido se cancela o se entrega
     """
-    from app.services.conductor_service import liberar_conductor
+    from app.services.conductor_service import liberar_conductor, conductor_liberado
     
-    pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo).first()
+    pedido = await db.scalar(select(Pedido).where(Pedido.codigo_pedido == codigo))
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
     
     if not pedido.conductor_codigo:
         raise HTTPException(status_code=400, detail="El pedido no tiene conductor asignado")
     
-    resultado = liberar_conductor(db, pedido.conductor_codigo)
+    codigo_conductor = pedido.conductor_codigo
+    # Conductor, pedido y evento en una sola transacción
+    resultado = await liberar_conductor(db, codigo_conductor, commit=False)
     
     # Limpiar conductor del pedido
     pedido.conductor_codigo = None
     if pedido.estado == "ASIGNADO":
         pedido.estado = "SOLICITADO"
-    db.commit()
+    # Si el pedido volvió a la cola, el evento reintenta la asignación
+    registrar_evento(db, pedido, "liberado", conductor_anterior=codigo_conductor)
+    await db.commit()
+    if resultado["exito"]:
+        conductor_liberado(codigo_conductor)
     
     return resultado
 
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Producto
 from app.schemas import ProductoCreate, ProductoResponse
+from app.services.catalogo_service import notificar_cambio_catalogo
 
 router = APIRouter(prefix="/productos", tags=["Productos"])
 
@@ -33,6 +34,7 @@ def crear_producto(producto: ProductoCreate, db: Session = Depends(get_db)):
     """Crear un nuevo producto"""
     db_producto = Producto(**producto.model_dump())
     db.add(db_producto)
+    notificar_cambio_catalogo(db)
     db.commit()
     db.refresh(db_producto)
     return db_producto
@@ -45,9 +47,14 @@ def actualizar_producto(codigo: str, producto: ProductoCreate, db: Session = Dep
     if not db_producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
+    # El file_id guardado por el bot es de la imagen anterior
+    if producto.img_url != db_producto.img_url:
+        db_producto.img_file_id = None
+    
     for key, value in producto.model_dump().items():
         setattr(db_producto, key, value)
     
+    notificar_cambio_catalogo(db)
     db.commit()
     db.refresh(db_producto)
     return db_producto
@@ -60,5 +67,6 @@ def eliminar_producto(codigo: str, db: Session = Depends(get_db)):
     if not producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     db.delete(producto)
+    notificar_cambio_catalogo(db)
     db.commit()
     return {"mensaje": "Producto eliminado"}
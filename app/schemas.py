@@ -1,9 +1,20 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, Literal
 from decimal import Decimal
 from datetime import datetime
 
 
+# ============ CONFIGURACION ============
+class ConfiguracionUpdate(BaseModel):
+    valor: Optional[str] = None
+
+class ConfiguracionResponse(ConfiguracionUpdate):
+    clave: str
+    
+    class Config:
+        from_attributes = True
+
+
 # ============ CATEGORIA ============
 class CategoriaBase(BaseModel):
     nombre: str
@@ -96,6 +107,34 @@ class UbicacionResponse(BaseModel):
         from_attributes = True
 
 
+# Schemas para carga de ubicaciones en lote
+class UbicacionFix(BaseModel):
+    codigo_conductor: str
+    latitud: Decimal = Field(ge=-90, le=90)
+    longitud: Decimal = Field(ge=-180, le=180)
+    timestamp: datetime
+
+class UbicacionLote(BaseModel):
+    ubicaciones: list[UbicacionFix] = Field(max_length=5000)
+
+class UbicacionAck(BaseModel):
+    codigo_conductor: str
+    # aplicada | obsoleta (ya había una posición más nueva) | no_encontrado |
+    # futura (todos sus fixes tenían timestamp en el futuro: rechazados)
+    estado: Literal["aplicada", "obsoleta", "no_encontrado", "futura"]
+    timestamp: datetime
+
+class UbicacionLoteResponse(BaseModel):
+    aplicadas: int
+    obsoletas: int
+    no_encontrados: int
+    # Fixes del mismo conductor superados por otro más nuevo en el mismo lote
+    duplicadas: int
+    # Fixes rechazados por tener timestamp en el futuro
+    futuras: int
+    resultados: list[UbicacionAck]
+
+
 # ============ PEDIDO ============
 class ItemPedidoBase(BaseModel):
     codigo_producto: str
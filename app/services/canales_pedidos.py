@@ -0,0 +1,216 @@
+"""
+Canales de seguimiento de pedidos
+Pub/sub en memoria detrás de GET /pedidos/{codigo}/stream (SSE): todos los
+clientes que siguen el mismo pedido comparten un canal. Los cambios de estado
+llegan por el bus de eventos de pedidos y las posiciones de los conductores
+al instante desde el almacén de posiciones, sin pasar por la BD. Un único
+sondeo de respaldo lee en una consulta el estado de todos los pedidos seguidos.
+"""
+import asyncio
+import threading
+from sqlalchemy import select
+from app.database import AsyncSessionLocal
+from app.models import Conductor, Pedido
+from app.services.conductor_service import calcular_distancia_haversine
+from app.services.eventos_pedido import relay_eventos
+
+
+# Cada cuánto se leen de la BD los estados de los pedidos seguidos (respaldo:
+# los cambios llegan antes por el bus de eventos; también trae la posición
+# de conductores que reportan a otro proceso)
+INTERVALO_SONDEO_SEGUNDOS = 5.0
+
+# Movimiento mínimo del conductor para publicar una posición nueva
+UMBRAL_POSICION_METROS = 10
+
+# Eventos encolados por suscriptor; si un cliente lento se atrasa se
+# descartan los más viejos
+MAX_EVENTOS_SUSCRIPTOR = 100
+
+ESTADOS_FINALES = ("ENTREGADO", "CANCELADO")
+
+
+class CanalesPedidos:
+    """
+    Un canal por pedido seguido, con la cola de cada suscriptor y el último
+    estado/posición publicados (un suscriptor nuevo los recibe de entrada).
+
+    Los suscriptores viven en el event loop de la API; posicion_conductor()
+    se puede llamar desde cualquier hilo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # codigo_pedido -> {"suscriptores": set[Queue], "estado": dict | None, "posicion": dict | None}
+        self._canales: dict[str, dict] = {}
+        # codigo_conductor -> códigos de pedido seguidos de ese conductor
+        self._por_conductor: dict[str, set] = {}
+        self._sondeo: asyncio.Task | None = None
+
+    @property
+    def total(self) -> int:
+        return len(self._canales)
+
+    def suscribir(self, codigo_pedido: str) -> asyncio.Queue:
+        """Cola de eventos (tipo, datos) del pedido; None indica fin del stream"""
+        self._loop = asyncio.get_running_loop()
+        cola = asyncio.Queue(maxsize=MAX_EVENTOS_SUSCRIPTOR)
+        with self._lock:
+            canal = self._canales.setdefault(
+                codigo_pedido, {"suscriptores": set(), "estado": None, "posicion": None}
+            )
+            canal["suscriptores"].add(cola)
+            for tipo in ("estado", "posicion"):
+                if canal[tipo] is not None:
+                    cola.put_nowait((tipo, canal[tipo]))
+
+        if self._sondeo is None or self._sondeo.done():
+            self._sondeo = asyncio.create_task(self._sondear())
+        return cola
+
+    def desuscribir(self, codigo_pedido: str, cola: asyncio.Queue):
+        with self._lock:
+            canal = self._canales.get(codigo_pedido)
+            if canal is None:
+                return
+            canal["suscriptores"].discard(cola)
+            if not canal["suscriptores"]:
+                self._cerrar_canal(codigo_pedido)
+
+    def posicion_conductor(self, codigo_conductor: str, latitud, longitud, timestamp):
+        """El conductor reportó una posición: publicarla en sus pedidos seguidos"""
+        if codigo_conductor not in self._por_conductor or self._loop is None:
+            return
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(
+            self._publicar_posicion, codigo_conductor, float(latitud), float(longitud), timestamp
+        )
+
+    def recibir_evento(self, evento: dict):
+        """Suscriptor del bus de eventos de pedidos (en el loop del relay)"""
+        if evento["codigo_pedido"] in self._canales:
+            self._publicar_estado(evento["codigo_pedido"], evento["estado"], evento["conductor_codigo"])
+
+    async def _sondear(self):
+        """Lee el estado de todos los pedidos seguidos mientras haya canales"""
+        while self._canales:
+            try:
+                await self._actualizar_estados()
+            except Exception as e:
+                print(f"❌ Error al leer pedidos seguidos: {e}")
+            await asyncio.sleep(INTERVALO_SONDEO_SEGUNDOS)
+
+    async def _actualizar_estados(self):
+        from app.services.ubicacion_service import almacen_posiciones
+
+        codigos = list(self._canales)
+        if not codigos:
+            return
+        async with AsyncSessionLocal() as db:
+            filas = (await db.execute(
+                select(
+                    Pedido.codigo_pedido,
+                    Pedido.estado,
+                    Pedido.conductor_codigo,
+                    Conductor.latitud,
+                    Conductor.longitud,
+                    Conductor.ultima_actualizacion
+                )
+                .outerjoin(Conductor, Conductor.codigo_conductor == Pedido.conductor_codigo)
+                .where(Pedido.codigo_pedido.in_(codigos))
+            )).all()
+
+        encontrados = set()
+        for fila in filas:
+            encontrados.add(fila.codigo_pedido)
+            self._publicar_estado(fila.codigo_pedido, fila.estado, fila.conductor_codigo)
+            if fila.conductor_codigo is None:
+                continue
+            latitud, longitud, timestamp = fila.latitud, fila.longitud, fila.ultima_actualizacion
+            fix = almacen_posiciones.obtener(fila.conductor_codigo)
+            if fix is not None and (timestamp is None or fix[2] > timestamp):
+                latitud, longitud, timestamp = fix
+            if latitud is not None and longitud is not None:
+                self._publicar_posicion(fila.conductor_codigo, float(latitud), float(longitud), timestamp)
+
+        # Pedidos borrados: terminar sus streams
+        for codigo in set(codigos) - encontrados:
+            self._finalizar(codigo)
+
+    def _publicar_estado(self, codigo_pedido: str, estado: str, conductor_codigo: str | None):
+        canal = self._canales.get(codigo_pedido)
+        if canal is None:
+            return
+        datos = {"codigo_pedido": codigo_pedido, "estado": estado, "conductor_codigo": conductor_codigo}
+        if canal["estado"] != datos:
+            anterior = canal["estado"]
+            canal["estado"] = datos
+            with self._lock:
+                # Seguir al conductor nuevo (asignación o reasignación)
+                if anterior and anterior["conductor_codigo"] != conductor_codigo:
+                    self._quitar_conductor(anterior["conductor_codigo"], codigo_pedido)
+                    canal["posicion"] = None
+                if conductor_codigo:
+                    self._por_conductor.setdefault(conductor_codigo, set()).add(codigo_pedido)
+            self._emitir(canal, "estado", datos)
+        if estado in ESTADOS_FINALES:
+            self._finalizar(codigo_pedido)
+
+    def _publicar_posicion(self, codigo_conductor: str, latitud: float, longitud: float, timestamp):
+        for codigo_pedido in list(self._por_conductor.get(codigo_conductor, ())):
+            canal = self._canales.get(codigo_pedido)
+            if canal is None:
+                continue
+            anterior = canal["posicion"]
+            if anterior is not None:
+                if timestamp is not None and anterior["timestamp"] is not None and timestamp <= anterior["timestamp"]:
+                    continue
+                movido = calcular_distancia_haversine(
+                    anterior["latitud"], anterior["longitud"], latitud, longitud
+                ) * 1000
+                if movido < UMBRAL_POSICION_METROS:
+                    continue
+            datos = {
+                "codigo_conductor": codigo_conductor,
+                "latitud": latitud,
+                "longitud": longitud,
+                "timestamp": timestamp
+            }
+            canal["posicion"] = datos
+            self._emitir(canal, "posicion", datos)
+
+    def _emitir(self, canal: dict, tipo: str, datos: dict | None):
+        for cola in list(canal["suscriptores"]):
+            if cola.full():
+                cola.get_nowait()
+            cola.put_nowait((tipo, datos) if tipo else None)
+
+    def _finalizar(self, codigo_pedido: str):
+        """El pedido terminó (o no existe): cerrar los streams"""
+        with self._lock:
+            canal = self._canales.get(codigo_pedido)
+            if canal is None:
+                return
+            self._emitir(canal, None, None)
+            self._cerrar_canal(codigo_pedido)
+
+    def _cerrar_canal(self, codigo_pedido: str):
+        """Requiere tener el lock"""
+        canal = self._canales.pop(codigo_pedido)
+        if canal["estado"] and canal["estado"]["conductor_codigo"]:
+            self._quitar_conductor(canal["estado"]["conductor_codigo"], codigo_pedido)
+
+    def _quitar_conductor(self, codigo_conductor: str, codigo_pedido: str):
+        """Requiere tener el lock"""
+        pedidos = self._por_conductor.get(codigo_conductor)
+        if pedidos is not None:
+            pedidos.discard(codigo_pedido)
+            if not pedidos:
+                del self._por_conductor[codigo_conductor]
+
+
+# Instancia única del proceso
+canales_pedidos = CanalesPedidos()
+relay_eventos.suscribir(canales_pedidos.recibir_evento)
@@ -0,0 +1,17 @@
+"""
+Cambios del catálogo (categorías y productos)
+Los routers que modifican el catálogo lo avisan con NOTIFY en CANAL_CATALOGO,
+dentro de la misma transacción: Postgres lo entrega al hacer commit. Los
+procesos del bot lo reciben por el relay de eventos y recargan su copia en
+memoria del menú (app/bot/catalogo.py).
+"""
+from sqlalchemy import func, select
+
+
+# Canal de Postgres (LISTEN/NOTIFY) de los cambios del catálogo
+CANAL_CATALOGO = "catalogo"
+
+
+def notificar_cambio_catalogo(db):
+    """Avisa que el catálogo cambió (se envía con el commit; nada si hay rollback)"""
+    db.execute(select(func.pg_notify(CANAL_CATALOGO, "")))
@@ -4,33 +4,49 @@ Calcula distancias y asigna el conductor más cercano al restaurante
 """
 import math
 from decimal import Decimal
-from sqlalchemy.orm import Session
-from app.models import Conductor, Pedido, ConfiguracionSistema
+import numpy as np
+from sqlalchemy import literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.models import Conductor, Pedido
+from app.services.configuracion_service import configuracion
+from app.services.eventos_pedido import registrar_evento
+from app.services.despacho_service import despachador
+from app.services.indice_conductores import indice_conductores
 
 
 # Coordenadas del restaurante (Catedral - por defecto)
 RESTAURANTE_LAT = -17.7838759
 RESTAURANTE_LNG = -63.1817578
 
+# Candidatos (los más cercanos) que se intentan bloquear al asignar un pedido:
+# el índice puede estar desactualizado y otro worker puede tener alguno tomado
+CANDIDATOS_ASIGNACION = 5
 
-def obtener_coordenadas_restaurante(db: Session) -> tuple:
+# Máximo de pedidos que toma (y bloquea) cada barrido en lote; el resto queda
+# libre para otros workers
+TAMANO_LOTE_ASIGNACION = 200
+
+# Radios (km) de búsqueda de conductores en la BD: se ensancha de a pasos
+# hasta encontrar suficientes candidatos; después se consulta sin límite
+RADIOS_BUSQUEDA_KM = (2.0, 5.0, 10.0, 25.0)
+
+# Kilómetros por grado de latitud (radio medio de la Tierra)
+KM_POR_GRADO = 111.195
+
+
+async def obtener_coordenadas_restaurante(db: AsyncSession) -> tuple:
     """
     Obtiene las coordenadas del restaurante desde la configuración
+    (caché en memoria; solo va a la BD cuando vence el TTL)
     """
-    try:
-        lat_config = db.query(ConfiguracionSistema).filter(
-            ConfiguracionSistema.clave == "REST_LAT"
-        ).first()
-        lng_config = db.query(ConfiguracionSistema).filter(
-            ConfiguracionSistema.clave == "REST_LNG"
-        ).first()
-        
-        if lat_config and lng_config:
-            return float(lat_config.valor), float(lng_config.valor)
-    except:
-        pass
-    
-    return RESTAURANTE_LAT, RESTAURANTE_LNG
+    await configuracion.asegurar(db)
+    if configuracion.obtener("REST_LAT") is None or configuracion.obtener("REST_LNG") is None:
+        return RESTAURANTE_LAT, RESTAURANTE_LNG
+    return (
+        configuracion.obtener_float("REST_LAT", RESTAURANTE_LAT),
+        configuracion.obtener_float("REST_LNG", RESTAURANTE_LNG)
+    )
 
 
 def calcular_distancia_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -65,17 +81,155 @@ def calcular_distancia_haversine(lat1: float, lon1: float, lat2: float, lon2: fl
     return round(distancia, 2)
 
 
-def obtener_conductores_disponibles(db: Session) -> list:
+def calcular_distancias_haversine(latitudes, longitudes, lat_destino, lng_destino) -> np.ndarray:
+    """
+    Versión vectorizada de calcular_distancia_haversine: calcula de una vez la
+    distancia de N puntos a uno o varios destinos
+    
+    Args:
+        latitudes, longitudes: Coordenadas de origen (ndarray, array.array('d')
+            o cualquier secuencia de números; los buffers se leen sin copiar)
+        lat_destino, lng_destino: Un punto (float) o K puntos (secuencias)
+    
+    Returns:
+        ndarray (N,) de distancias en km si el destino es un punto,
+        o (N, K) si son varios destinos (sin redondear)
+    """
+    lat1 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng1 = np.radians(np.asarray(longitudes, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat_destino, dtype=np.float64))
+    lng2 = np.radians(np.asarray(lng_destino, dtype=np.float64))
+    
+    # Varios destinos: matriz origen x destino por broadcasting
+    if lat2.ndim:
+        lat1, lng1 = lat1[:, None], lng1[:, None]
+        lat2, lng2 = lat2[None, :], lng2[None, :]
+    
+    return _haversine_radianes(lat1, lng1, lat2, lng2)
+
+
+def calcular_longitud_recorrido(latitudes, longitudes) -> float:
     """
-    Obtiene todos los conductores disponibles con ubicación válida
+    Distancia total (km) de un recorrido: suma de los tramos entre puntos
+    consecutivos
     """
-    conductores = db.query(Conductor).filter(
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng = np.radians(np.asarray(longitudes, dtype=np.float64))
+    if lat.size < 2:
+        return 0.0
+    return float(_haversine_radianes(lat[:-1], lng[:-1], lat[1:], lng[1:]).sum())
+
+
+def _haversine_radianes(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """Haversine elemento a elemento sobre arrays en radianes (km)"""
+    R = 6371.0
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * R * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _coordenadas_conductores(conductores: list) -> tuple[np.ndarray, np.ndarray]:
+    """Extrae latitudes y longitudes de los conductores como arrays float64"""
+    n = len(conductores)
+    latitudes = np.fromiter((float(c.latitud) for c in conductores), dtype=np.float64, count=n)
+    longitudes = np.fromiter((float(c.longitud) for c in conductores), dtype=np.float64, count=n)
+    return latitudes, longitudes
+
+
+async def obtener_conductores_disponibles(
+    db: AsyncSession,
+    latitud: float | None = None,
+    longitud: float | None = None,
+    minimo: int = 1,
+    radios_km: tuple = RADIOS_BUSQUEDA_KM,
+    bloquear: bool = False
+) -> list:
+    """
+    Obtiene los conductores disponibles con ubicación válida
+    
+    Si se indica un punto (latitud, longitud), primero filtra en SQL por una
+    caja lat/lng alrededor del punto (usa el índice de coordenadas) y la va
+    ensanchando según radios_km hasta tener al menos `minimo` conductores a
+    menos de ese radio. Así los `minimo` más cercanos siempre están en el
+    resultado sin transferir toda la tabla.
+    
+    Args:
+        latitud, longitud: Punto de referencia (opcional)
+        minimo: Cantidad de candidatos que debe haber dentro del radio
+        radios_km: Radios a probar, de menor a mayor
+        bloquear: Bloquea las filas (FOR UPDATE SKIP LOCKED) hasta el fin de
+            la transacción; los conductores ya bloqueados por otro worker
+            no aparecen en el resultado
+    """
+    filtros = [
         Conductor.is_disponible == True,
         Conductor.latitud.isnot(None),
         Conductor.longitud.isnot(None)
-    ).all()
-    
-    return conductores
+    ]
+    
+    if latitud is not None and longitud is not None:
+        for radio_km in radios_km:
+            conductores = await _conductores_en_caja(db, filtros, latitud, longitud, radio_km, bloquear)
+            if len(conductores) < minimo:
+                continue
+            
+            latitudes, longitudes = _coordenadas_conductores(conductores)
+            distancias = calcular_distancias_haversine(latitudes, longitudes, latitud, longitud)
+            if int((distancias <= radio_km).sum()) >= minimo:
+                return conductores
+    
+    consulta = select(Conductor).where(*filtros)
+    if bloquear:
+        consulta = _con_bloqueo(consulta)
+    resultado = await db.scalars(consulta)
+    
+    return resultado.all()
+
+
+def _con_bloqueo(consulta):
+    """
+    SELECT ... FOR UPDATE SKIP LOCKED: las filas quedan tomadas hasta el fin
+    de la transacción y las que ya tiene otra transacción no se devuelven.
+    populate_existing: si la fila ya estaba en la sesión (leída antes sin
+    bloqueo) se pisa con lo que devuelve la BD y no se decide con datos viejos
+    """
+    return consulta.with_for_update(skip_locked=True).execution_options(populate_existing=True)
+
+
+async def _conductores_en_caja(
+    db: AsyncSession,
+    filtros: list,
+    latitud: float,
+    longitud: float,
+    radio_km: float,
+    bloquear: bool = False
+) -> list:
+    """Conductores dentro de la caja lat/lng que contiene el círculo de radio_km"""
+    dlat = radio_km / KM_POR_GRADO
+    dlng = radio_km / (KM_POR_GRADO * max(math.cos(math.radians(latitud)), 1e-6))
+    
+    consulta = select(Conductor).where(
+        *filtros,
+        Conductor.latitud.between(latitud - dlat, latitud + dlat),
+        Conductor.longitud.between(longitud - dlng, longitud + dlng)
+    )
+    if bloquear:
+        consulta = _con_bloqueo(consulta)
+    resultado = await db.scalars(consulta)
+    return resultado.all()
+
+
+def _datos_conductor(conductor: Conductor, distancia_km: float) -> dict:
+    """Dict con la info pública del conductor y su distancia"""
+    return {
+        "codigo_conductor": conductor.codigo_conductor,
+        "nombre": conductor.nombre,
+        "telefono": conductor.telefono,
+        "tipo_vehiculo": conductor.tipo_vehiculo,
+        "vehiculo": conductor.vehiculo,
+        "latitud": float(conductor.latitud),
+        "longitud": float(conductor.longitud),
+        "distancia_km": distancia_km
+    }
 
 
 def calcular_distancia_conductor_restaurante(
@@ -96,109 +250,162 @@ def calcular_distancia_conductor_restaurante(
         rest_lng
     )
     
-    return {
-        "codigo_conductor": conductor.codigo_conductor,
-        "nombre": conductor.nombre,
-        "telefono": conductor.telefono,
-        "tipo_vehiculo": conductor.tipo_vehiculo,
-        "vehiculo": conductor.vehiculo,
-        "latitud": float(conductor.latitud),
-        "longitud": float(conductor.longitud),
-        "distancia_km": distancia
-    }
+    return _datos_conductor(conductor, distancia)
 
 
-def obtener_conductor_mas_cercano(db: Session) -> dict | None:
+async def obtener_conductor_mas_cercano(db: AsyncSession) -> dict | None:
     """
     Encuentra el conductor disponible más cercano al restaurante
+    Usa el índice espacial en memoria si está cargado; si no, consulta la BD
     
     Returns:
         Dict con info del conductor más cercano o None si no hay disponibles
     """
     # Obtener coordenadas del restaurante
-    rest_lat, rest_lng = obtener_coordenadas_restaurante(db)
+    rest_lat, rest_lng = await obtener_coordenadas_restaurante(db)
     
-    # Obtener conductores disponibles
-    conductores = obtener_conductores_disponibles(db)
+    if indice_conductores.cargado:
+        cercanos = indice_conductores.k_mas_cercanos(rest_lat, rest_lng, 1)
+        return cercanos[0] if cercanos else None
+    
+    # Obtener conductores disponibles (prefiltrados por cercanía en SQL)
+    conductores = await obtener_conductores_disponibles(db, rest_lat, rest_lng)
     
     if not conductores:
         return None
     
-    # Calcular distancia de cada conductor
-    conductores_con_distancia = []
-    for conductor in conductores:
-        info = calcular_distancia_conductor_restaurante(conductor, rest_lat, rest_lng)
-        conductores_con_distancia.append(info)
-    
-    # Ordenar por distancia y retornar el más cercano
-    conductores_con_distancia.sort(key=lambda x: x["distancia_km"])
+    # Distancias de todos los conductores en una sola operación vectorizada
+    latitudes, longitudes = _coordenadas_conductores(conductores)
+    distancias = calcular_distancias_haversine(latitudes, longitudes, rest_lat, rest_lng)
     
-    return conductores_con_distancia[0] if conductores_con_distancia else None
+    # El más cercano (argmin, sin ordenar toda la lista)
+    indice = int(distancias.argmin())
+    return _datos_conductor(conductores[indice], round(float(distancias[indice]), 2))
 
 
-def obtener_conductores_ordenados_por_distancia(db: Session) -> list:
+async def obtener_conductores_ordenados_por_distancia(
+    db: AsyncSession,
+    limite: int | None = None,
+    radio_km: float | None = None
+) -> list:
     """
-    Obtiene todos los conductores disponibles ordenados por distancia al restaurante
+    Obtiene los conductores disponibles ordenados por distancia al restaurante
+    Usa el índice espacial en memoria si está cargado; si no, consulta la BD
+    
+    Args:
+        limite: Máximo de conductores a devolver (los más cercanos)
+        radio_km: Solo conductores a menos de esta distancia
     
     Returns:
         Lista de conductores con su distancia, ordenados de menor a mayor
     """
-    rest_lat, rest_lng = obtener_coordenadas_restaurante(db)
-    conductores = obtener_conductores_disponibles(db)
+    rest_lat, rest_lng = await obtener_coordenadas_restaurante(db)
+    
+    if indice_conductores.cargado:
+        if radio_km is not None:
+            conductores = indice_conductores.dentro_de_radio(rest_lat, rest_lng, radio_km)
+            return conductores[:limite] if limite is not None else conductores
+        if limite is not None:
+            return indice_conductores.k_mas_cercanos(rest_lat, rest_lng, limite)
+        return indice_conductores.todos_ordenados(rest_lat, rest_lng)
+    
+    if radio_km is not None:
+        conductores = await obtener_conductores_disponibles(
+            db, rest_lat, rest_lng, minimo=0, radios_km=(radio_km,)
+        )
+    elif limite is not None:
+        conductores = await obtener_conductores_disponibles(db, rest_lat, rest_lng, minimo=limite)
+    else:
+        conductores = await obtener_conductores_disponibles(db)
     
-    conductores_con_distancia = []
-    for conductor in conductores:
-        info = calcular_distancia_conductor_restaurante(conductor, rest_lat, rest_lng)
-        conductores_con_distancia.append(info)
+    if not conductores:
+        return []
     
-    conductores_con_distancia.sort(key=lambda x: x["distancia_km"])
+    latitudes, longitudes = _coordenadas_conductores(conductores)
+    distancias = calcular_distancias_haversine(latitudes, longitudes, rest_lat, rest_lng)
     
-    return conductores_con_distancia
+    ordenados = [
+        _datos_conductor(conductores[i], round(float(distancias[i]), 2))
+        for i in np.argsort(distancias, kind="stable")
+        if radio_km is None or distancias[i] <= radio_km
+    ]
+    return ordenados[:limite] if limite is not None else ordenados
 
 
-def asignar_conductor_a_pedido(db: Session, codigo_pedido: str) -> dict:
+async def asignar_conductor_a_pedido(db: AsyncSession, codigo_pedido: str, avisar_cliente: bool = True) -> dict:
     """
     Asigna automáticamente el conductor más cercano a un pedido
     
+    El pedido y el conductor elegido se bloquean con FOR UPDATE SKIP LOCKED
+    hasta el commit: si otro worker (otro proceso, la task de asignación o
+    el endpoint manual) ya tiene alguna de esas filas, se salta en lugar de
+    esperar, así un conductor nunca queda asignado a dos pedidos.
+    
     Args:
         db: Sesión de base de datos
         codigo_pedido: Código del pedido a asignar
+        avisar_cliente: False si quien llama ya le muestra el resultado al
+            cliente (el bot no le envía el aviso de asignación)
     
     Returns:
         Dict con resultado de la asignación
     """
     # Verificar que el pedido existe y está en estado SOLICITADO
-    pedido = db.query(Pedido).filter(Pedido.codigo_pedido == codigo_pedido).first()
+    pedido = await db.scalar(
+        _con_bloqueo(select(Pedido).where(Pedido.codigo_pedido == codigo_pedido))
+    )
     
     if not pedido:
+        existe = await db.scalar(
+            select(Pedido.codigo_pedido).where(Pedido.codigo_pedido == codigo_pedido)
+        )
+        if existe:
+            return {"exito": False, "mensaje": "El pedido está siendo asignado por otro proceso"}
         return {"exito": False, "mensaje": "Pedido no encontrado"}
     
     if pedido.estado != "SOLICITADO":
+        await db.commit()  # libera el bloqueo del pedido
         return {"exito": False, "mensaje": f"El pedido ya está en estado: {pedido.estado}"}
     
     if pedido.conductor_codigo:
+        await db.commit()
         return {"exito": False, "mensaje": "El pedido ya tiene un conductor asignado"}
     
-    # Obtener conductor más cercano
-    conductor_info = obtener_conductor_mas_cercano(db)
-    
-    if not conductor_info:
+    # Candidatos más cercanos (índice en memoria o BD, sin bloquear) y se
+    # bloquea el primero que siga libre. El índice puede estar desactualizado
+    # respecto de la BD: si la fila ya no está disponible se corrige el índice
+    candidatos = await obtener_conductores_ordenados_por_distancia(db, limite=CANDIDATOS_ASIGNACION)
+    
+    conductor = None
+    for conductor_info in candidatos:
+        codigo_conductor = conductor_info["codigo_conductor"]
+        conductor = await db.scalar(
+            _con_bloqueo(select(Conductor).where(Conductor.codigo_conductor == codigo_conductor))
+        )
+        if conductor is None:
+            continue  # bloqueado por otro worker
+        if conductor.is_disponible:
+            break
+        indice_conductores.actualizar_disponibilidad(codigo_conductor, False)
+        conductor = None
+    
+    if conductor is None:
+        await db.commit()
         return {"exito": False, "mensaje": "No hay conductores disponibles"}
     
-    # Asignar conductor al pedido
-    codigo_conductor = conductor_info["codigo_conductor"]
-    
     # Actualizar pedido
     pedido.conductor_codigo = codigo_conductor
     pedido.estado = "ASIGNADO"
     
     # Marcar conductor como no disponible
-    conductor = db.query(Conductor).filter(
-        Conductor.codigo_conductor == codigo_conductor
-    ).first()
     conductor.is_disponible = False
+    datos_evento = {"distancia_km": float(conductor_info["distancia_km"])}
+    if not avisar_cliente:
+        datos_evento["avisar_cliente"] = False
+    registrar_evento(db, pedido, "asignado", **datos_evento)
     
-    db.commit()
+    await db.commit()
+    indice_conductores.actualizar_disponibilidad(codigo_conductor, False)
     
     return {
         "exito": True,
@@ -209,26 +416,223 @@ def asignar_conductor_a_pedido(db: Session, codigo_pedido: str) -> dict:
     }
 
 
-def liberar_conductor(db: Session, codigo_conductor: str) -> dict:
+def _asignacion_voraz(costos: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Asignación voraz: cada fila (en orden) toma la columna libre más barata
+
+    Returns:
+        Lista de pares (fila, columna)
+    """
+    libres = np.ones(costos.shape[1], dtype=bool)
+    pares = []
+    for fila in range(min(costos.shape)):
+        candidatos = np.where(libres, costos[fila], np.inf)
+        columna = int(candidatos.argmin())
+        libres[columna] = False
+        pares.append((fila, columna))
+    return pares
+
+
+def _asignacion_optima(costos: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Asignación de costo mínimo (algoritmo Húngaro, variante de caminos
+    aumentantes con potenciales, O(n² · m)). El bucle interno sobre columnas
+    está vectorizado con NumPy.
+
+    Requiere filas <= columnas: todas las filas quedan asignadas.
+
+    Returns:
+        Lista de pares (fila, columna)
+    """
+    n, m = costos.shape
+    if n == 0:
+        return []
+    if n > m:
+        raise ValueError("La matriz de costos debe tener filas <= columnas")
+
+    # Índices 1..n / 1..m; la posición 0 es el nodo ficticio del algoritmo
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)    # p[j] = fila asignada a la columna j
+    way = np.zeros(m + 1, dtype=np.int64)  # columna previa en el camino aumentante
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        usadas = np.zeros(m + 1, dtype=bool)
+
+        while True:
+            usadas[j0] = True
+            i0 = p[j0]
+
+            # Reducir costos de las columnas libres desde la fila i0
+            libres = ~usadas[1:]
+            cur = costos[i0 - 1] - u[i0] - v[1:]
+            mejora = libres & (cur < minv[1:])
+            minv[1:][mejora] = cur[mejora]
+            way[1:][mejora] = j0
+
+            candidatos = np.where(libres, minv[1:], np.inf)
+            j1 = int(candidatos.argmin()) + 1
+            delta = candidatos[j1 - 1]
+
+            # Actualizar potenciales
+            u[p[usadas]] += delta
+            v[usadas] -= delta
+            minv[~usadas] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        # Invertir el camino aumentante
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return sorted((int(p[j]) - 1, j - 1) for j in range(1, m + 1) if p[j] != 0)
+
+
+async def asignar_pedidos_en_lote(db: AsyncSession, estrategia: str | None = None) -> dict:
+    """
+    Asigna en un solo paso los pedidos SOLICITADOS a los conductores disponibles
+
+    Construye una matriz de costos pedidos x conductores (distancia del
+    conductor al origen del pedido) y la resuelve con la estrategia indicada:
+    - "optima": emparejamiento de costo mínimo (Húngaro)
+    - "voraz": cada pedido, por antigüedad, toma el conductor libre más cercano
+
+    Si hay más pedidos que conductores se atienden primero los más antiguos.
+    Todas las asignaciones se confirman en una sola transacción.
+
+    Pedidos y conductores se toman con FOR UPDATE SKIP LOCKED: varios
+    workers (en distintos procesos) pueden drenar la cola de SOLICITADOS en
+    paralelo, cada uno con su parte, sin asignar dos veces la misma fila.
+
+    Args:
+        db: Sesión de base de datos
+        estrategia: "optima" o "voraz" (por defecto, la de la configuración)
+
+    Returns:
+        Dict con las asignaciones realizadas y los pedidos que quedan pendientes
+    """
+    estrategia = estrategia or get_settings().estrategia_asignacion
+    if estrategia not in ("optima", "voraz"):
+        raise ValueError(f"Estrategia de asignación no válida: {estrategia}")
+
+    pedidos = (await db.scalars(
+        _con_bloqueo(
+            select(Pedido).where(
+                # Literal (no parámetro) para que también el plan genérico de
+                # asyncpg use el índice parcial ix_pedido_pendiente_asignacion_fecha
+                Pedido.estado == literal("SOLICITADO", literal_execute=True),
+                Pedido.conductor_codigo.is_(None)
+            ).order_by(Pedido.fecha.asc()).limit(TAMANO_LOTE_ASIGNACION)
+        )
+    )).all()
+
+    if not pedidos:
+        return {"exito": True, "estrategia": estrategia, "asignaciones": [], "pendientes": 0}
+
+    rest_lat, rest_lng = await obtener_coordenadas_restaurante(db)
+    conductores = await obtener_conductores_disponibles(
+        db, rest_lat, rest_lng, minimo=len(pedidos), bloquear=True
+    )
+
+    if not conductores:
+        await db.commit()  # libera los pedidos bloqueados
+        return {
+            "exito": False,
+            "mensaje": "No hay conductores disponibles",
+            "estrategia": estrategia,
+            "asignaciones": [],
+            "pendientes": len(pedidos)
+        }
+
+    # Más pedidos que conductores: el lote son los más antiguos
+    lote = pedidos[:len(conductores)]
+
+    lat_conductores, lng_conductores = _coordenadas_conductores(conductores)
+    costos = calcular_distancias_haversine(
+        [float(p.latitud_origen) if p.latitud_origen is not None else rest_lat for p in lote],
+        [float(p.longitud_origen) if p.longitud_origen is not None else rest_lng for p in lote],
+        lat_conductores,
+        lng_conductores
+    )
+
+    if estrategia == "optima":
+        pares = _asignacion_optima(costos)
+    else:
+        pares = _asignacion_voraz(costos)
+
+    asignaciones = []
+    for fila, columna in pares:
+        pedido = lote[fila]
+        conductor = conductores[columna]
+
+        pedido.conductor_codigo = conductor.codigo_conductor
+        pedido.estado = "ASIGNADO"
+        conductor.is_disponible = False
+        distancia_km = round(float(costos[fila, columna]), 2)
+        registrar_evento(db, pedido, "asignado", distancia_km=distancia_km)
+
+        asignaciones.append({
+            "pedido": pedido.codigo_pedido,
+            "codigo_conductor": conductor.codigo_conductor,
+            "conductor": conductor.nombre,
+            "distancia_km": distancia_km
+        })
+
+    await db.commit()
+
+    for fila, columna in pares:
+        indice_conductores.actualizar_disponibilidad(conductores[columna].codigo_conductor, False)
+
+    return {
+        "exito": True,
+        "estrategia": estrategia,
+        "asignaciones": asignaciones,
+        "distancia_total_km": round(float(sum(costos[f, c] for f, c in pares)), 2),
+        "pendientes": len(pedidos) - len(asignaciones)
+    }
+
+
+async def liberar_conductor(db: AsyncSession, codigo_conductor: str, commit: bool = True) -> dict:
     """
     Libera un conductor (lo marca como disponible)
     Se usa cuando el pedido se entrega o cancela
+    
+    Args:
+        commit: False si quien llama confirma el cambio en su propia
+            transacción (junto con el pedido y su evento); después del commit
+            debe llamar a conductor_liberado()
     """
-    conductor = db.query(Conductor).filter(
-        Conductor.codigo_conductor == codigo_conductor
-    ).first()
+    conductor = await db.scalar(
+        select(Conductor).where(Conductor.codigo_conductor == codigo_conductor)
+    )
     
     if not conductor:
         return {"exito": False, "mensaje": "Conductor no encontrado"}
     
     conductor.is_disponible = True
-    db.commit()
+    if commit:
+        await db.commit()
+        conductor_liberado(codigo_conductor)
     
     return {"exito": True, "mensaje": f"Conductor {conductor.nombre} disponible"}
 
 
-def calcular_distancia_conductor_cliente(
-    db: Session,
+def conductor_liberado(codigo_conductor: str):
+    """Actualiza el índice y dispara la asignación de pendientes (después del commit)"""
+    indice_conductores.actualizar_disponibilidad(codigo_conductor, True)
+    # Hay un conductor libre: disparar la asignación de pedidos pendientes
+    despachador.notificar("conductor_liberado")
+
+
+async def calcular_distancia_conductor_cliente(
+    db: AsyncSession,
     codigo_conductor: str,
     lat_cliente: float,
     lng_cliente: float
@@ -236,9 +640,9 @@ def calcular_distancia_conductor_cliente(
     """
     Calcula la distancia entre un conductor y la ubicación del cliente
     """
-    conductor = db.query(Conductor).filter(
-        Conductor.codigo_conductor == codigo_conductor
-    ).first()
+    conductor = await db.scalar(
+        select(Conductor).where(Conductor.codigo_conductor == codigo_conductor)
+    )
     
     if not conductor or not conductor.latitud or not conductor.longitud:
         return {"distancia_km": None, "mensaje": "Conductor sin ubicación"}
@@ -0,0 +1,121 @@
+"""
+Conexiones WebSocket de los conductores
+Registro de los sockets abiertos en /conductores/{codigo}/stream para
+enviarles pushes (pedido asignado, cambios de estado). Los pushes salen de
+los eventos de pedidos, así llegan aunque el cambio ocurra en otro proceso
+(bot, despachador u otro worker)
+"""
+import asyncio
+import threading
+from app.services.eventos_pedido import relay_eventos
+
+
+class ConexionesConductores:
+    """
+    Socket abierto de cada conductor (uno por conductor: una conexión nueva
+    reemplaza a la anterior). enviar() se puede llamar desde el event loop o
+    desde el threadpool de FastAPI; el envío siempre ocurre en el loop del
+    socket y de a un mensaje por conexión.
+
+    Los sockets son locales al proceso, pero cada proceso recibe todos los
+    eventos de pedidos por el relay: el que tiene el socket envía el push
+    aunque el cambio haya ocurrido en otro proceso.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # codigo -> (websocket, loop, lock de envío)
+        self._conexiones: dict[str, tuple] = {}
+        self._envios: set[asyncio.Future] = set()
+
+    def conectar(self, codigo_conductor: str, websocket):
+        """
+        Registra el socket del conductor
+
+        Returns:
+            El socket anterior del conductor (para cerrarlo), o None
+        """
+        entrada = (websocket, asyncio.get_running_loop(), asyncio.Lock())
+        with self._lock:
+            anterior = self._conexiones.get(codigo_conductor)
+            self._conexiones[codigo_conductor] = entrada
+        return anterior[0] if anterior else None
+
+    def desconectar(self, codigo_conductor: str, websocket):
+        """Quita el socket (solo si sigue siendo el registrado)"""
+        with self._lock:
+            actual = self._conexiones.get(codigo_conductor)
+            if actual is not None and actual[0] is websocket:
+                del self._conexiones[codigo_conductor]
+
+    def conectado(self, codigo_conductor: str) -> bool:
+        return codigo_conductor in self._conexiones
+
+    @property
+    def total(self) -> int:
+        return len(self._conexiones)
+
+    def enviar(self, codigo_conductor: str | None, mensaje: dict) -> bool:
+        """
+        Envía un mensaje JSON al conductor sin esperar (fire-and-forget)
+
+        Returns:
+            False si el conductor no tiene socket abierto en este proceso
+        """
+        if not codigo_conductor:
+            return False
+        entrada = self._conexiones.get(codigo_conductor)
+        if entrada is None:
+            return False
+
+        loop = entrada[1]
+        if loop.is_closed():
+            return False
+        envio = asyncio.run_coroutine_threadsafe(self._enviar(codigo_conductor, entrada, mensaje), loop)
+        self._envios.add(envio)
+        envio.add_done_callback(self._envios.discard)
+        return True
+
+    async def _enviar(self, codigo_conductor: str, entrada: tuple, mensaje: dict):
+        websocket, _, lock = entrada
+        try:
+            async with lock:
+                await websocket.send_json(mensaje)
+        except Exception:
+            # Socket caído: el handler del stream lo termina de limpiar
+            self.desconectar(codigo_conductor, websocket)
+
+
+def notificar_pedido_asignado(codigo_conductor: str, codigo_pedido: str, distancia_km: float | None = None):
+    """Push al conductor: se le asignó un pedido (debe aceptarlo o rechazarlo)"""
+    conexiones_conductores.enviar(codigo_conductor, {
+        "tipo": "pedido_asignado",
+        "codigo_pedido": codigo_pedido,
+        "distancia_km": distancia_km
+    })
+
+
+def notificar_estado_pedido(codigo_conductor: str | None, codigo_pedido: str, estado: str):
+    """Push al conductor: cambió el estado de un pedido suyo"""
+    conexiones_conductores.enviar(codigo_conductor, {
+        "tipo": "estado_pedido",
+        "codigo_pedido": codigo_pedido,
+        "estado": estado
+    })
+
+
+def _push_evento(evento: dict):
+    """Suscriptor del bus de eventos de pedidos"""
+    if evento["tipo"] == "asignado":
+        notificar_pedido_asignado(
+            evento["conductor_codigo"], evento["codigo_pedido"], evento["datos"].get("distancia_km")
+        )
+    elif evento["tipo"] == "estado" and evento["datos"].get("origen") != "conductor":
+        notificar_estado_pedido(evento["conductor_codigo"], evento["codigo_pedido"], evento["estado"])
+    elif evento["tipo"] == "liberado":
+        notificar_estado_pedido(evento["datos"].get("conductor_anterior"), evento["codigo_pedido"], "LIBERADO")
+
+
+# Instancia única del proceso
+conexiones_conductores = ConexionesConductores()
+relay_eventos.suscribir(_push_evento)
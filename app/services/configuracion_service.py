@@ -0,0 +1,111 @@
+"""
+Servicio de configuración del sistema
+Copia en memoria de toda la tabla configuracion_sistema con TTL, para que
+los caminos calientes (asignación, distancias) lean valores como las
+coordenadas del restaurante sin ir a la BD en cada llamada
+
+El router de /configuracion avisa cada cambio con NOTIFY en
+CANAL_CONFIGURACION (se entrega con el commit) y cada proceso invalida su
+copia al recibirlo por el relay de eventos.
+"""
+import threading
+import time
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import ConfiguracionSistema
+from app.services.eventos_pedido import relay_eventos
+
+
+# Canal de Postgres (LISTEN/NOTIFY) de los cambios de configuracion_sistema
+CANAL_CONFIGURACION = "configuracion"
+
+# Tiempo máximo que se sirve la copia sin recargarla (respaldo por si se
+# pierde un NOTIFY o se cambia la tabla fuera de la API)
+TTL_CONFIGURACION_SEGUNDOS = 60.0
+
+
+def notificar_cambio_configuracion(db):
+    """Avisa que la configuración cambió (se envía con el commit; nada si hay rollback)"""
+    db.execute(select(func.pg_notify(CANAL_CONFIGURACION, "")))
+
+
+class CacheConfiguracion:
+    """
+    Caché de configuracion_sistema (clave -> valor).
+    Se recarga entera cuando vence el TTL o tras invalidar(). Si la recarga
+    falla se siguen sirviendo los últimos valores conocidos.
+    """
+
+    def __init__(self, ttl: float = TTL_CONFIGURACION_SEGUNDOS):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._valores: dict[str, str | None] = {}
+        self._vence_en = 0.0
+        # Se incrementa al invalidar: una carga iniciada antes no marca la copia como vigente
+        self._generacion = 0
+
+    # ============ CARGA ============
+    @property
+    def vigente(self) -> bool:
+        return time.monotonic() < self._vence_en
+
+    def invalidar(self, *_):
+        """Fuerza a recargar en la próxima lectura"""
+        with self._lock:
+            self._generacion += 1
+            self._vence_en = 0.0
+
+    async def asegurar(self, db: AsyncSession):
+        """
+        Recarga la copia si venció. La lectura va en un SAVEPOINT: si falla
+        se deshace solo ella y la transacción de quien llama (con sus filas
+        bloqueadas) sigue usable.
+        """
+        if self.vigente:
+            return
+        generacion = self._generacion
+        try:
+            async with db.begin_nested():
+                filas = (await db.execute(
+                    select(ConfiguracionSistema.clave, ConfiguracionSistema.valor)
+                )).all()
+        except SQLAlchemyError as e:
+            self._fallo_recarga(e)
+            return
+        self._guardar(filas, generacion)
+
+    def _guardar(self, filas: list, generacion: int):
+        with self._lock:
+            self._valores = {clave: valor for clave, valor in filas}
+            if generacion == self._generacion:
+                self._vence_en = time.monotonic() + self._ttl
+
+    def _fallo_recarga(self, error: Exception):
+        print(f"⚠️ No se pudo recargar configuracion_sistema, se usan los últimos valores: {error}")
+        # Reintentar en unos segundos en lugar de en cada llamada
+        with self._lock:
+            self._vence_en = time.monotonic() + min(self._ttl, 5.0)
+
+    # ============ LECTURA ============
+    def obtener(self, clave: str, defecto: str | None = None) -> str | None:
+        valor = self._valores.get(clave)
+        return defecto if valor is None else valor
+
+    def obtener_float(self, clave: str, defecto: float) -> float:
+        return self._convertir(clave, float, defecto)
+
+    def _convertir(self, clave: str, tipo, defecto):
+        valor = self.obtener(clave)
+        if valor is None:
+            return defecto
+        try:
+            return tipo(valor)
+        except ValueError:
+            print(f"⚠️ Configuración {clave}={valor!r} no es un {tipo.__name__} válido, se usa {defecto}")
+            return defecto
+
+
+# Instancia única del proceso
+configuracion = CacheConfiguracion()
+relay_eventos.escuchar(CANAL_CONFIGURACION, configuracion.invalidar)
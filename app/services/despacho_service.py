@@ -0,0 +1,159 @@
+"""
+Servicio de despacho de asignaciones
+Cola de eventos en memoria que dispara la asignación automática en cuanto
+ocurre algo relevante (pedido creado, pedido rechazado, conductor liberado),
+en lugar de esperar al siguiente barrido periódico. Los pedidos que vuelven
+a la cola llegan desde el bus de eventos de pedidos (ver app/dispatcher.py);
+los conductores que quedan libres se notifican directamente.
+
+Si la task de asignación corre en otro proceso (ver app/dispatcher.py), los
+eventos se publican con NOTIFY en el canal CANAL_ASIGNACION y el despachador
+líder los recibe con LISTEN.
+"""
+import asyncio
+import json
+from app.database import conectar_asyncpg
+
+
+# Canal de Postgres (LISTEN/NOTIFY) para los eventos entre procesos
+CANAL_ASIGNACION = "asignacion_pedidos"
+
+
+class DespachadorAsignacion:
+    """
+    Cola de eventos de asignación.
+    Los routers síncronos (threadpool) y el bot (event loop) la alimentan con
+    notificar(); la task de asignación la consume con esperar_eventos().
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._cola: asyncio.Queue | None = None
+        # Publicación a otros procesos (NOTIFY)
+        self._loop_publicacion: asyncio.AbstractEventLoop | None = None
+        self._conexion = None
+        self._lock_publicacion: asyncio.Lock | None = None
+        self._envios: set[asyncio.Task] = set()
+
+    @property
+    def activo(self) -> bool:
+        """True si la task de asignación consume eventos en este proceso"""
+        return self._cola is not None
+
+    def iniciar(self, loop: asyncio.AbstractEventLoop):
+        """Vincula la cola al event loop donde corre la task de asignación"""
+        self._loop = loop
+        self._cola = asyncio.Queue()
+
+    def detener(self):
+        """Desvincula la cola (los eventos posteriores se ignoran o se publican)"""
+        self._loop = None
+        self._cola = None
+
+    async def iniciar_publicacion(self):
+        """
+        Abre la conexión usada para publicar eventos a otros procesos.
+        Se llama desde el event loop del proceso (lifespan de la API, post_init del bot).
+        """
+        self._conexion = await conectar_asyncpg()
+        self._lock_publicacion = asyncio.Lock()
+        self._loop_publicacion = asyncio.get_running_loop()
+
+    async def detener_publicacion(self):
+        """Cierra la conexión de publicación"""
+        self._loop_publicacion = None
+        if self._envios:
+            await asyncio.gather(*self._envios, return_exceptions=True)
+        conexion, self._conexion = self._conexion, None
+        if conexion is not None:
+            await conexion.close()
+
+    def notificar(self, motivo: str, codigo_pedido: str | None = None):
+        """
+        Encola un evento de asignación. Se puede llamar desde cualquier hilo.
+        Si la task de asignación corre en este proceso va directo a su cola;
+        si no, se publica con NOTIFY para el despachador líder. Sin ninguna de
+        las dos, el evento se descarta (el barrido periódico lo recogerá).
+        """
+        evento = (motivo, codigo_pedido)
+        if self._encolar(self._loop, self._cola, evento):
+            return
+
+        loop = self._loop_publicacion
+        if loop is None or self._conexion is None or loop.is_closed():
+            return
+        if _loop_actual() is loop:
+            self._publicar(evento)
+        else:
+            loop.call_soon_threadsafe(self._publicar, evento)
+
+    def recibir_notificacion(self, conexion, pid: int, canal: str, payload: str):
+        """Listener de asyncpg: encola el evento publicado por otro proceso"""
+        try:
+            motivo, codigo_pedido = json.loads(payload)
+        except (ValueError, TypeError):
+            motivo, codigo_pedido = payload, None
+        self._encolar(self._loop, self._cola, (motivo, codigo_pedido))
+
+    async def esperar_eventos(self, timeout: float) -> list:
+        """
+        Espera hasta el primer evento (o hasta que venza el timeout) y
+        devuelve también todos los que ya estaban encolados, de modo que
+        una ráfaga de eventos se resuelve con un solo barrido.
+
+        Returns:
+            Lista de tuplas (motivo, codigo_pedido); vacía si venció el timeout
+        """
+        cola = self._cola
+        if cola is None:
+            await asyncio.sleep(timeout)
+            return []
+
+        try:
+            primero = await asyncio.wait_for(cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+
+        eventos = [primero]
+        while not cola.empty():
+            eventos.append(cola.get_nowait())
+        return eventos
+
+    @staticmethod
+    def _encolar(loop, cola, evento: tuple) -> bool:
+        """Pone el evento en la cola local; False si no hay consumidor"""
+        if loop is None or cola is None or loop.is_closed():
+            return False
+        if _loop_actual() is loop:
+            cola.put_nowait(evento)
+        else:
+            loop.call_soon_threadsafe(cola.put_nowait, evento)
+        return True
+
+    def _publicar(self, evento: tuple):
+        """Lanza el NOTIFY en segundo plano (en el loop de publicación)"""
+        envio = asyncio.create_task(self._enviar(evento))
+        self._envios.add(envio)
+        envio.add_done_callback(self._envios.discard)
+
+    async def _enviar(self, evento: tuple):
+        conexion = self._conexion
+        if conexion is None:
+            return
+        try:
+            # Una conexión asyncpg no admite operaciones simultáneas
+            async with self._lock_publicacion:
+                await conexion.execute("SELECT pg_notify($1, $2)", CANAL_ASIGNACION, json.dumps(evento))
+        except Exception as e:
+            print(f"⚠️ No se pudo publicar el evento de asignación {evento[0]}: {e}")
+
+
+def _loop_actual() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+# Instancia única del proceso
+despachador = DespachadorAsignacion()
@@ -0,0 +1,257 @@
+"""
+Bus de eventos de pedidos (outbox transaccional)
+Cada cambio de un pedido agrega una fila a evento_pedido en la misma
+transacción (registrar_evento) y, al hacer commit, Postgres avisa con NOTIFY
+en CANAL_EVENTOS. El relay de cada proceso lee los eventos nuevos por cursor
+(id) y los entrega a los suscriptores del proceso: pushes a los
+conductores, streams SSE, despachador de asignaciones... (ver RelayEventos
+sobre el orden de entrega)
+
+Un evento que no se llega a confirmar nunca se publica; uno confirmado se
+publica aunque se pierda el NOTIFY (lectura de respaldo periódica).
+
+La misma conexión escucha otros canales de NOTIFY del proceso (escuchar()),
+como los cambios del catálogo y de la configuración.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import Session
+from app.config import get_settings
+from app.database import AsyncSessionLocal, conectar_asyncpg
+from app.models import EventoPedido, Pedido
+
+
+# Canal de Postgres (LISTEN/NOTIFY) que despierta a los relays
+CANAL_EVENTOS = "eventos_pedido"
+
+# Eventos leídos por consulta
+EVENTOS_POR_LECTURA = 500
+
+# Lectura de respaldo si no llega ningún NOTIFY
+INTERVALO_RELAY_SEGUNDOS = 5.0
+REINTENTO_RELAY_SEGUNDOS = 2.0
+
+# Los ids (BIGSERIAL) se asignan antes del commit: una transacción más lenta
+# puede confirmar un id menor al cursor. Esos huecos se vuelven a buscar
+# durante este tiempo (después se asume que la transacción se deshizo).
+ESPERA_HUECOS_SEGUNDOS = 30.0
+
+# Cada cuánto se borran los eventos más viejos que eventos_dias_retencion
+INTERVALO_LIMPIEZA_SEGUNDOS = 3600
+
+
+def registrar_evento(db, pedido: Pedido, tipo: str, **datos):
+    """
+    Agrega el evento del pedido a la sesión (sync o async): se guarda con el
+    mismo commit que el cambio de estado y se descarta si se hace rollback.
+    Llamar después de modificar el pedido.
+    """
+    db.add(EventoPedido(
+        codigo_pedido=pedido.codigo_pedido,
+        tipo=tipo,
+        estado=pedido.estado,
+        conductor_codigo=pedido.conductor_codigo,
+        datos=datos or None
+    ))
+
+
+@event.listens_for(Session, "after_flush")
+def _avisar_relays(session, flush_context):
+    """Un NOTIFY por flush con eventos nuevos (Postgres lo entrega al hacer commit)"""
+    if any(isinstance(objeto, EventoPedido) for objeto in session.new):
+        session.connection().execute(select(func.pg_notify(CANAL_EVENTOS, "")))
+
+
+class RelayEventos:
+    """
+    Lee los eventos confirmados en orden de id y los entrega a los
+    suscriptores de este proceso. Empieza por los eventos posteriores al
+    arranque (no reproduce el pasado).
+
+    El orden no está garantizado: un evento que llena un hueco (su
+    transacción confirmó después que otra con id mayor) se entrega cuando
+    aparece, después de los posteriores ya entregados. No se retienen los
+    siguientes hasta que llegue, porque un hueco de una transacción deshecha
+    nunca se llena y demoraría todo ESPERA_HUECOS_SEGUNDOS. Los suscriptores
+    que dependen del orden deben comparar el id del evento (o releer el
+    pedido) en lugar de asumir que el último recibido es el más nuevo.
+    """
+
+    def __init__(self):
+        self._suscriptores: list = []
+        # canal de NOTIFY -> funciones que lo escuchan
+        self._canales: dict[str, list] = {}
+        self._cursor: int | None = None
+        # id faltante -> momento en que se detectó
+        self._huecos: dict[int, float] = {}
+        self._despertar: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self.eventos_entregados = 0
+
+    def suscribir(self, funcion):
+        """
+        funcion(evento: dict) se llama en el event loop del relay, por cada
+        evento y en orden; no debe bloquear
+        """
+        if funcion not in self._suscriptores:
+            self._suscriptores.append(funcion)
+
+    def desuscribir(self, funcion):
+        if funcion in self._suscriptores:
+            self._suscriptores.remove(funcion)
+
+    def escuchar(self, canal: str, funcion):
+        """
+        funcion(payload) se llama en el event loop del relay por cada NOTIFY
+        del canal, y con None al (re)conectar: los NOTIFY de mientras estuvo
+        desconectado se pierden y el suscriptor debe resincronizarse
+        """
+        funciones = self._canales.setdefault(canal, [])
+        if funcion not in funciones:
+            funciones.append(funcion)
+
+    def iniciar(self):
+        """Arranca la task del relay en el event loop actual"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.ejecutar())
+
+    async def detener(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def ejecutar(self):
+        """Bucle del relay: LISTEN y lectura por cursor (se detiene cancelando la task)"""
+        self._despertar = asyncio.Event()
+        while True:
+            conexion = None
+            try:
+                conexion = await conectar_asyncpg()
+                await conexion.add_listener(CANAL_EVENTOS, self._recibir_aviso)
+                for canal in self._canales:
+                    await conexion.add_listener(canal, self._recibir_canal)
+                    self._avisar_canal(canal, None)
+                if self._cursor is None:
+                    self._cursor = await conexion.fetchval("SELECT coalesce(max(id), 0) FROM evento_pedido")
+                while True:
+                    self._despertar.clear()
+                    if await self._leer(conexion) == EVENTOS_POR_LECTURA:
+                        continue
+                    try:
+                        await asyncio.wait_for(self._despertar.wait(), INTERVALO_RELAY_SEGUNDOS)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Relay de eventos de pedidos: {e}")
+            finally:
+                if conexion is not None:
+                    conexion.terminate()
+            await asyncio.sleep(REINTENTO_RELAY_SEGUNDOS)
+
+    def _recibir_aviso(self, conexion, pid: int, canal: str, payload: str):
+        """Listener de asyncpg: hay eventos nuevos confirmados"""
+        if self._despertar is not None:
+            self._despertar.set()
+
+    def _recibir_canal(self, conexion, pid: int, canal: str, payload: str):
+        """Listener de asyncpg de los canales de escuchar()"""
+        self._avisar_canal(canal, payload)
+
+    def _avisar_canal(self, canal: str, payload: str | None):
+        for funcion in self._canales.get(canal, ()):
+            try:
+                funcion(payload)
+            except Exception as e:
+                print(f"❌ Error al avisar NOTIFY de {canal}: {e}")
+
+    async def _leer(self, conexion) -> int:
+        """
+        Entrega los eventos posteriores al cursor y los huecos que hayan
+        aparecido
+
+        Returns:
+            Cantidad de eventos nuevos leídos
+        """
+        ahora = time.monotonic()
+        self._huecos = {
+            id_: visto for id_, visto in self._huecos.items()
+            if ahora - visto < ESPERA_HUECOS_SEGUNDOS
+        }
+
+        filas = await conexion.fetch(
+            """
+            SELECT id, codigo_pedido, tipo, estado, conductor_codigo, datos, creado_en
+            FROM evento_pedido
+            WHERE id > $1 OR id = ANY($2::bigint[])
+            ORDER BY id
+            LIMIT $3
+            """,
+            self._cursor, list(self._huecos), EVENTOS_POR_LECTURA
+        )
+
+        nuevos = 0
+        for fila in filas:
+            if fila["id"] in self._huecos:
+                del self._huecos[fila["id"]]
+            elif fila["id"] > self._cursor:
+                if fila["id"] - self._cursor <= EVENTOS_POR_LECTURA:
+                    for faltante in range(self._cursor + 1, fila["id"]):
+                        self._huecos[faltante] = ahora
+                self._cursor = fila["id"]
+                nuevos += 1
+            else:
+                continue
+            self._entregar({
+                "id": fila["id"],
+                "codigo_pedido": fila["codigo_pedido"],
+                "tipo": fila["tipo"],
+                "estado": fila["estado"],
+                "conductor_codigo": fila["conductor_codigo"],
+                "datos": json.loads(fila["datos"]) if fila["datos"] else {},
+                "creado_en": fila["creado_en"]
+            })
+        return nuevos
+
+    def _entregar(self, evento: dict):
+        for funcion in self._suscriptores:
+            try:
+                funcion(evento)
+            except Exception as e:
+                print(f"❌ Error al entregar evento {evento['tipo']} de {evento['codigo_pedido']}: {e}")
+        self.eventos_entregados += 1
+
+
+async def eliminar_eventos_antiguos(dias: int) -> int:
+    """Borra los eventos con más de `dias` días"""
+    async with AsyncSessionLocal() as db:
+        resultado = await db.execute(
+            delete(EventoPedido).where(EventoPedido.creado_en < datetime.now() - timedelta(days=dias))
+        )
+        await db.commit()
+        return resultado.rowcount
+
+
+async def ejecutar_limpieza(intervalo: float = INTERVALO_LIMPIEZA_SEGUNDOS):
+    """Task de limpieza periódica del outbox (corre en el despachador líder)"""
+    while True:
+        try:
+            borrados = await eliminar_eventos_antiguos(get_settings().eventos_dias_retencion)
+            if borrados:
+                print(f"🧹 {borrados} eventos de pedidos antiguos eliminados")
+        except Exception as e:
+            print(f"❌ Error al limpiar eventos de pedidos: {e}")
+        await asyncio.sleep(intervalo)
+
+
+# Instancia única del proceso
+relay_eventos = RelayEventos()
@@ -0,0 +1,338 @@
+"""
+Servicio de historial de ubicaciones
+Guarda en ubicacion_conductor (particionada por día) cada posición GPS
+recibida, vinculada al pedido en curso del conductor, submuestrea los días
+viejos, borra los que superan la retención y arma el recorrido de un pedido
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from sqlalchemy import DateTime, REAL, String, column, select, text, true, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Pedido, UbicacionConductor
+from app.services.conductor_service import calcular_longitud_recorrido
+
+
+# Estados en los que el conductor está haciendo el recorrido de un pedido
+ESTADOS_EN_RECORRIDO = ("ACEPTADO", "EN_RESTAURANTE", "RECOGIO_PEDIDO", "EN_CAMINO")
+
+# Filas por INSERT (5 parámetros por fila)
+FILAS_POR_INSERT = 2000
+
+# Particiones diarias que se crean por adelantado
+DIAS_PARTICIONES_ADELANTE = 3
+
+# Cada cuánto corre el mantenimiento (particiones, submuestreo, retención)
+INTERVALO_MANTENIMIENTO_SEGUNDOS = 3600
+
+TABLA = UbicacionConductor.__tablename__
+
+# Partición DEFAULT (migrations/002_historial_ubicaciones.sql)
+PARTICION_DEFAULT = f"{TABLA}_default"
+
+
+# ============ ESCRITURA ============
+async def insertar_historial(db: AsyncSession, fixes: list) -> int:
+    """
+    Inserta las posiciones en el historial, con el pedido en curso de cada
+    conductor resuelto en el mismo INSERT ... SELECT (LATERAL sobre pedido).
+    Los repetidos (mismo conductor e instante) se ignoran.
+
+    Args:
+        fixes: Lista de (codigo_conductor, latitud, longitud, timestamp)
+
+    Returns:
+        Cantidad de posiciones insertadas
+    """
+    insertadas = 0
+    for inicio in range(0, len(fixes), FILAS_POR_INSERT):
+        bloque = fixes[inicio:inicio + FILAS_POR_INSERT]
+        fix = values(
+            column("codigo", String),
+            column("latitud", REAL),
+            column("longitud", REAL),
+            column("ts", DateTime),
+            name="fix"
+        ).data([(c, float(lat), float(lng), ts) for c, lat, lng, ts in bloque])
+
+        en_curso = (
+            select(Pedido.codigo_pedido)
+            .where(
+                Pedido.conductor_codigo == fix.c.codigo,
+                Pedido.estado.in_(ESTADOS_EN_RECORRIDO)
+            )
+            .order_by(Pedido.fecha.desc())
+            .limit(1)
+            .lateral("en_curso")
+        )
+        origen = select(
+            fix.c.codigo, en_curso.c.codigo_pedido, fix.c.ts, fix.c.latitud, fix.c.longitud
+        ).select_from(fix.outerjoin(en_curso, true()))
+
+        resultado = await db.execute(
+            insert(UbicacionConductor)
+            .from_select(
+                ["codigo_conductor", "codigo_pedido", "registrado_en", "latitud", "longitud"],
+                origen
+            )
+            .on_conflict_do_nothing()
+        )
+        insertadas += resultado.rowcount
+    await db.commit()
+    return insertadas
+
+
+# ============ MANTENIMIENTO ============
+def nombre_particion(dia: date) -> str:
+    return f"{TABLA}_{dia:%Y%m%d}"
+
+
+async def dias_en_particion_default(db: AsyncSession, desde: date, hasta: date) -> list[date]:
+    """
+    Días en [desde, hasta) con posiciones en la partición por defecto (las
+    que llegaron cuando su partición diaria todavía no existía)
+    """
+    return list((await db.scalars(text(f"""
+        SELECT DISTINCT CAST(registrado_en AS date) FROM {PARTICION_DEFAULT}
+        WHERE registrado_en >= :desde AND registrado_en < :hasta
+        ORDER BY 1
+    """), {"desde": desde, "hasta": hasta})).all())
+
+
+async def _crear_particion(db: AsyncSession, dia: date):
+    """
+    Crea la partición del día. Si la partición por defecto tiene filas de ese
+    día, CREATE ... PARTITION OF fallaría: la tabla se crea suelta, se le
+    pasan esas filas y se adjunta (todo en la misma transacción)
+    """
+    nombre = nombre_particion(dia)
+    rango = f"FROM ('{dia.isoformat()}') TO ('{(dia + timedelta(days=1)).isoformat()}')"
+    en_default = await db.scalar(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {PARTICION_DEFAULT}
+            WHERE registrado_en >= :desde AND registrado_en < :hasta
+        )
+    """), {"desde": dia, "hasta": dia + timedelta(days=1)})
+
+    if not en_default:
+        await db.execute(text(f"CREATE TABLE {nombre} PARTITION OF {TABLA} FOR VALUES {rango}"))
+        return
+
+    await db.execute(text(f"CREATE TABLE {nombre} (LIKE {TABLA} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    movidas = await db.execute(text(f"""
+        WITH movidas AS (
+            DELETE FROM {PARTICION_DEFAULT}
+            WHERE registrado_en >= :desde AND registrado_en < :hasta
+            RETURNING *
+        )
+        INSERT INTO {nombre} SELECT * FROM movidas
+    """), {"desde": dia, "hasta": dia + timedelta(days=1)})
+    await db.execute(text(f"ALTER TABLE {TABLA} ATTACH PARTITION {nombre} FOR VALUES {rango}"))
+    print(f"📥 {movidas.rowcount} posiciones pasadas de {PARTICION_DEFAULT} a {nombre}")
+
+
+async def crear_particiones(db: AsyncSession, dias: list[date]) -> list[str]:
+    """
+    Crea (si faltan) las particiones diarias de los días dados, cada una en
+    su propio savepoint: si una falla, se sigue con las demás
+    """
+    creadas = []
+    for dia in dias:
+        nombre = nombre_particion(dia)
+        existe = await db.scalar(text("SELECT to_regclass(:nombre) IS NOT NULL"), {"nombre": nombre})
+        if existe:
+            continue
+        try:
+            async with db.begin_nested():
+                await _crear_particion(db, dia)
+            await db.commit()
+        except SQLAlchemyError as e:
+            print(f"❌ No se pudo crear la partición {nombre}: {e}")
+            continue
+        creadas.append(nombre)
+    return creadas
+
+
+async def submuestrear_dia(db: AsyncSession, dia: date, segundos: int) -> int:
+    """
+    Deja una posición cada `segundos` por conductor y pedido en la partición
+    del día (la primera de cada intervalo). Repetirlo no borra nada más.
+
+    Returns:
+        Cantidad de posiciones borradas
+    """
+    nombre = nombre_particion(dia)
+    if not await db.scalar(text("SELECT to_regclass(:nombre) IS NOT NULL"), {"nombre": nombre}):
+        return 0
+
+    resultado = await db.execute(text(f"""
+        DELETE FROM {nombre} u
+        USING (
+            SELECT ctid FROM (
+                SELECT ctid, row_number() OVER (
+                    PARTITION BY codigo_conductor, codigo_pedido,
+                                 floor(extract(epoch FROM registrado_en) / CAST(:segundos AS integer))
+                    ORDER BY registrado_en
+                ) AS n
+                FROM {nombre}
+            ) x
+            WHERE x.n > 1
+        ) sobrantes
+        WHERE u.ctid = sobrantes.ctid
+    """), {"segundos": segundos})
+    await db.commit()
+    return resultado.rowcount
+
+
+async def eliminar_particiones_antiguas(db: AsyncSession, antes_de: date) -> list[str]:
+    """Elimina las particiones diarias anteriores a `antes_de`"""
+    particiones = (await db.scalars(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :tabla
+    """), {"tabla": TABLA})).all()
+
+    eliminadas = []
+    for nombre in particiones:
+        try:
+            dia = datetime.strptime(nombre.removeprefix(f"{TABLA}_"), "%Y%m%d").date()
+        except ValueError:
+            continue  # partición por defecto u otra que no es diaria
+        if dia < antes_de:
+            try:
+                async with db.begin_nested():
+                    await db.execute(text(f"DROP TABLE {nombre}"))
+                await db.commit()
+            except SQLAlchemyError as e:
+                print(f"❌ No se pudo eliminar la partición {nombre}: {e}")
+                continue
+            eliminadas.append(nombre)
+    return eliminadas
+
+
+async def podar_particion_default(db: AsyncSession, antes_de: date) -> int:
+    """
+    Borra de la partición por defecto las posiciones anteriores a `antes_de`
+    (la retención por DROP de particiones diarias no las alcanza)
+    """
+    resultado = await db.execute(
+        text(f"DELETE FROM {PARTICION_DEFAULT} WHERE registrado_en < :antes_de"),
+        {"antes_de": antes_de}
+    )
+    await db.commit()
+    return resultado.rowcount
+
+
+async def mantener_historial():
+    """
+    Un ciclo de mantenimiento: particiones de los próximos días, submuestreo
+    de los días que dejaron de ser recientes y retención
+    """
+    settings = get_settings()
+    hoy = date.today()
+    antes_de = hoy - timedelta(days=settings.historial_dias_retencion)
+
+    async with AsyncSessionLocal() as db:
+        # Los días que quedaron en la partición por defecto (el mantenimiento
+        # no corrió a tiempo) reciben su partición como los próximos días
+        proximos = [hoy + timedelta(days=i) for i in range(DIAS_PARTICIONES_ADELANTE)]
+        atrasados = await dias_en_particion_default(db, antes_de, proximos[-1] + timedelta(days=1))
+        creadas = await crear_particiones(db, sorted(set(atrasados) | set(proximos)))
+        if creadas:
+            print(f"🗂️ Particiones de historial creadas: {', '.join(creadas)}")
+
+        # Se revisan algunos días hacia atrás por si un ciclo no corrió
+        borradas = 0
+        ultimo_completo = hoy - timedelta(days=settings.historial_dias_completo)
+        for i in range(1, 4):
+            borradas += await submuestrear_dia(
+                db, ultimo_completo - timedelta(days=i), settings.historial_segundos_muestreo
+            )
+        if borradas:
+            print(f"🗜️ Historial submuestreado: {borradas} posiciones borradas")
+
+        eliminadas = await eliminar_particiones_antiguas(db, antes_de)
+        if eliminadas:
+            print(f"🧹 Particiones de historial eliminadas: {', '.join(eliminadas)}")
+        podadas = await podar_particion_default(db, antes_de)
+        if podadas:
+            print(f"🧹 {podadas} posiciones antiguas eliminadas de {PARTICION_DEFAULT}")
+
+
+async def ejecutar_mantenimiento(intervalo: float = INTERVALO_MANTENIMIENTO_SEGUNDOS):
+    """Task de mantenimiento periódico (corre en el despachador líder)"""
+    while True:
+        try:
+            await mantener_historial()
+        except Exception as e:
+            print(f"❌ Error en mantenimiento del historial de ubicaciones: {e}")
+        await asyncio.sleep(intervalo)
+
+
+# ============ CONSULTA ============
+def codificar_polyline(puntos: list, precision: int = 5) -> str:
+    """
+    Codifica una lista de (latitud, longitud) con el algoritmo de polylines
+    de Google (deltas enteros en base 64, ~1 m de precisión con 5 decimales)
+    """
+    factor = 10 ** precision
+    salida = []
+    lat_previa = lng_previa = 0
+    for latitud, longitud in puntos:
+        lat_entera = round(latitud * factor)
+        lng_entera = round(longitud * factor)
+        for delta in (lat_entera - lat_previa, lng_entera - lng_previa):
+            valor = ~(delta << 1) if delta < 0 else delta << 1
+            while valor >= 0x20:
+                salida.append(chr((0x20 | (valor & 0x1F)) + 63))
+                valor >>= 5
+            salida.append(chr(valor + 63))
+        lat_previa, lng_previa = lat_entera, lng_entera
+    return "".join(salida)
+
+
+async def obtener_recorrido(db: AsyncSession, pedido: Pedido) -> dict:
+    """
+    Recorrido del conductor durante el pedido
+
+    Returns:
+        Dict con la polyline codificada, cantidad de puntos, inicio/fin,
+        distancia recorrida y duración
+    """
+    filtros = [UbicacionConductor.codigo_pedido == pedido.codigo_pedido]
+    if pedido.fecha is not None:
+        # Acota las particiones a leer
+        filtros.append(UbicacionConductor.registrado_en >= pedido.fecha)
+
+    filas = (await db.execute(
+        select(
+            UbicacionConductor.latitud,
+            UbicacionConductor.longitud,
+            UbicacionConductor.registrado_en
+        )
+        .where(*filtros)
+        .order_by(UbicacionConductor.registrado_en)
+    )).all()
+
+    if not filas:
+        return {"codigo_pedido": pedido.codigo_pedido, "puntos": 0, "polyline": ""}
+
+    latitudes = [f.latitud for f in filas]
+    longitudes = [f.longitud for f in filas]
+
+    inicio, fin = filas[0].registrado_en, filas[-1].registrado_en
+    return {
+        "codigo_pedido": pedido.codigo_pedido,
+        "conductor": pedido.conductor_codigo,
+        "puntos": len(filas),
+        "polyline": codificar_polyline(zip(latitudes, longitudes)),
+        "inicio": inicio,
+        "fin": fin,
+        "duracion_min": round((fin - inicio).total_seconds() / 60, 1),
+        "distancia_km": round(calcular_longitud_recorrido(latitudes, longitudes), 2)
+    }
@@ -0,0 +1,321 @@
+"""
+Índice espacial en memoria de los conductores
+Grilla uniforme (celdas de CELDA_GRADOS x CELDA_GRADOS) con la posición y
+disponibilidad de cada conductor, para responder "k más cercanos" y
+"dentro de un radio" sin leer toda la tabla conductor en cada consulta
+
+Los cambios de disponibilidad hechos en otros procesos (bot, despachador,
+otros workers) llegan por los eventos de pedidos del relay; los que no
+generan evento (PUT /conductores/{codigo}/disponibilidad en otro worker) se
+corrigen con la recarga periódica.
+"""
+import asyncio
+import math
+import threading
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.models import Conductor
+from app.services.eventos_pedido import relay_eventos
+
+
+# ~1.1 km de lado en latitud
+CELDA_GRADOS = 0.01
+
+# Kilómetros por grado de latitud (radio medio de la Tierra)
+KM_POR_GRADO = 111.195
+
+# Recarga completa desde la BD (respaldo de los eventos)
+INTERVALO_RECARGA_SEGUNDOS = 300
+
+
+def _distancias(latitudes: list, longitudes: list, lat: float, lng: float) -> np.ndarray:
+    """Distancias (km) de los candidatos al punto de consulta"""
+    from app.services.conductor_service import calcular_distancias_haversine
+    return calcular_distancias_haversine(latitudes, longitudes, lat, lng)
+
+
+class IndiceConductores:
+    """
+    Índice espacial de conductores, local al proceso.
+    Solo los conductores disponibles y con ubicación entran en la grilla;
+    el resto se guarda igual para poder reactivarlos sin ir a la BD.
+    Es seguro usarlo desde el event loop y desde el threadpool de FastAPI.
+    """
+
+    def __init__(self, celda_grados: float = CELDA_GRADOS):
+        self._celda_grados = celda_grados
+        self._lock = threading.RLock()
+        self._conductores: dict[str, dict] = {}
+        self._celdas: dict[tuple[int, int], set[str]] = {}
+        self._celda_de: dict[str, tuple[int, int]] = {}
+        # Extensión de las celdas ocupadas (solo crece; se reinicia al cargar)
+        self._extension: list[int] | None = None
+        # codigo -> id del último evento de pedidos aplicado (los eventos
+        # pueden llegar fuera de orden, ver RelayEventos)
+        self._ultimo_evento: dict[str, int] = {}
+        self.cargado = False
+
+    # ============ ACTUALIZACIÓN ============
+    def cargar(self, conductores: list):
+        """Reemplaza todo el contenido del índice con los conductores dados"""
+        with self._lock:
+            self._conductores.clear()
+            self._celdas.clear()
+            self._celda_de.clear()
+            self._extension = None
+            for conductor in conductores:
+                self.registrar(conductor)
+            self.cargado = True
+
+    def registrar(self, conductor: Conductor):
+        """Agrega o actualiza un conductor a partir de su fila de BD"""
+        with self._lock:
+            self._conductores[conductor.codigo_conductor] = {
+                "codigo_conductor": conductor.codigo_conductor,
+                "nombre": conductor.nombre,
+                "telefono": conductor.telefono,
+                "tipo_vehiculo": conductor.tipo_vehiculo,
+                "vehiculo": conductor.vehiculo,
+                "latitud": float(conductor.latitud) if conductor.latitud is not None else None,
+                "longitud": float(conductor.longitud) if conductor.longitud is not None else None,
+                "disponible": bool(conductor.is_disponible)
+            }
+            self._indexar(conductor.codigo_conductor)
+
+    def actualizar_ubicacion(self, codigo_conductor: str, latitud: float, longitud: float) -> bool:
+        """
+        Mueve al conductor a su nueva posición
+
+        Returns:
+            False si el conductor no está en el índice
+        """
+        with self._lock:
+            datos = self._conductores.get(codigo_conductor)
+            if datos is None:
+                return False
+            datos["latitud"] = float(latitud)
+            datos["longitud"] = float(longitud)
+            self._indexar(codigo_conductor)
+            return True
+
+    def actualizar_disponibilidad(self, codigo_conductor: str, disponible: bool) -> bool:
+        """
+        Marca al conductor como disponible / no disponible
+
+        Returns:
+            False si el conductor no está en el índice
+        """
+        with self._lock:
+            datos = self._conductores.get(codigo_conductor)
+            if datos is None:
+                return False
+            datos["disponible"] = bool(disponible)
+            self._indexar(codigo_conductor)
+            return True
+
+    def recibir_evento(self, evento: dict):
+        """
+        Suscriptor del relay: aplica los cambios de disponibilidad que
+        acompañan a cada evento (asignado ocupa al conductor; liberado,
+        rechazado y la entrega lo dejan libre)
+        """
+        tipo = evento["tipo"]
+        if tipo == "asignado":
+            codigo, disponible = evento["conductor_codigo"], False
+        elif tipo in ("liberado", "rechazado"):
+            codigo, disponible = evento["datos"].get("conductor_anterior"), True
+        elif (tipo == "estado" and evento["estado"] == "ENTREGADO"
+              and evento["datos"].get("origen") == "conductor"):
+            codigo, disponible = evento["conductor_codigo"], True
+        else:
+            return
+        if not codigo:
+            return
+        with self._lock:
+            # Un evento atrasado no pisa el estado que dejó uno posterior
+            if evento["id"] < self._ultimo_evento.get(codigo, 0):
+                return
+            self._ultimo_evento[codigo] = evento["id"]
+            self.actualizar_disponibilidad(codigo, disponible)
+
+    def _indexar(self, codigo_conductor: str):
+        """Recoloca al conductor en la grilla (requiere tener el lock)"""
+        anterior = self._celda_de.pop(codigo_conductor, None)
+        if anterior is not None:
+            celda = self._celdas[anterior]
+            celda.discard(codigo_conductor)
+            if not celda:
+                del self._celdas[anterior]
+
+        datos = self._conductores[codigo_conductor]
+        if not datos["disponible"] or datos["latitud"] is None or datos["longitud"] is None:
+            return
+
+        clave = self._clave_celda(datos["latitud"], datos["longitud"])
+        self._celdas.setdefault(clave, set()).add(codigo_conductor)
+        self._celda_de[codigo_conductor] = clave
+
+        if self._extension is None:
+            self._extension = [clave[0], clave[0], clave[1], clave[1]]
+        else:
+            ext = self._extension
+            ext[0] = min(ext[0], clave[0])
+            ext[1] = max(ext[1], clave[0])
+            ext[2] = min(ext[2], clave[1])
+            ext[3] = max(ext[3], clave[1])
+
+    # ============ CONSULTAS ============
+    def obtener(self, codigo_conductor: str) -> dict | None:
+        """Copia de los datos del conductor, o None si no está en el índice"""
+        with self._lock:
+            datos = self._conductores.get(codigo_conductor)
+            return dict(datos) if datos else None
+
+    def total_disponibles(self) -> int:
+        """Cantidad de conductores disponibles con ubicación"""
+        with self._lock:
+            return len(self._celda_de)
+
+    def k_mas_cercanos(self, latitud: float, longitud: float, k: int) -> list:
+        """
+        Los k conductores disponibles más cercanos al punto.
+        Recorre la grilla en anillos crecientes y se detiene cuando ninguna
+        celda sin visitar puede contener a alguien más cerca que el k-ésimo.
+
+        Returns:
+            Lista de dicts (datos del conductor + distancia_km) de menor a mayor
+        """
+        if k <= 0:
+            return []
+
+        with self._lock:
+            if not self._celda_de:
+                return []
+
+            ci, cj = self._clave_celda(latitud, longitud)
+            min_i, max_i, min_j, max_j = self._extension
+            radio_max = max(ci - min_i, max_i - ci, cj - min_j, max_j - cj, 0)
+
+            candidatos = []
+            r = 0
+            while True:
+                for clave in self._anillo(ci, cj, r):
+                    candidatos.extend(self._celdas.get(clave, ()))
+
+                if len(candidatos) >= k or r >= radio_max:
+                    distancias = self._distancias_candidatos(candidatos, latitud, longitud)
+                    if r >= radio_max:
+                        break
+                    # Cota inferior de la distancia a cualquier celda fuera del anillo r
+                    k_esima = np.partition(distancias, k - 1)[k - 1]
+                    if k_esima <= self._cota_inferior_km(latitud, r):
+                        break
+                r += 1
+
+            return self._resultado(candidatos, distancias, limite=k)
+
+    def dentro_de_radio(self, latitud: float, longitud: float, radio_km: float) -> list:
+        """
+        Conductores disponibles a menos de radio_km del punto
+
+        Returns:
+            Lista de dicts (datos del conductor + distancia_km) de menor a mayor
+        """
+        with self._lock:
+            if not self._celda_de:
+                return []
+
+            dlat = radio_km / KM_POR_GRADO
+            dlng = radio_km / (KM_POR_GRADO * max(math.cos(math.radians(latitud)), 1e-6))
+            i0, j0 = self._clave_celda(latitud - dlat, longitud - dlng)
+            i1, j1 = self._clave_celda(latitud + dlat, longitud + dlng)
+
+            candidatos = []
+            if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(self._celdas):
+                for i in range(i0, i1 + 1):
+                    for j in range(j0, j1 + 1):
+                        candidatos.extend(self._celdas.get((i, j), ()))
+            else:
+                # Radio grande: es más barato recorrer solo las celdas ocupadas
+                for (i, j), codigos in self._celdas.items():
+                    if i0 <= i <= i1 and j0 <= j <= j1:
+                        candidatos.extend(codigos)
+
+            distancias = self._distancias_candidatos(candidatos, latitud, longitud)
+            dentro = distancias <= radio_km
+            candidatos = [c for c, ok in zip(candidatos, dentro) if ok]
+            return self._resultado(candidatos, distancias[dentro])
+
+    def todos_ordenados(self, latitud: float, longitud: float) -> list:
+        """Todos los conductores disponibles ordenados por distancia al punto"""
+        with self._lock:
+            candidatos = list(self._celda_de)
+            distancias = self._distancias_candidatos(candidatos, latitud, longitud)
+            return self._resultado(candidatos, distancias)
+
+    # ============ AUXILIARES ============
+    def _clave_celda(self, latitud: float, longitud: float) -> tuple[int, int]:
+        return math.floor(latitud / self._celda_grados), math.floor(longitud / self._celda_grados)
+
+    @staticmethod
+    def _anillo(ci: int, cj: int, r: int):
+        """Celdas a distancia de Chebyshev exactamente r de (ci, cj)"""
+        if r == 0:
+            yield (ci, cj)
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def _cota_inferior_km(self, latitud: float, r: int) -> float:
+        """Distancia mínima posible a un punto fuera del anillo r"""
+        lat_extrema = min(abs(latitud) + (r + 1) * self._celda_grados, 89.9)
+        return r * self._celda_grados * KM_POR_GRADO * math.cos(math.radians(lat_extrema))
+
+    def _distancias_candidatos(self, candidatos: list, latitud: float, longitud: float) -> np.ndarray:
+        if not candidatos:
+            return np.empty(0)
+        latitudes = [self._conductores[c]["latitud"] for c in candidatos]
+        longitudes = [self._conductores[c]["longitud"] for c in candidatos]
+        return _distancias(latitudes, longitudes, latitud, longitud)
+
+    def _resultado(self, candidatos: list, distancias: np.ndarray, limite: int | None = None) -> list:
+        orden = np.argsort(distancias, kind="stable")
+        if limite is not None:
+            orden = orden[:limite]
+
+        resultado = []
+        for i in orden:
+            datos = dict(self._conductores[candidatos[i]])
+            datos.pop("disponible")
+            datos["distancia_km"] = round(float(distancias[i]), 2)
+            resultado.append(datos)
+        return resultado
+
+
+async def cargar_indice_desde_bd(db: AsyncSession):
+    """Carga en el índice todos los conductores de la BD"""
+    conductores = (await db.scalars(select(Conductor))).all()
+    indice_conductores.cargar(conductores)
+    print(f"🗺️ Índice de conductores cargado: {indice_conductores.total_disponibles()} disponibles")
+
+
+async def ejecutar_recarga(intervalo: float = INTERVALO_RECARGA_SEGUNDOS):
+    """Task que vuelve a cargar el índice cada `intervalo` segundos"""
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            async with AsyncSessionLocal() as db:
+                await cargar_indice_desde_bd(db)
+        except Exception as e:
+            print(f"❌ Error al recargar el índice de conductores: {e}")
+
+
+# Instancia única del proceso
+indice_conductores = IndiceConductores()
+relay_eventos.suscribir(indice_conductores.recibir_evento)
@@ -0,0 +1,355 @@
+"""
+Servicio de ubicaciones de conductores
+Aplica en bloque las posiciones GPS reportadas por las apps de conductores y
+mantiene el almacén write-behind de la última posición de cada conductor
+"""
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, Numeric, String, column, event, or_, select, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+from app.database import AsyncSessionLocal
+from app.models import Conductor
+from app.services.indice_conductores import indice_conductores
+from app.services.historial_service import insertar_historial
+from app.services.canales_pedidos import canales_pedidos
+
+
+# Filas por sentencia UPDATE (4 parámetros por fila; Postgres admite 32767)
+FILAS_POR_UPDATE = 2000
+
+# Tope de posiciones pendientes de pasar al historial (si la BD no responde,
+# se descartan las más viejas en lugar de crecer sin límite)
+MAX_HISTORIAL_PENDIENTE = 200_000
+
+# Adelanto máximo aceptado del reloj del teléfono; un fix más en el futuro se
+# rechaza (dejaría fija ultima_actualizacion y descartaría los fixes reales)
+TOLERANCIA_FUTURO_SEGUNDOS = 30
+
+
+def _hora_local(timestamp: datetime) -> datetime:
+    """ultima_actualizacion es TIMESTAMP sin zona, en hora local del servidor"""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone().replace(tzinfo=None)
+
+
+def es_futuro(timestamp: datetime) -> bool:
+    """True si el timestamp (hora local) supera el ahora más la tolerancia"""
+    return timestamp > datetime.now() + timedelta(seconds=TOLERANCIA_FUTURO_SEGUNDOS)
+
+
+def separar_futuros(fixes: list) -> tuple[list, dict]:
+    """
+    Aparta los fixes con timestamp en el futuro
+
+    Returns:
+        (fixes válidos, dict codigo_conductor -> timestamp local rechazado más nuevo)
+    """
+    validos = []
+    futuros = {}
+    for fix in fixes:
+        timestamp = _hora_local(fix.timestamp)
+        if not es_futuro(timestamp):
+            validos.append(fix)
+        elif timestamp > futuros.get(fix.codigo_conductor, timestamp.min):
+            futuros[fix.codigo_conductor] = timestamp
+    return validos, futuros
+
+
+def deduplicar_ubicaciones(fixes: list) -> dict:
+    """
+    Se queda con el fix más reciente de cada conductor
+
+    Args:
+        fixes: Objetos con codigo_conductor, latitud, longitud y timestamp
+
+    Returns:
+        Dict codigo_conductor -> (latitud, longitud, timestamp local)
+    """
+    ultimos = {}
+    for fix in fixes:
+        timestamp = _hora_local(fix.timestamp)
+        actual = ultimos.get(fix.codigo_conductor)
+        if actual is None or timestamp > actual[2]:
+            ultimos[fix.codigo_conductor] = (fix.latitud, fix.longitud, timestamp)
+    return ultimos
+
+
+def leer_frame_ubicaciones(texto: str) -> list[tuple]:
+    """
+    Interpreta un frame de ubicación del stream WebSocket del conductor.
+    Formatos aceptados (ts en milisegundos epoch, opcional):
+        [lat, lng] | [lat, lng, ts] | [[lat, lng, ts], ...] | {"lat": .., "lng": .., "ts": ..}
+
+    Returns:
+        Lista de (latitud, longitud, timestamp | None)
+
+    Raises:
+        ValueError: Si el frame no es válido
+    """
+    datos = json.loads(texto)
+    if isinstance(datos, dict):
+        datos = [datos.get("lat"), datos.get("lng"), datos.get("ts")]
+    if not isinstance(datos, list) or not datos:
+        raise ValueError("Frame vacío o con formato desconocido")
+
+    fixes = datos if isinstance(datos[0], list) else [datos]
+    resultado = []
+    for fix in fixes:
+        if not isinstance(fix, list) or len(fix) not in (2, 3):
+            raise ValueError("Cada fix debe ser [lat, lng] o [lat, lng, ts]")
+        latitud, longitud = float(fix[0]), float(fix[1])
+        if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+            raise ValueError("Coordenadas fuera de rango")
+        timestamp = None
+        if len(fix) == 3 and fix[2] is not None:
+            try:
+                timestamp = datetime.fromtimestamp(float(fix[2]) / 1000)
+            except (OSError, OverflowError):
+                # Fuera del rango de la plataforma (1e20) o infinito (1e400)
+                raise ValueError("Timestamp fuera de rango")
+            if es_futuro(timestamp):
+                raise ValueError("Timestamp en el futuro: revisa el reloj del dispositivo")
+        resultado.append((latitud, longitud, timestamp))
+    return resultado
+
+
+async def aplicar_ubicaciones(
+    db: AsyncSession,
+    ultimos: dict,
+    actualizar_indice: bool = True
+) -> tuple[dict, set]:
+    """
+    Escribe las posiciones con un UPDATE ... FROM (VALUES ...) por bloque.
+    Solo se aplican las que son más nuevas que ultima_actualizacion, así un
+    fix que llega tarde (o repetido) no pisa una posición más reciente.
+
+    Args:
+        ultimos: Dict codigo_conductor -> (latitud, longitud, timestamp)
+        actualizar_indice: Mover también a los conductores en el índice
+            espacial (el almacén write-behind ya lo hizo al recibir el fix)
+
+    Returns:
+        (filas aplicadas por código, códigos que no existen en la BD)
+    """
+    aplicadas = {}
+    codigos = list(ultimos)
+
+    for inicio in range(0, len(codigos), FILAS_POR_UPDATE):
+        bloque = codigos[inicio:inicio + FILAS_POR_UPDATE]
+        fixes = values(
+            column("codigo", String),
+            column("latitud", Numeric(12, 8)),
+            column("longitud", Numeric(12, 8)),
+            column("ts", DateTime),
+            name="fix"
+        ).data([(codigo, *ultimos[codigo]) for codigo in bloque])
+
+        resultado = await db.execute(
+            update(Conductor)
+            .where(
+                Conductor.codigo_conductor == fixes.c.codigo,
+                or_(
+                    Conductor.ultima_actualizacion.is_(None),
+                    Conductor.ultima_actualizacion < fixes.c.ts
+                )
+            )
+            .values(
+                latitud=fixes.c.latitud,
+                longitud=fixes.c.longitud,
+                ultima_actualizacion=fixes.c.ts
+            )
+            .returning(
+                Conductor.codigo_conductor,
+                Conductor.nombre,
+                Conductor.telefono,
+                Conductor.tipo_vehiculo,
+                Conductor.vehiculo,
+                Conductor.latitud,
+                Conductor.longitud,
+                Conductor.is_disponible
+            )
+            .execution_options(synchronize_session=False)
+        )
+        for fila in resultado:
+            aplicadas[fila.codigo_conductor] = fila
+
+    # Los que no se aplicaron: obsoletos o inexistentes (solo se consulta si hay alguno)
+    no_aplicados = [codigo for codigo in codigos if codigo not in aplicadas]
+    no_encontrados = set()
+    if no_aplicados:
+        existentes = set((await db.scalars(
+            select(Conductor.codigo_conductor).where(Conductor.codigo_conductor.in_(no_aplicados))
+        )).all())
+        no_encontrados = set(no_aplicados) - existentes
+
+    await db.commit()
+
+    if actualizar_indice:
+        for codigo, fila in aplicadas.items():
+            almacen_posiciones.conocer(codigo, fila.latitud, fila.longitud, ultimos[codigo][2])
+            if not indice_conductores.actualizar_ubicacion(codigo, fila.latitud, fila.longitud):
+                indice_conductores.registrar(fila)
+
+    return aplicadas, no_encontrados
+
+
+class AlmacenPosiciones:
+    """
+    Última posición de cada conductor, en memoria y con escritura diferida.
+    registrar() deja el fix visible al instante (índice espacial y lecturas
+    de Conductor en este proceso) y lo marca pendiente; vaciar() persiste
+    los pendientes de todos los conductores en un solo UPDATE. Lo que se
+    pierde ante una caída es como máximo un intervalo de vaciado.
+
+    Es local al proceso: con varios workers, los demás ven la posición
+    cuando se vacía a la BD.
+
+    Además acumula todos los fixes recibidos (no solo el último) para el
+    historial de ubicaciones, que se inserta en el mismo vaciado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # codigo -> (latitud, longitud, timestamp)
+        self._ultimas: dict[str, tuple] = {}
+        self._pendientes: dict[str, tuple] = {}
+        # (codigo, latitud, longitud, timestamp) para el historial
+        self._historial: list[tuple] = []
+        self.fixes_recibidos = 0
+        self.filas_escritas = 0
+        self.historial_descartado = 0
+
+    def registrar(self, codigo_conductor: str, latitud, longitud, timestamp: datetime | None = None) -> bool:
+        """
+        Guarda un fix y lo deja pendiente de escribir.
+
+        Returns:
+            False si ya había una posición más nueva (el fix se descarta)
+        """
+        timestamp = _hora_local(timestamp) if timestamp else datetime.now()
+        fix = (latitud, longitud, timestamp)
+        with self._lock:
+            # Al historial va aunque llegue tarde: sigue siendo un punto del recorrido
+            self._agregar_historial((codigo_conductor, latitud, longitud, timestamp))
+            actual = self._ultimas.get(codigo_conductor)
+            if actual is not None and actual[2] >= timestamp:
+                return False
+            self._ultimas[codigo_conductor] = fix
+            self._pendientes[codigo_conductor] = fix
+            self.fixes_recibidos += 1
+
+        indice_conductores.actualizar_ubicacion(codigo_conductor, latitud, longitud)
+        canales_pedidos.posicion_conductor(codigo_conductor, latitud, longitud, timestamp)
+        return True
+
+    def conocer(self, codigo_conductor: str, latitud, longitud, timestamp: datetime):
+        """Recuerda una posición que ya está en la BD (no queda pendiente)"""
+        with self._lock:
+            actual = self._ultimas.get(codigo_conductor)
+            if actual is None or actual[2] < timestamp:
+                self._ultimas[codigo_conductor] = (latitud, longitud, timestamp)
+
+    def agregar_historial(self, codigo_conductor: str, latitud, longitud, timestamp: datetime):
+        """Agrega un fix solo al historial (p. ej. los del endpoint en lote)"""
+        with self._lock:
+            self._agregar_historial((codigo_conductor, latitud, longitud, _hora_local(timestamp)))
+
+    def _agregar_historial(self, fix: tuple):
+        """Requiere tener el lock"""
+        self._historial.append(fix)
+        if len(self._historial) > MAX_HISTORIAL_PENDIENTE:
+            sobrantes = len(self._historial) - MAX_HISTORIAL_PENDIENTE
+            del self._historial[:sobrantes]
+            self.historial_descartado += sobrantes
+
+    def obtener(self, codigo_conductor: str) -> tuple | None:
+        """(latitud, longitud, timestamp) más reciente conocida, o None"""
+        return self._ultimas.get(codigo_conductor)
+
+    @property
+    def pendientes(self) -> int:
+        return len(self._pendientes)
+
+    async def vaciar(self) -> int:
+        """
+        Escribe los fixes pendientes en la tabla conductor (un UPDATE por
+        bloque de FILAS_POR_UPDATE) y los acumulados en el historial.
+        Si falla, los vuelve a dejar pendientes.
+
+        Returns:
+            Cantidad de conductores escritos
+        """
+        with self._lock:
+            lote, self._pendientes = self._pendientes, {}
+            historial, self._historial = self._historial, []
+        if not lote and not historial:
+            return 0
+
+        aplicadas = {}
+        try:
+            async with AsyncSessionLocal() as db:
+                if lote:
+                    aplicadas, _ = await aplicar_ubicaciones(db, lote, actualizar_indice=False)
+                    lote = {}
+                if historial:
+                    await insertar_historial(db, historial)
+        except Exception:
+            with self._lock:
+                for codigo, fix in lote.items():
+                    pendiente = self._pendientes.get(codigo)
+                    if pendiente is None or pendiente[2] < fix[2]:
+                        self._pendientes[codigo] = fix
+                historial.extend(self._historial)
+                self._historial = []
+                for fix in historial:
+                    self._agregar_historial(fix)
+            raise
+
+        self.filas_escritas += len(aplicadas)
+        return len(aplicadas)
+
+    async def ejecutar_vaciado(self, intervalo: float):
+        """
+        Task de vaciado periódico; al cancelarla hace un último vaciado
+        para no perder los fixes recibidos antes del apagado.
+        """
+        try:
+            while True:
+                await asyncio.sleep(intervalo)
+                try:
+                    await self.vaciar()
+                except Exception as e:
+                    print(f"❌ Error al guardar posiciones de conductores: {e}")
+        finally:
+            try:
+                escritas = await self.vaciar()
+                if escritas:
+                    print(f"💾 {escritas} posiciones de conductores guardadas al apagar")
+            except Exception as e:
+                print(f"❌ No se pudieron guardar las posiciones pendientes: {e}")
+
+
+# Instancia única del proceso
+almacen_posiciones = AlmacenPosiciones()
+
+
+@event.listens_for(Conductor, "load")
+@event.listens_for(Conductor, "refresh")
+def _superponer_posicion(conductor: Conductor, *args):
+    """
+    Todo Conductor leído de la BD en este proceso muestra la última posición
+    del almacén si es más nueva que la guardada (sin marcarlo como modificado)
+    """
+    fix = almacen_posiciones.obtener(conductor.codigo_conductor)
+    if fix is None:
+        return
+    guardada = conductor.__dict__.get("ultima_actualizacion")
+    if guardada is not None and guardada >= fix[2]:
+        return
+    set_committed_value(conductor, "latitud", fix[0])
+    set_committed_value(conductor, "longitud", fix[1])
+    set_committed_value(conductor, "ultima_actualizacion", fix[2])
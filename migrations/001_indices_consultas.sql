@@ -0,0 +1,49 @@
+-- Índices de las consultas calientes de pedido y conductor
+-- (declarados también en app/models.py, __table_args__)
+--
+-- CREATE INDEX CONCURRENTLY no bloquea escrituras pero no puede correr dentro
+-- de una transacción: ejecutar con psql sin BEGIN/COMMIT, por ejemplo
+--     psql "$DATABASE_URL" -f migrations/001_indices_consultas.sql
+
+-- ============ CONDUCTOR ============
+
+-- Prefiltro por caja lat/lng de los conductores disponibles (asignación)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_conductor_disponible_coordenadas
+    ON conductor (latitud, longitud)
+    WHERE is_disponible AND latitud IS NOT NULL AND longitud IS NOT NULL;
+
+-- GET /conductores/disponibles
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_conductor_disponible
+    ON conductor (codigo_conductor)
+    WHERE is_disponible;
+
+-- ============ PEDIDO ============
+
+-- Cola de asignación: SOLICITADO sin conductor, por antigüedad
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pedido_pendiente_asignacion_fecha
+    ON pedido (fecha)
+    WHERE estado = 'SOLICITADO' AND conductor_codigo IS NULL;
+
+-- Pedidos de un cliente, los más recientes primero (/mispedidos)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pedido_cliente_fecha
+    ON pedido (cliente_telefono, fecha DESC);
+
+-- Pedidos activos de un conductor (GET /conductores/{codigo}/pedidos y
+-- /pendientes, pedido en curso de cada fix GPS). Solo tiene los pedidos
+-- activos: estas consultas no recorren el historial del conductor
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pedido_conductor_activo_fecha
+    ON pedido (conductor_codigo, fecha DESC)
+    WHERE estado NOT IN ('ENTREGADO', 'CANCELADO');
+
+-- Historial completo de un conductor (GET /conductores/{codigo}/historial) y
+-- la FK pedido.conductor_codigo (borrar un conductor). Comparte columnas con
+-- el anterior, pero el parcial no tiene los pedidos entregados/cancelados
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pedido_conductor_fecha
+    ON pedido (conductor_codigo, fecha DESC);
+
+-- GET /pedidos/estado/{estado}
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pedido_estado_fecha
+    ON pedido (estado, fecha);
+
+ANALYZE conductor;
+ANALYZE pedido;
@@ -0,0 +1,41 @@
+-- Historial de ubicaciones de conductores (modelo UbicacionConductor)
+--
+-- Tabla particionada por día sobre registrado_en. Las particiones diarias las
+-- crea por adelantado el mantenimiento del despachador líder
+-- (app/services/historial_service.py), que además submuestrea los días viejos
+-- y elimina los que superan la retención. Aquí se crean la tabla, la
+-- partición por defecto y las de hoy y los próximos días.
+--
+--     psql "$DATABASE_URL" -f migrations/002_historial_ubicaciones.sql
+
+CREATE TABLE IF NOT EXISTS ubicacion_conductor (
+    codigo_conductor VARCHAR(100) NOT NULL,
+    codigo_pedido VARCHAR(50),
+    registrado_en TIMESTAMP NOT NULL,
+    latitud REAL NOT NULL,
+    longitud REAL NOT NULL,
+    PRIMARY KEY (codigo_conductor, registrado_en)
+) PARTITION BY RANGE (registrado_en);
+
+-- Recorrido de un pedido (GET /pedidos/{codigo}/recorrido)
+CREATE INDEX IF NOT EXISTS ix_ubicacion_conductor_pedido
+    ON ubicacion_conductor (codigo_pedido, registrado_en)
+    WHERE codigo_pedido IS NOT NULL;
+
+-- Red de seguridad: posiciones fuera de las particiones diarias existentes.
+-- El mantenimiento crea después la partición de esos días y les pasa las filas
+CREATE TABLE IF NOT EXISTS ubicacion_conductor_default
+    PARTITION OF ubicacion_conductor DEFAULT;
+
+DO $$
+DECLARE
+    dia DATE;
+BEGIN
+    FOR i IN 0..2 LOOP
+        dia := current_date + i;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF ubicacion_conductor FOR VALUES FROM (%L) TO (%L)',
+            'ubicacion_conductor_' || to_char(dia, 'YYYYMMDD'), dia, dia + 1
+        );
+    END LOOP;
+END $$;
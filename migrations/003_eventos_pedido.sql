@@ -0,0 +1,21 @@
+-- Outbox de eventos de pedidos (modelo EventoPedido)
+--
+-- Cada cambio de estado de un pedido inserta una fila en la misma
+-- transacción; el relay de cada proceso (app/services/eventos_pedido.py) la
+-- lee por id y la entrega a sus suscriptores. El despachador líder borra los
+-- eventos con más de EVENTOS_DIAS_RETENCION días.
+--
+--     psql "$DATABASE_URL" -f migrations/003_eventos_pedido.sql
+
+CREATE TABLE IF NOT EXISTS evento_pedido (
+    id BIGSERIAL PRIMARY KEY,
+    codigo_pedido VARCHAR(50) NOT NULL,
+    tipo VARCHAR(30) NOT NULL,
+    estado VARCHAR(20),
+    conductor_codigo VARCHAR(100),
+    datos JSONB,
+    creado_en TIMESTAMP DEFAULT now()
+);
+
+-- Limpieza de eventos viejos
+CREATE INDEX IF NOT EXISTS ix_evento_pedido_creado_en ON evento_pedido (creado_en);
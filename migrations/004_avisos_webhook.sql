@@ -0,0 +1,9 @@
+-- Avisos a clientes con varias réplicas del bot (modo webhook)
+--
+-- Todas las réplicas reciben los eventos de pedidos; la que marca
+-- evento_pedido.avisado es la que le envía el mensaje al cliente
+-- (app/bot/notificaciones.py).
+--
+--     psql "$DATABASE_URL" -f migrations/004_avisos_webhook.sql
+
+ALTER TABLE evento_pedido ADD COLUMN IF NOT EXISTS avisado BOOLEAN NOT NULL DEFAULT false;
@@ -0,0 +1,10 @@
+-- file_id de Telegram de la imagen de cada producto
+--
+-- La primera vez que el bot envía la foto de un producto guarda el file_id
+-- que devuelve Telegram y las siguientes vistas lo reutilizan en vez de que
+-- Telegram vuelva a descargar img_url (app/bot/catalogo.py). Se borra al
+-- cambiar img_url (PUT /productos/{codigo}).
+--
+--     psql "$DATABASE_URL" -f migrations/005_file_id_productos.sql
+
+ALTER TABLE producto ADD COLUMN IF NOT EXISTS img_file_id VARCHAR(200);
@@ -0,0 +1,233 @@
+"""
+Benchmark de los índices de pedido y conductor
+
+Siembra pedidos de prueba (prefijo BENCH-, por defecto 1.000.000), y para
+cada consulta caliente mide el plan (EXPLAIN ANALYZE) y la latencia sin los
+índices secundarios de app/models.py y con ellos.
+
+Usar contra una BD de pruebas: borra y recrea esos índices.
+
+Uso:
+    python -m scripts.benchmark_indices --pedidos 1000000 --repeticiones 20
+    python -m scripts.benchmark_indices --limpiar
+"""
+import argparse
+import json
+import statistics
+import time
+from sqlalchemy import create_engine, text
+from app.config import get_settings
+from app.models import Conductor, Pedido
+
+
+PREFIJO = "BENCH-"
+
+# Consultas de los endpoints / del bot / de la asignación
+CONSULTAS = [
+    (
+        "Cola de asignación (lote)",
+        "SELECT * FROM pedido WHERE estado = 'SOLICITADO' AND conductor_codigo IS NULL "
+        "ORDER BY fecha LIMIT 200"
+    ),
+    (
+        "GET /asignacion/estado (conteo)",
+        "SELECT count(*) FROM pedido WHERE estado = 'SOLICITADO' AND conductor_codigo IS NULL"
+    ),
+    (
+        "Bot /mispedidos",
+        "SELECT * FROM pedido WHERE cliente_telefono = :cliente ORDER BY fecha DESC LIMIT 10"
+    ),
+    (
+        "GET /conductores/{codigo}/pedidos",
+        "SELECT * FROM pedido WHERE conductor_codigo = :conductor "
+        "AND estado NOT IN ('ENTREGADO', 'CANCELADO') ORDER BY fecha DESC"
+    ),
+    (
+        "GET /conductores/{codigo}/pedidos/pendientes",
+        "SELECT * FROM pedido WHERE conductor_codigo = :conductor AND estado = 'ASIGNADO' "
+        "ORDER BY fecha DESC"
+    ),
+    (
+        "GET /conductores/{codigo}/historial",
+        "SELECT * FROM pedido WHERE conductor_codigo = :conductor ORDER BY fecha DESC"
+    ),
+    (
+        "GET /pedidos/estado/EN_CAMINO",
+        "SELECT * FROM pedido WHERE estado = 'EN_CAMINO'"
+    ),
+    (
+        "Conductores disponibles en caja 5 km",
+        "SELECT * FROM conductor WHERE is_disponible AND latitud IS NOT NULL AND longitud IS NOT NULL "
+        "AND latitud BETWEEN -17.829 AND -17.739 AND longitud BETWEEN -63.229 AND -63.134"
+    ),
+    (
+        "GET /conductores/disponibles",
+        "SELECT * FROM conductor WHERE is_disponible"
+    ),
+]
+
+
+def _indices():
+    return [*Conductor.__table__.indexes, *Pedido.__table__.indexes]
+
+
+def sembrar(conn, n_pedidos: int, n_clientes: int, n_conductores: int):
+    """Inserta clientes, conductores y pedidos de prueba con generate_series"""
+    existentes = conn.scalar(text("SELECT count(*) FROM pedido WHERE codigo_pedido LIKE :p"), {"p": f"{PREFIJO}%"})
+    if existentes >= n_pedidos:
+        print(f"🌱 Ya hay {existentes} pedidos de prueba")
+        return
+
+    print(f"🌱 Sembrando {n_pedidos} pedidos...")
+    inicio = time.perf_counter()
+    conn.execute(text("""
+        INSERT INTO cliente_bot (telefono, chat_id, nombre)
+        SELECT 'B' || g, :p || g, 'Cliente ' || g FROM generate_series(1, :n) g
+        ON CONFLICT DO NOTHING
+    """), {"p": PREFIJO, "n": n_clientes})
+    conn.execute(text("""
+        INSERT INTO conductor (codigo_conductor, nombre, placa, tipo_vehiculo, latitud, longitud, is_disponible)
+        SELECT :p || g, 'Conductor ' || g, :p || g, 'MOTO',
+               -17.7838759 + (random() - 0.5) * 0.4,
+               -63.1817578 + (random() - 0.5) * 0.4,
+               random() < 0.3
+        FROM generate_series(1, :n) g
+        ON CONFLICT DO NOTHING
+    """), {"p": PREFIJO, "n": n_conductores})
+    conn.execute(text("""
+        INSERT INTO pedido (codigo_pedido, fecha, estado, total, cliente_telefono, conductor_codigo)
+        SELECT :p || g,
+               now() - random() * interval '365 days',
+               e.estado,
+               round((random() * 200)::numeric, 2),
+               'B' || (1 + floor(random() * :clientes)::int),
+               CASE WHEN e.estado = 'SOLICITADO' THEN NULL
+                    ELSE :p || (1 + floor(random() * :conductores)::int) END
+        FROM generate_series(:desde, :n) g
+        CROSS JOIN LATERAL (
+            SELECT CASE
+                WHEN r < 0.90 THEN 'ENTREGADO'
+                WHEN r < 0.93 THEN 'CANCELADO'
+                WHEN r < 0.94 THEN 'SOLICITADO'
+                WHEN r < 0.95 THEN 'ASIGNADO'
+                WHEN r < 0.96 THEN 'ACEPTADO'
+                WHEN r < 0.97 THEN 'EN_RESTAURANTE'
+                WHEN r < 0.98 THEN 'RECOGIO_PEDIDO'
+                ELSE 'EN_CAMINO'
+            END AS estado
+            FROM (SELECT random() + g * 0 AS r) x
+        ) e
+    """), {
+        "p": PREFIJO, "n": n_pedidos, "desde": existentes + 1,
+        "clientes": n_clientes, "conductores": n_conductores
+    })
+    conn.commit()
+    print(f"🌱 Listo en {time.perf_counter() - inicio:.1f}s")
+
+
+def limpiar(conn):
+    conn.execute(text("DELETE FROM pedido WHERE codigo_pedido LIKE :p"), {"p": f"{PREFIJO}%"})
+    conn.execute(text("DELETE FROM conductor WHERE codigo_conductor LIKE :p"), {"p": f"{PREFIJO}%"})
+    conn.execute(text("DELETE FROM cliente_bot WHERE chat_id LIKE :p"), {"p": f"{PREFIJO}%"})
+    conn.commit()
+    print("🧹 Datos de prueba eliminados")
+
+
+def _resumen_plan(nodo: dict) -> str:
+    """Nodos del plan en una línea, ej: 'Limit > Index Scan (ix_pedido_...)'"""
+    partes = []
+    while nodo:
+        descripcion = nodo["Node Type"]
+        if "Index Name" in nodo:
+            descripcion += f" ({nodo['Index Name']})"
+        partes.append(descripcion)
+        hijos = nodo.get("Plans") or []
+        nodo = hijos[0] if hijos else None
+    return " > ".join(partes)
+
+
+def medir(conn, sql: str, parametros: dict, repeticiones: int) -> dict:
+    """Plan (EXPLAIN ANALYZE) y latencias de la consulta"""
+    plan = conn.scalar(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), parametros)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]
+
+    for _ in range(2):
+        conn.execute(text(sql), parametros).all()
+
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        conn.execute(text(sql), parametros).all()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+
+    return {
+        "plan": _resumen_plan(plan["Plan"]),
+        "buffers": plan["Plan"].get("Shared Hit Blocks", 0) + plan["Plan"].get("Shared Read Blocks", 0),
+        "mediana_ms": statistics.median(tiempos),
+        "p95_ms": tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    }
+
+
+def medir_todas(conn, parametros: dict, repeticiones: int) -> dict:
+    conn.execute(text("ANALYZE conductor"))
+    conn.execute(text("ANALYZE pedido"))
+    conn.commit()
+    return {nombre: medir(conn, sql, parametros, repeticiones) for nombre, sql in CONSULTAS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de índices de pedido y conductor")
+    parser.add_argument("--pedidos", type=int, default=1_000_000)
+    parser.add_argument("--clientes", type=int, default=50_000)
+    parser.add_argument("--conductores", type=int, default=2_000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--limpiar", action="store_true", help="Solo eliminar los datos de prueba")
+    args = parser.parse_args()
+
+    engine = create_engine(get_settings().database_url)
+
+    with engine.connect() as conn:
+        if args.limpiar:
+            limpiar(conn)
+            return
+
+        sembrar(conn, args.pedidos, args.clientes, args.conductores)
+
+        # Cliente y conductor con más pedidos (el peor caso de cada endpoint)
+        parametros = {
+            "cliente": conn.scalar(text(
+                "SELECT cliente_telefono FROM pedido WHERE codigo_pedido LIKE :p "
+                "GROUP BY 1 ORDER BY count(*) DESC LIMIT 1"
+            ), {"p": f"{PREFIJO}%"}),
+            "conductor": conn.scalar(text(
+                "SELECT conductor_codigo FROM pedido WHERE codigo_pedido LIKE :p AND conductor_codigo IS NOT NULL "
+                "GROUP BY 1 ORDER BY count(*) DESC LIMIT 1"
+            ), {"p": f"{PREFIJO}%"})
+        }
+
+        print("📉 Midiendo sin índices...")
+        for indice in _indices():
+            indice.drop(conn, checkfirst=True)
+        conn.commit()
+        antes = medir_todas(conn, parametros, args.repeticiones)
+
+        print("📈 Creando índices y midiendo...")
+        for indice in _indices():
+            indice.create(conn, checkfirst=True)
+        conn.commit()
+        despues = medir_todas(conn, parametros, args.repeticiones)
+
+    for nombre, _ in CONSULTAS:
+        a, d = antes[nombre], despues[nombre]
+        mejora = a["mediana_ms"] / d["mediana_ms"] if d["mediana_ms"] else float("inf")
+        print(f"\n🔎 {nombre}")
+        print(f"   antes:   {a['mediana_ms']:9.2f} ms (p95 {a['p95_ms']:.2f}) {a['buffers']:>8} bloques  {a['plan']}")
+        print(f"   después: {d['mediana_ms']:9.2f} ms (p95 {d['p95_ms']:.2f}) {d['buffers']:>8} bloques  {d['plan']}")
+        print(f"   x{mejora:.1f}")
+
+
+if __name__ == "__main__":
+    main()
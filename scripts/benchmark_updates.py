@@ -0,0 +1,154 @@
+"""
+Benchmark del procesamiento de updates del bot
+
+Simula muchos chats tocando botones a la vez contra una Application real de
+python-telegram-bot (la Bot API de arranque es scripts/fake_telegram.py, en
+memoria) y mide la latencia de cada update: desde que llega hasta que su
+handler termina. Compara:
+
+    secuencial  procesador por defecto (un update a la vez)
+    sin_orden   SimpleUpdateProcessor(N): en paralelo, sin orden por chat
+    por_chat    ProcesadorPorChat(N) de app/bot/procesador.py
+
+Los handlers imitan al bot: la mayoría hace una consulta corta (5-30 ms) y
+responde (30-80 ms de red hasta Telegram); un porcentaje simula
+procesar_pago_qr (3 s). Cada
+handler agrega el número de update al "carrito" en user_data, con una
+espera en medio, para detectar updates del mismo chat que se pisan.
+
+Uso:
+    python -m scripts.benchmark_updates --chats 200 --updates 5 --procesadores por_chat,sin_orden
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uvicorn
+from starlette.applications import Starlette
+from starlette.routing import Route
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, SimpleUpdateProcessor
+from app.bot.procesador import ProcesadorPorChat
+from scripts.fake_telegram import PRIMER_CHAT, TelegramFalso, _percentil
+
+
+PUERTO_TELEGRAM = 8082
+
+
+def crear_procesador(nombre: str, trabajadores: int):
+    if nombre == "secuencial":
+        return SimpleUpdateProcessor(1)
+    if nombre == "sin_orden":
+        return SimpleUpdateProcessor(trabajadores)
+    return ProcesadorPorChat(trabajadores)
+
+
+async def medir(nombre: str, telegram: TelegramFalso, args) -> dict:
+    application = (
+        Application.builder()
+        .token("1:benchmark")
+        .base_url(f"http://127.0.0.1:{PUERTO_TELEGRAM}/bot")
+        .concurrent_updates(crear_procesador(nombre, args.trabajadores))
+        .build()
+    )
+    llegada: dict[int, float] = {}
+    latencias = []
+    pisados = 0
+
+    async def handler(update: Update, context):
+        nonlocal pisados
+        query = update.callback_query
+        carrito = context.user_data.setdefault("carrito", [])
+        # Leer-modificar-escribir con una espera en medio (como el handler real
+        # que consulta la BD antes de guardar el carrito)
+        copia = list(carrito)
+        if query.data == "pago_qr":
+            await asyncio.sleep(3)
+        else:
+            await asyncio.sleep(random.uniform(0.005, 0.03))
+        copia.append(int(query.id))
+        if context.user_data["carrito"] is not carrito:
+            # Otro update del chat guardó el carrito mientras tanto: se pierde
+            pisados += 1
+        context.user_data["carrito"] = copia
+        # Respuesta al usuario (ida y vuelta a Telegram)
+        await asyncio.sleep(random.uniform(0.03, 0.08))
+        latencias.append((time.perf_counter() - llegada[update.update_id]) * 1000)
+
+    application.add_handler(CallbackQueryHandler(handler))
+    await application.initialize()
+    await application.start()
+
+    async def chat(i: int):
+        for n in range(args.updates):
+            accion = "pago_qr" if random.random() < args.pagos else "menu_ver"
+            update = telegram.crear_update(PRIMER_CHAT + i, accion)
+            update["callback_query"]["id"] = str(n)
+            objeto = Update.de_json(update, application.bot)
+            llegada[objeto.update_id] = time.perf_counter()
+            await application.update_queue.put(objeto)
+            await asyncio.sleep(random.uniform(0, args.pausa))
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(chat(i) for i in range(args.chats)))
+    total = args.chats * args.updates
+    while len(latencias) < total:
+        await asyncio.sleep(0.05)
+    duracion = time.perf_counter() - inicio
+
+    # Orden por chat: el carrito debe tener los updates en el orden enviado
+    desordenados = sum(
+        1 for datos in application.user_data.values()
+        if datos.get("carrito") != sorted(datos.get("carrito", []))
+    )
+    await application.stop()
+    await application.shutdown()
+    return {
+        "duracion": duracion,
+        "latencias": latencias,
+        "pisados": pisados,
+        "desordenados": desordenados
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de procesamiento concurrente de updates")
+    parser.add_argument("--chats", type=int, default=200, help="Chats simultáneos")
+    parser.add_argument("--updates", type=int, default=5, help="Updates por chat")
+    parser.add_argument("--trabajadores", type=int, default=256, help="Updates en paralelo (BOT_UPDATES_CONCURRENTES)")
+    parser.add_argument("--pagos", type=float, default=0.05, help="Fracción de updates que tardan 3 s (pago QR)")
+    parser.add_argument("--pausa", type=float, default=0.2, help="Pausa máxima entre toques de un chat (s)")
+    parser.add_argument("--procesadores", default="por_chat,sin_orden",
+                        help="secuencial, sin_orden y/o por_chat, separados por coma")
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    telegram = TelegramFalso()
+    servidor = uvicorn.Server(uvicorn.Config(
+        Starlette(routes=[Route("/bot{token}/{metodo}", telegram.bot_api, methods=["GET", "POST"])]),
+        host="127.0.0.1", port=PUERTO_TELEGRAM, log_level="warning"
+    ))
+    tarea_servidor = asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.05)
+
+    total = args.chats * args.updates
+    print(f"📊 {total} updates de {args.chats} chats · {args.trabajadores} trabajadores · {args.pagos:.0%} pagos QR\n")
+    for nombre in args.procesadores.split(","):
+        random.seed(args.semilla)
+        r = await medir(nombre.strip(), telegram, args)
+        latencias = r["latencias"]
+        print(
+            f"   {nombre:<10} p50 {statistics.median(latencias):>7.0f} ms · "
+            f"p95 {_percentil(latencias, 0.95):>7.0f} ms · p99 {_percentil(latencias, 0.99):>7.0f} ms · "
+            f"{total / r['duracion']:>5.0f} updates/s · "
+            f"carritos pisados {r['pisados']} · chats desordenados {r['desordenados']}"
+        )
+
+    servidor.should_exit = True
+    await tarea_servidor
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
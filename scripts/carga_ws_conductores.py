@@ -0,0 +1,125 @@
+"""
+Prueba de carga del stream WebSocket de conductores
+
+Simula miles de conductores conectados a /conductores/{codigo}/stream que
+envían su posición periódicamente, y reporta conexiones, tiempos de conexión,
+frames enviados por segundo y pushes recibidos.
+
+Los conductores de prueba (prefijo CARGA-) se crean por la API si no existen.
+Para muchos sockets puede hacer falta subir el límite de archivos abiertos
+(ulimit -n) tanto del cliente como del servidor.
+
+Uso:
+    python -m scripts.carga_ws_conductores --url http://localhost:8000 --conductores 2000 --duracion 60
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import httpx
+import websockets
+
+
+PREFIJO = "CARGA-"
+RESTAURANTE_LAT = -17.7838759
+RESTAURANTE_LNG = -63.1817578
+
+
+async def crear_conductores(url: str, n: int):
+    """Crea por la API los conductores que falten"""
+    async with httpx.AsyncClient(base_url=url, timeout=30) as cliente:
+        existentes = {c["codigo_conductor"] for c in (await cliente.get("/conductores/")).json()}
+        faltantes = [i for i in range(n) if f"{PREFIJO}{i:05d}" not in existentes]
+        semaforo = asyncio.Semaphore(50)
+
+        async def crear(i: int):
+            async with semaforo:
+                await cliente.post("/conductores/", json={
+                    "codigo_conductor": f"{PREFIJO}{i:05d}",
+                    "nombre": f"Carga {i}",
+                    "placa": f"{PREFIJO}{i:05d}",
+                    "tipo_vehiculo": "MOTO",
+                    "latitud": RESTAURANTE_LAT,
+                    "longitud": RESTAURANTE_LNG
+                })
+
+        await asyncio.gather(*(crear(i) for i in faltantes))
+        if faltantes:
+            print(f"🌱 {len(faltantes)} conductores de prueba creados")
+
+
+async def conductor(url_ws: str, indice: int, intervalo: float, fin: float, metricas: dict):
+    """Un conductor simulado: se conecta y envía [lat, lng, ts] cada `intervalo` s"""
+    codigo = f"{PREFIJO}{indice:05d}"
+    rnd = random.Random(indice)
+    lat = RESTAURANTE_LAT + rnd.uniform(-0.05, 0.05)
+    lng = RESTAURANTE_LNG + rnd.uniform(-0.05, 0.05)
+
+    inicio = time.perf_counter()
+    try:
+        async with websockets.connect(f"{url_ws}/conductores/{codigo}/stream", max_queue=None) as ws:
+            metricas["conexion_ms"].append((time.perf_counter() - inicio) * 1000)
+
+            async def recibir():
+                async for mensaje in ws:
+                    tipo = json.loads(mensaje).get("tipo")
+                    metricas["recibidos"][tipo] = metricas["recibidos"].get(tipo, 0) + 1
+
+            receptor = asyncio.create_task(recibir())
+            # Desfasar a los conductores para no enviar todos a la vez
+            await asyncio.sleep(rnd.uniform(0, intervalo))
+            while time.monotonic() < fin:
+                lat += rnd.uniform(-0.0003, 0.0003)
+                lng += rnd.uniform(-0.0003, 0.0003)
+                await ws.send(json.dumps([round(lat, 7), round(lng, 7), int(time.time() * 1000)]))
+                metricas["frames"] += 1
+                await asyncio.sleep(intervalo)
+            receptor.cancel()
+    except Exception as e:
+        metricas["errores"] += 1
+        if metricas["errores"] <= 5:
+            print(f"❌ {codigo}: {e}")
+
+
+async def main_async(args):
+    await crear_conductores(args.url, args.conductores)
+
+    url_ws = args.url.replace("http://", "ws://").replace("https://", "wss://")
+    metricas = {"conexion_ms": [], "frames": 0, "errores": 0, "recibidos": {}}
+    fin = time.monotonic() + args.duracion
+
+    print(f"🚀 {args.conductores} conductores, un frame cada {args.intervalo}s durante {args.duracion}s")
+    tareas = []
+    for i in range(args.conductores):
+        tareas.append(asyncio.create_task(conductor(url_ws, i, args.intervalo, fin, metricas)))
+        # Rampa de conexiones
+        if args.rampa and i % args.rampa == args.rampa - 1:
+            await asyncio.sleep(0.1)
+
+    inicio = time.monotonic()
+    await asyncio.gather(*tareas)
+    duracion = time.monotonic() - inicio
+
+    conexiones = sorted(metricas["conexion_ms"])
+    print(f"\n🔌 Conexiones: {len(conexiones)} OK, {metricas['errores']} con error")
+    if conexiones:
+        p99 = conexiones[min(len(conexiones) - 1, int(len(conexiones) * 0.99))]
+        print(f"⏱️ Conexión: mediana {statistics.median(conexiones):.1f} ms, p99 {p99:.1f} ms")
+    print(f"📡 Frames enviados: {metricas['frames']} ({metricas['frames'] / duracion:.0f}/s)")
+    print(f"📥 Mensajes recibidos: {metricas['recibidos']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga del stream WebSocket de conductores")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--conductores", type=int, default=2000)
+    parser.add_argument("--intervalo", type=float, default=3.0, help="Segundos entre frames de cada conductor")
+    parser.add_argument("--duracion", type=float, default=60.0)
+    parser.add_argument("--rampa", type=int, default=200, help="Conexiones abiertas por cada 100 ms (0 = todas juntas)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
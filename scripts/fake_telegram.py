@@ -0,0 +1,247 @@
+"""
+Telegram falso para probar el bot en modo webhook sin salir de la máquina
+
+Levanta un servidor que imita la Bot API (responde getMe, setWebhook,
+sendMessage, editMessage*, answerCallbackQuery...) y, cuando la API del bot
+registra su webhook, le envía updates de muchos chats a la vez. Reporta la
+latencia del POST al webhook, la latencia hasta la primera respuesta del bot
+a cada update y los 503 (cola llena).
+
+Cada chat simulado manda sus updates de a uno (espera la respuesta del bot
+antes del siguiente), como una persona.
+
+Uso:
+    # 1) Telegram falso (queda esperando el setWebhook)
+    python -m scripts.fake_telegram --chats 200 --updates 5
+
+    # 2) La API apuntando al Telegram falso
+    TELEGRAM_MODO=webhook TELEGRAM_API_URL=http://localhost:8081/bot \\
+    TELEGRAM_WEBHOOK_URL=http://localhost:8000/telegram/webhook \\
+    python -m app api
+"""
+import argparse
+import asyncio
+import email.parser
+import itertools
+import json
+import random
+import statistics
+import time
+from urllib.parse import parse_qs
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+BOT_ID = 7000000001
+PRIMER_CHAT = 900000000
+
+# Updates que manda cada chat (se eligen al azar)
+ACCIONES = ("/start", "/menu", "menu_ver", "info_horarios")
+
+
+def _percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class TelegramFalso:
+    """Bot API en memoria y generador de updates"""
+
+    def __init__(self):
+        self._ids_mensaje = itertools.count(1)
+        self._ids_update = itertools.count(1)
+        self._ids_archivo = itertools.count(1)
+        self.webhook: dict | None = None
+        self.webhook_registrado = asyncio.Event()
+        self.llamadas: dict[str, int] = {}
+        # chat_id -> futuros de los updates que esperan respuesta (en orden)
+        self._esperando: dict[int, list] = {}
+
+    async def bot_api(self, request: Request) -> JSONResponse:
+        metodo = request.path_params["metodo"]
+        parametros = await self._parametros(request)
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+
+        chat_id = parametros.get("chat_id")
+        if chat_id is not None:
+            self._respondio(int(chat_id))
+
+        return JSONResponse({"ok": True, "result": self._resultado(metodo, parametros)})
+
+    def _resultado(self, metodo: str, parametros: dict):
+        if metodo == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "SpeedyFake", "username": "speedy_fake_bot"}
+        if metodo == "setWebhook":
+            self.webhook = parametros
+            self.webhook_registrado.set()
+            return True
+        if metodo == "getWebhookInfo":
+            return {"url": (self.webhook or {}).get("url", ""), "has_custom_certificate": False, "pending_update_count": 0}
+        if metodo == "getUpdates":
+            return []
+        if metodo.startswith(("send", "edit", "stop")) and "chat_id" in parametros:
+            mensaje = self._mensaje(int(parametros["chat_id"]), parametros.get("text"))
+            if "message_id" in parametros:
+                mensaje["message_id"] = int(parametros["message_id"])
+            if metodo == "sendPhoto" or metodo == "editMessageMedia":
+                n = next(self._ids_archivo)
+                mensaje["photo"] = [{"file_id": f"FAKE-FOTO-{n}", "file_unique_id": f"U{n}", "width": 640, "height": 480}]
+            if "latitude" in parametros:
+                mensaje["location"] = {"latitude": float(parametros["latitude"]), "longitude": float(parametros["longitude"])}
+            return mensaje
+        return True
+
+    def _mensaje(self, chat_id: int, texto: str | None = None, de_usuario: bool = False) -> dict:
+        mensaje = {
+            "message_id": next(self._ids_mensaje),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"Cliente {chat_id}"},
+            "from": self._usuario(chat_id) if de_usuario else {"id": BOT_ID, "is_bot": True, "first_name": "SpeedyFake"}
+        }
+        if texto is not None:
+            mensaje["text"] = texto
+        return mensaje
+
+    @staticmethod
+    def _usuario(chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": f"Cliente {chat_id}"}
+
+    @staticmethod
+    async def _parametros(request: Request) -> dict:
+        """Form urlencoded o multipart (cuando el bot sube archivos) -> dict"""
+        cuerpo = await request.body()
+        tipo = request.headers.get("content-type", "")
+        if tipo.startswith("multipart/form-data"):
+            mensaje = email.parser.BytesParser().parsebytes(
+                f"Content-Type: {tipo}\r\n\r\n".encode() + cuerpo
+            )
+            parametros = {
+                parte.get_param("name", header="content-disposition"): parte.get_payload(decode=True).decode(errors="replace")
+                for parte in mensaje.get_payload()
+                if parte.get_filename() is None
+            }
+        elif tipo.startswith("application/json"):
+            parametros = json.loads(cuerpo or b"{}")
+        else:
+            parametros = {clave: valores[0] for clave, valores in parse_qs(cuerpo.decode()).items()}
+        return parametros
+
+    def _respondio(self, chat_id: int):
+        futuros = self._esperando.get(chat_id)
+        if futuros:
+            futuro = futuros.pop(0)
+            if not futuro.done():
+                futuro.set_result(time.perf_counter())
+
+    def crear_update(self, chat_id: int, accion: str) -> dict:
+        if accion.startswith("/"):
+            mensaje = self._mensaje(chat_id, accion, de_usuario=True)
+            mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(accion)}]
+            return {"update_id": next(self._ids_update), "message": mensaje}
+        return {
+            "update_id": next(self._ids_update),
+            "callback_query": {
+                "id": str(next(self._ids_update)),
+                "from": self._usuario(chat_id),
+                "chat_instance": str(chat_id),
+                "data": accion,
+                "message": self._mensaje(chat_id, "🍔 Menú")
+            }
+        }
+
+    async def simular_chat(self, cliente: httpx.AsyncClient, chat_id: int, updates: int,
+                           pausa: float, resultados: dict):
+        headers = {}
+        if self.webhook.get("secret_token"):
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook["secret_token"]
+        loop = asyncio.get_running_loop()
+
+        for _ in range(updates):
+            respuesta = loop.create_future()
+            self._esperando.setdefault(chat_id, []).append(respuesta)
+            inicio = time.perf_counter()
+            try:
+                r = await cliente.post(self.webhook["url"], json=self.crear_update(chat_id, random.choice(ACCIONES)),
+                                       headers=headers)
+            except httpx.HTTPError:
+                resultados["errores"] += 1
+                self._esperando[chat_id].remove(respuesta)
+                continue
+            resultados["post"].append((time.perf_counter() - inicio) * 1000)
+            if r.status_code != 200:
+                resultados["rechazados" if r.status_code == 503 else "errores"] += 1
+                self._esperando[chat_id].remove(respuesta)
+                continue
+            try:
+                fin = await asyncio.wait_for(respuesta, 30)
+                resultados["respuesta"].append((fin - inicio) * 1000)
+            except asyncio.TimeoutError:
+                resultados["sin_respuesta"] += 1
+                if respuesta in self._esperando.get(chat_id, []):
+                    self._esperando[chat_id].remove(respuesta)
+            await asyncio.sleep(pausa * random.random())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Telegram falso + carga sobre el webhook del bot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8081)
+    parser.add_argument("--chats", type=int, default=200, help="Chats simultáneos")
+    parser.add_argument("--updates", type=int, default=5, help="Updates por chat")
+    parser.add_argument("--pausa", type=float, default=0.5, help="Pausa máxima entre updates de un chat (s)")
+    parser.add_argument("--solo-servidor", action="store_true", help="Solo imitar la Bot API, sin generar carga")
+    args = parser.parse_args()
+
+    telegram = TelegramFalso()
+    servidor = uvicorn.Server(uvicorn.Config(
+        Starlette(routes=[Route("/bot{token}/{metodo}", telegram.bot_api, methods=["GET", "POST"])]),
+        host=args.host, port=args.puerto, log_level="warning"
+    ))
+    tarea_servidor = asyncio.create_task(servidor.serve())
+
+    print(f"📡 Telegram falso en http://{args.host}:{args.puerto}/bot (TELEGRAM_API_URL)")
+    if args.solo_servidor:
+        await tarea_servidor
+        return
+
+    print("⏳ Esperando que la API registre su webhook (setWebhook)...")
+    await telegram.webhook_registrado.wait()
+    print(f"🔗 Webhook: {telegram.webhook['url']}")
+
+    resultados = {"post": [], "respuesta": [], "rechazados": 0, "errores": 0, "sin_respuesta": 0}
+    limites = httpx.Limits(max_connections=args.chats, max_keepalive_connections=args.chats)
+    inicio = time.perf_counter()
+    async with httpx.AsyncClient(timeout=30, limits=limites) as cliente:
+        await asyncio.gather(*(
+            telegram.simular_chat(cliente, PRIMER_CHAT + i, args.updates, args.pausa, resultados)
+            for i in range(args.chats)
+        ))
+    duracion = time.perf_counter() - inicio
+
+    total = args.chats * args.updates
+    print(f"\n📊 {total} updates de {args.chats} chats en {duracion:.1f} s ({total / duracion:.0f} updates/s)")
+    for nombre, clave in (("POST al webhook", "post"), ("Update -> primera respuesta", "respuesta")):
+        valores = resultados[clave]
+        if valores:
+            print(
+                f"   {nombre}: p50 {statistics.median(valores):.0f} ms · "
+                f"p95 {_percentil(valores, 0.95):.0f} ms · p99 {_percentil(valores, 0.99):.0f} ms"
+            )
+    print(
+        f"   Rechazados (503): {resultados['rechazados']} · Errores: {resultados['errores']} · "
+        f"Sin respuesta: {resultados['sin_respuesta']}"
+    )
+    print(f"   Llamadas a la Bot API: {dict(sorted(telegram.llamadas.items()))}")
+
+    servidor.should_exit = True
+    await tarea_servidor
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
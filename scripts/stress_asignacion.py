@@ -0,0 +1,235 @@
+"""
+Prueba de estrés de la asignación concurrente de conductores
+
+Crea conductores y pedidos de prueba (prefijo STRESS-), lanza varios procesos
+con varios workers cada uno que compiten asignando con asignar_pedidos_en_lote
+y asignar_conductor_a_pedido, y verifica al final que:
+- ningún conductor quedó asignado a más de un pedido
+- todo conductor con pedido quedó marcado como no disponible
+- todo conductor no disponible tiene su pedido (no se reasignó un pedido ya asignado)
+- se asignaron min(conductores, pedidos) pedidos
+
+Parte de las asignaciones individuales primero lee sin bloqueo el pedido y los
+conductores disponibles en la misma sesión (como el bot, que hace commit del
+pedido y asigna con la sesión abierta): la relectura con FOR UPDATE tiene que
+ver el estado actual de esas filas y no el que quedó en la sesión.
+
+Usar contra una BD de pruebas: los barridos en lote también toman los pedidos
+SOLICITADOS que no sean de la prueba.
+
+Uso:
+    python -m scripts.stress_asignacion --conductores 300 --pedidos 500 --procesos 4 --workers 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import sys
+import time
+from sqlalchemy import delete, func, select
+from app.database import AsyncSessionLocal, async_engine
+from app.models import Conductor, Pedido
+from app.services.conductor_service import (
+    RESTAURANTE_LAT,
+    RESTAURANTE_LNG,
+    asignar_conductor_a_pedido,
+    asignar_pedidos_en_lote,
+    obtener_conductores_disponibles
+)
+from app.services.indice_conductores import cargar_indice_desde_bd
+
+
+PREFIJO = "STRESS-"
+
+
+async def limpiar():
+    """Elimina los pedidos y conductores de la prueba"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Pedido).where(Pedido.codigo_pedido.like(f"{PREFIJO}%")))
+        await db.execute(delete(Conductor).where(Conductor.codigo_conductor.like(f"{PREFIJO}%")))
+        await db.commit()
+
+
+async def sembrar(n_conductores: int, n_pedidos: int):
+    """Crea conductores disponibles alrededor del restaurante y pedidos SOLICITADOS"""
+    rnd = random.Random(42)
+    async with AsyncSessionLocal() as db:
+        db.add_all([
+            Conductor(
+                codigo_conductor=f"{PREFIJO}C{i:05d}",
+                nombre=f"Conductor {i}",
+                placa=f"{PREFIJO}{i:05d}",
+                tipo_vehiculo="MOTO",
+                latitud=RESTAURANTE_LAT + rnd.uniform(-0.05, 0.05),
+                longitud=RESTAURANTE_LNG + rnd.uniform(-0.05, 0.05),
+                is_disponible=True
+            )
+            for i in range(n_conductores)
+        ])
+        db.add_all([
+            Pedido(
+                codigo_pedido=f"{PREFIJO}P{i:05d}",
+                estado="SOLICITADO",
+                total=10,
+                latitud_origen=RESTAURANTE_LAT,
+                longitud_origen=RESTAURANTE_LNG
+            )
+            for i in range(n_pedidos)
+        ])
+        await db.commit()
+
+
+async def _worker(n_pedidos: int, semilla: int, duracion: float, lote: float) -> dict:
+    """Alterna asignaciones individuales (pedido al azar), con o sin precarga, y barridos en lote"""
+    rnd = random.Random(semilla)
+    conteo = {"individual": 0, "precargado": 0, "lote": 0, "errores": 0}
+    fin = time.monotonic() + duracion
+
+    while time.monotonic() < fin:
+        async with AsyncSessionLocal() as db:
+            try:
+                sorteo = rnd.random()
+                if sorteo >= lote:
+                    codigo = f"{PREFIJO}P{rnd.randrange(n_pedidos):05d}"
+                    clave = "individual"
+                    if sorteo >= (1 + lote) / 2:
+                        # Filas en la sesión (referenciadas, como las tiene el
+                        # handler) antes del bloqueo; mientras tanto otros
+                        # workers las cambian
+                        precargadas = [
+                            await db.get(Pedido, codigo),
+                            *await obtener_conductores_disponibles(db, RESTAURANTE_LAT, RESTAURANTE_LNG)
+                        ]
+                        await db.commit()
+                        await asyncio.sleep(rnd.uniform(0, 0.05))
+                        clave = "precargado"
+                    if (await asignar_conductor_a_pedido(db, codigo))["exito"]:
+                        conteo[clave] += 1
+                else:
+                    resultado = await asignar_pedidos_en_lote(
+                        db, rnd.choice(("optima", "voraz"))
+                    )
+                    conteo["lote"] += len(resultado["asignaciones"])
+            except Exception as e:
+                conteo["errores"] += 1
+                print(f"❌ Worker {semilla}: {e}", file=sys.stderr)
+    return conteo
+
+
+async def _proceso(n_pedidos: int, workers: int, semilla: int, duracion: float, indice: bool,
+                   lote: float) -> dict:
+    if indice:
+        async with AsyncSessionLocal() as db:
+            await cargar_indice_desde_bd(db)
+
+    resultados = await asyncio.gather(*(
+        _worker(n_pedidos, semilla * 1000 + w, duracion, lote) for w in range(workers)
+    ))
+    await async_engine.dispose()
+
+    total = {"individual": 0, "precargado": 0, "lote": 0, "errores": 0}
+    for conteo in resultados:
+        for clave, valor in conteo.items():
+            total[clave] += valor
+    return total
+
+
+def _ejecutar_proceso(args: tuple) -> dict:
+    return asyncio.run(_proceso(*args))
+
+
+async def verificar(n_conductores: int, n_pedidos: int) -> bool:
+    """Comprueba los invariantes de la asignación; devuelve True si se cumplen"""
+    async with AsyncSessionLocal() as db:
+        duplicados = (await db.execute(
+            select(Pedido.conductor_codigo, func.count())
+            .where(
+                Pedido.conductor_codigo.like(f"{PREFIJO}%"),
+                Pedido.estado == "ASIGNADO"
+            )
+            .group_by(Pedido.conductor_codigo)
+            .having(func.count() > 1)
+        )).all()
+
+        asignados = await db.scalar(
+            select(func.count()).select_from(Pedido).where(
+                Pedido.codigo_pedido.like(f"{PREFIJO}%"),
+                Pedido.estado == "ASIGNADO"
+            )
+        )
+
+        inconsistentes = await db.scalar(
+            select(func.count()).select_from(Pedido).join(Conductor).where(
+                Pedido.codigo_pedido.like(f"{PREFIJO}%"),
+                Pedido.estado == "ASIGNADO",
+                Conductor.is_disponible == True
+            )
+        )
+
+        sin_pedido = await db.scalar(
+            select(func.count()).select_from(Conductor).where(
+                Conductor.codigo_conductor.like(f"{PREFIJO}%"),
+                Conductor.is_disponible == False,
+                ~select(Pedido.codigo_pedido).where(
+                    Pedido.conductor_codigo == Conductor.codigo_conductor
+                ).exists()
+            )
+        )
+
+    esperados = min(n_conductores, n_pedidos)
+    print(f"📦 Pedidos asignados: {asignados} (esperados {esperados})")
+    print(f"🔁 Conductores con más de un pedido: {len(duplicados)}")
+    print(f"⚠️ Pedidos asignados a conductores disponibles: {inconsistentes}")
+    print(f"👻 Conductores no disponibles sin pedido: {sin_pedido}")
+    for codigo, cantidad in duplicados[:10]:
+        print(f"   {codigo}: {cantidad} pedidos")
+
+    return not duplicados and not inconsistentes and not sin_pedido and asignados == esperados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de estrés de asignación concurrente")
+    parser.add_argument("--conductores", type=int, default=300)
+    parser.add_argument("--pedidos", type=int, default=500)
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8, help="Workers por proceso")
+    parser.add_argument("--duracion", type=float, default=20.0, help="Segundos de carga")
+    parser.add_argument("--lote", type=float, default=0.3,
+                        help="Fracción de barridos en lote; el resto son individuales (la mitad con precarga)")
+    parser.add_argument("--indice", action="store_true", help="Usar el índice en memoria en cada proceso")
+    args = parser.parse_args()
+
+    async def preparar():
+        await limpiar()
+        await sembrar(args.conductores, args.pedidos)
+        await async_engine.dispose()
+
+    asyncio.run(preparar())
+    print(f"🚀 {args.procesos} procesos x {args.workers} workers durante {args.duracion}s")
+
+    tareas = [
+        (args.pedidos, args.workers, p + 1, args.duracion, args.indice, args.lote)
+        for p in range(args.procesos)
+    ]
+    inicio = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(args.procesos) as pool:
+        resultados = pool.map(_ejecutar_proceso, tareas)
+    print(f"⏱️ {time.perf_counter() - inicio:.1f}s")
+
+    for p, conteo in enumerate(resultados, start=1):
+        print(f"   Proceso {p}: {conteo}")
+
+    async def cerrar() -> bool:
+        try:
+            return await verificar(args.conductores, args.pedidos)
+        finally:
+            await limpiar()
+            await async_engine.dispose()
+
+    ok = asyncio.run(cerrar())
+    print("✅ Sin asignaciones dobles" if ok else "❌ Invariantes violados")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()